@@ -1,136 +1,1062 @@
+import re
+import json
+import time
+import asyncio
+import threading
+
+import aiohttp
 import requests
 
+from config import (LLM_API_URL, LLM_POOL_SIZE, LLM_KEEPALIVE_TIMEOUT, LLM_ATTEMPT_TIMEOUT, LLM_MAX_RETRIES,
+                    LLM_HEDGE_ENABLED, LLM_RATE_LIMIT_ENABLED)
+from metrics import (LLM_REQUEST_SECONDS, LLM_ATTEMPTS_TOTAL, LLM_HEDGES_TOTAL, LLM_DOWNGRADES_TOTAL, LLM_LIMITER_STATE,
+                     registry, record_usage, log_event)
+from resilience import (LLMError, LLMTimeoutError, LLMConnectionError, LLMRateLimitError, LLMServerError,
+                        LLMRequestError, LLMEmptyResponseError, LLMCircuitOpenError, CircuitBreaker, LatencyTracker,
+                        ModelRouter, AdaptiveRateLimiter, parse_retry_after, backoff_delay)
+from scheduler import PRIORITY_APPLICATION, PRIORITY_DEFAULT, PRIORITY_LOW
+
+# Некоторые провайдеры R1 возвращают рассуждения прямо в тексте ответа
+THINK_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL)
+
+# Приоритет задач в общем ограничителе запросов: данные заявки раньше ответов RAG,
+# ответы RAG раньше классификации спама
+TASK_PRIORITY = {
+    "collect_info": PRIORITY_APPLICATION,
+    "ask": PRIORITY_DEFAULT,
+    "ask_stream": PRIORITY_DEFAULT,
+    "classify": PRIORITY_LOW,
+    "classify_and_collect": PRIORITY_LOW,
+}
+
+
+def build_classify_prompt(text):
+    """
+    Формирует промпт для классификации сообщения
+
+    Args:
+        text (str): входной текст пользователя
+
+    Returns:
+        str: промпт для модели
+    """
+    return (
+        f"Проанализируй следующий текст и классифицируй его по одной из меток: заявка, вопрос или спам.\n"
+        f"ВАЖНО, что эти сообщения адресуются конкретной компании и нерелевантные сообщения должны уходить "
+        f"в спам\n"
+        f"К вопросам должны относиться только те сообщения, где пользователь хочет что-то узнать по тематике "
+        f"компании\n"
+        f"К заявкам относятся сообщения, где видно, что пользователь хочет что-то купить, как-то проинвестировать "
+        f"или принести иную прбыль компании\n"
+        f"Текст:\n\"\"\"\n{text}\n\"\"\"\n"
+        "Ответь только одним словом — одной меткой, без пояснений и дополнительного текста."
+    )
+
+
+def build_collect_info_prompt(text):
+    """
+    Формирует промпт для извлечения информации из заявки
+
+    Args:
+        text (str): входной текст пользователя
+
+    Returns:
+        str: промпт для модели
+    """
+    return (
+        f"Следующий текст является заявкой, которая потенциально должна принести компании прибыль\n"
+        f"Проанализируй текст и пойми какие данные из списка присутствуют в тексте\n"
+        f"Список: ФИО, продукт или товар, который автор сообщения хочет приобрести, контактные данные\n"
+        f"Текст:\n\"\"\"\n{text}\n\"\"\"\n"
+        f"Ответь JSON в формате {{\"contact_info\": контактные данные, \"fio\": фио клиента, "
+        f"\"product\": продукт, который хотят приобрести}}."
+        f"Никакий других данных в ответе быть не должно, только JSON, который можно распарсить\n"
+        f"Если каких-то данных нет в тексте, то на их месте пришли null\n"
+        f"Дополнительно проверь данные на валидность, чтобы номер соответствовал реальному номеру, "
+        f"ФИО было адекватным и не придуманным, данные о продукте заноси в именительном падеже "
+        f"с указанием количества, если оно присутствует"
+    )
+
+
+def build_classify_and_collect_prompt(text):
+    """
+    Формирует промпт, в котором модель за один запрос классифицирует сообщение
+    и, если это заявка, извлекает из него данные клиента
+
+    Args:
+        text (str): входной текст пользователя
+
+    Returns:
+        str: промпт для модели
+    """
+    return (
+        f"Проанализируй следующий текст и классифицируй его по одной из меток: заявка, вопрос или спам.\n"
+        f"ВАЖНО, что эти сообщения адресуются конкретной компании и нерелевантные сообщения должны уходить "
+        f"в спам\n"
+        f"К вопросам должны относиться только те сообщения, где пользователь хочет что-то узнать по тематике "
+        f"компании\n"
+        f"К заявкам относятся сообщения, где видно, что пользователь хочет что-то купить, как-то проинвестировать "
+        f"или принести иную прбыль компании\n"
+        f"Если текст является заявкой, дополнительно найди в нем ФИО, продукт или товар, который автор "
+        f"сообщения хочет приобрести, и контактные данные\n"
+        f"Текст:\n\"\"\"\n{text}\n\"\"\"\n"
+        f"Ответь JSON в формате {{\"label\": метка, \"contact_info\": контактные данные, \"fio\": фио клиента, "
+        f"\"product\": продукт, который хотят приобрести}}.\n"
+        f"Никакий других данных в ответе быть не должно, только JSON, который можно распарсить\n"
+        f"Если каких-то данных нет в тексте или текст не является заявкой, то на их месте пришли null\n"
+        f"Дополнительно проверь данные на валидность, чтобы номер соответствовал реальному номеру, "
+        f"ФИО было адекватным и не придуманным, данные о продукте заноси в именительном падеже "
+        f"с указанием количества, если оно присутствует"
+    )
+
+
+FIELD_DESCRIPTIONS = {
+    "contact_info": "контактные данные клиента: телефон, email или имя пользователя Telegram",
+    "fio": "ФИО клиента, как оно указано в тексте",
+    "product": "продукт, который хотят приобрести, в именительном падеже с количеством, если оно указано",
+}
+
+
+def build_collect_fields_prompt(text, fields):
+    """
+    Формирует промпт для извлечения из заявки только недостающих полей
+
+    Args:
+        text (str): входной текст пользователя
+        fields (list): названия полей из FIELD_DESCRIPTIONS
+
+    Returns:
+        str: промпт для модели
+    """
+    described = "\n".join(f"- {field}: {FIELD_DESCRIPTIONS[field]}" for field in fields)
+    return (
+        f"Следующий текст является заявкой, которая потенциально должна принести компании прибыль\n"
+        f"Найди в тексте только эти данные:\n{described}\n"
+        f"Текст:\n\"\"\"\n{text}\n\"\"\"\n"
+        f"Ответь JSON с этими полями. Если каких-то данных нет в тексте, верни для них null, ничего не придумывай"
+    )
+
+
+def lead_schema(fields) -> dict:
+    """
+    Формат ответа OpenRouter (строгая JSON-схема) для извлечения полей заявки
+
+    Args:
+        fields (list): названия полей из FIELD_DESCRIPTIONS
+
+    Returns:
+        dict: значение параметра response_format
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "lead",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {field: {"type": ["string", "null"], "description": FIELD_DESCRIPTIONS[field]}
+                               for field in fields},
+                "required": list(fields),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def status_error(status: int, text: str, model: str, retry_after=None) -> LLMError:
+    """
+    Преобразует неуспешный HTTP-статус (или код ошибки в теле ответа) в типизированную ошибку
+
+    Args:
+        status (int): HTTP-статус или код ошибки
+        text (str): текст ответа
+        model (str): модель, к которой был запрос
+        retry_after (str): значение заголовка Retry-After
+
+    Returns:
+        LLMError: ошибка соответствующего типа
+    """
+    message = f"{model}: HTTP {status}: {text[:500]}"
+    if status == 429:
+        return LLMRateLimitError(message, model, parse_retry_after(retry_after))
+    if status >= 500 or status in (408, 502, 503, 504):
+        return LLMServerError(message, model, status)
+    return LLMRequestError(message, model, status)
+
+
+def extract_content(body: dict, model: str, stream: bool = False):
+    """
+    Извлекает текст ответа из JSON OpenRouter. OpenRouter может вернуть ошибку
+    провайдера со статусом 200 в поле error
+
+    Args:
+        body (dict): тело ответа или событие SSE
+        model (str): модель, к которой был запрос
+        stream (bool): True для событий потокового ответа (текст в delta)
+
+    Returns:
+        str: текст ответа; для потока - фрагмент или None
+
+    Raises:
+        LLMError: ответ содержит ошибку или не содержит текста
+    """
+    error = body.get("error")
+    if error:
+        code = error.get("code") if isinstance(error, dict) else None
+        message = error.get("message", "") if isinstance(error, dict) else str(error)
+        raise status_error(code if isinstance(code, int) else 502, message, model)
+
+    choices = body.get("choices", [])
+    if stream:
+        return choices[0].get("delta", {}).get("content") if choices else None
+    content = (choices[0].get("message", {}).get("content") or "") if choices else ""
+    content = THINK_PATTERN.sub("", content).strip()
+    if not content:
+        raise LLMEmptyResponseError(f"{model}: пустой ответ модели", model)
+    return content
+
+
+def build_request(prompt: str, model: str, route: dict, stream: bool = False, response_format: dict = None) -> dict:
+    """
+    Формирует тело запроса chat completions по маршруту задачи. Если рассуждения
+    задаче не нужны, OpenRouter не присылает их в ответе
+
+    Args:
+        prompt (str): входной промпт
+        model (str): модель
+        route (dict): маршрут задачи (ModelRouter.route)
+        stream (bool): потоковый ответ
+        response_format (dict): формат ответа (например, lead_schema); запрос уходит только
+            к провайдерам, которые его поддерживают
+
+    Returns:
+        dict: тело запроса
+    """
+    data = {
+        "model": model,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ],
+    }
+    if route.get("max_tokens"):
+        data["max_tokens"] = route["max_tokens"]
+    if not route.get("reasoning"):
+        data["reasoning"] = {"exclude": True}
+    if response_format:
+        data["response_format"] = response_format
+        data["provider"] = {"require_parameters": True}
+    if stream:
+        data["stream"] = True
+        data["usage"] = {"include": True}
+    return data
+
+
+def record_route_latency(router: ModelRouter, task: str, model: str, seconds: float):
+    """
+    Передает задержку ответа модели в маршрутизатор и сообщает о переходе задачи на другую модель
+
+    Args:
+        router (ModelRouter): маршрутизатор
+        task (str): тип запроса
+        model (str): модель
+        seconds (float): задержка
+
+    Returns:
+        None
+    """
+    fallback = router.record(task, model, seconds)
+    if fallback is not None:
+        LLM_DOWNGRADES_TOTAL.inc(task, fallback)
+        log_event("llm_downgrade", task=task, model=model, fallback=fallback, budget=router.route(task)["budget"])
+        print(f"[DeepSeekR1] {task}: {model} не укладывается в бюджет задержки, переход на {fallback}")
+
+
+def retry_delay(error: LLMError, attempt: int, max_retries: int, deadline: float):
+    """
+    Решает, повторять ли запрос к той же модели после ошибки
+
+    Args:
+        error (LLMError): ошибка попытки
+        attempt (int): номер уже выполненного повтора, начиная с 0
+        max_retries (int): максимальное количество повторов
+        deadline (float): общий срок ответа по time.monotonic()
+
+    Returns:
+        float: пауза перед повтором или None, если повторять не нужно
+    """
+    if not error.retryable or attempt >= max_retries:
+        return None
+    delay = backoff_delay(attempt, getattr(error, "retry_after", None))
+    if time.monotonic() + delay >= deadline:
+        return None
+    print(f"[DeepSeekR1] {error}, повтор через {delay:.1f} s")
+    return delay
+
+
+def observe_request(task: str, outcome: str, model: str, started: float):
+    """
+    Учитывает завершенный вызов модели (вместе с повторами и резервными моделями)
+
+    Args:
+        task (str): тип запроса
+        outcome (str): "ok" или имя класса ошибки
+        model (str): модель, которая ответила или завершила перебор
+        started (float): время начала вызова по time.perf_counter()
+
+    Returns:
+        None
+    """
+    seconds = time.perf_counter() - started
+    LLM_REQUEST_SECONDS.observe(task, outcome, value=seconds)
+    log_event("llm_request", task=task, model=model, outcome=outcome, seconds=round(seconds, 4))
+
+
 class DeepSeekAPI:
     """
     Класс, реализующий подключение и запросы к сервису DeepSeek
     """
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, timeout: float = None, api_url: str = LLM_API_URL, models: list = None,
+                 max_retries: int = LLM_MAX_RETRIES, routes: dict = None, limiter: AdaptiveRateLimiter = None):
         """
         Инициализирует объект подключения к DeepSeek
 
         Args:
             api_key (str):  API-ключ подключения к сервису
+            timeout (float): общий срок ответа по умолчанию, в секундах; если не задан, берется из маршрута задачи
+            api_url (str): адрес chat completions API
+            models (list): модели в порядке перебора для всех задач, по умолчанию модели берутся из маршрутов
+            max_retries (int): количество повторов запроса к одной модели
+            routes (dict): маршруты задач (модели, max_tokens, бюджет задержки), по умолчанию LLM_ROUTES
+            limiter (AdaptiveRateLimiter): общий ограничитель запросов, см. get_client; None - без ограничения
 
         Returns:
             None
         """
         self.api_key = api_key
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+        self.api_url = api_url
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        self.model = "deepseek/deepseek-r1:free"
+        self.router = ModelRouter(routes, models)
+        self.models = self.router.models
+        self.model = self.models[0]
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = limiter
+        self.breakers = {model: CircuitBreaker() for model in self.models}
+
+    def _post(self, prompt, model, timeout, task="ask", response_format=None):
+        """
+        Выполняет одну попытку запроса к модели
+
+        Args:
+            prompt (str): входной промпт
+            model (str): модель
+            timeout (float): таймаут попытки в секундах
+            task (str): тип запроса для метрик
+            response_format (dict): формат ответа, см. build_request
+
+        Returns:
+            str: ответ модели
+
+        Raises:
+            LLMError: попытка не удалась
+        """
+        data = build_request(prompt, model, self.router.route(task), response_format=response_format)
+
+        try:
+            body = self._request(data, model, timeout)
+        except LLMError as e:
+            LLM_ATTEMPTS_TOTAL.inc(model, type(e).__name__)
+            raise
+        LLM_ATTEMPTS_TOTAL.inc(model, "ok")
+        record_usage(model, task, body.get("usage"))
+        return extract_content(body, model)
+
+    def _request(self, data, model, timeout):
+        """
+        Отправляет запрос и разбирает JSON ответа
+
+        Args:
+            data (dict): тело запроса
+            model (str): модель
+            timeout (float): таймаут попытки в секундах
+
+        Returns:
+            dict: тело ответа
+
+        Raises:
+            LLMError: запрос не удался
+        """
+        if self.limiter is not None:
+            self.limiter.acquire_sync()
+        try:
+            response = requests.post(self.api_url, json=data, headers=self.headers, timeout=timeout)
+        except requests.Timeout:
+            raise LLMTimeoutError(f"{model}: превышено время ожидания ответа модели", model)
+        except requests.RequestException as e:
+            raise LLMConnectionError(f"{model}: {e}", model)
+
+        if self.limiter is not None:
+            self.limiter.record(response.status_code, response.headers)
+        if response.status_code != 200:
+            raise status_error(response.status_code, response.text, model, response.headers.get("Retry-After"))
+        try:
+            return response.json()
+        except ValueError as e:
+            raise LLMServerError(f"{model}: некорректный JSON в ответе: {e}", model, response.status_code)
+
+    def _complete(self, prompt, timeout=None, task="ask", response_format=None):
+        """
+        Запрашивает ответ, повторяя попытки с паузами и переходя к резервным моделям.
+        Все попытки укладываются в общий срок timeout
+
+        Args:
+            prompt (str): входной промпт
+            timeout (float): общий срок ответа, по умолчанию self.timeout или срок из маршрута задачи
+            task (str): тип запроса для метрик
+            response_format (dict): формат ответа, см. build_request
+
+        Returns:
+            str: ответ модели
+
+        Raises:
+            LLMError: ни одна модель не ответила
+        """
+        started = time.perf_counter()
+        deadline = time.monotonic() + (timeout or self.timeout or self.router.route(task)["timeout"])
+        error = None
+        for model in self.router.order(task):
+            breaker = self.breakers[model]
+            if not breaker.allow():
+                error = error or LLMCircuitOpenError(f"{model}: модель временно отключена", model)
+                continue
+            attempt = 0
+            model_started = time.monotonic()
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        raise LLMTimeoutError(f"{model}: истек срок ответа", model)
+                    content = self._post(prompt, model, min(remaining, LLM_ATTEMPT_TIMEOUT), task, response_format)
+                except LLMError as e:
+                    delay = retry_delay(e, attempt, self.max_retries, deadline)
+                    if delay is None:
+                        breaker.record_failure()
+                        if isinstance(e, LLMTimeoutError):
+                            record_route_latency(self.router, task, model, time.monotonic() - model_started)
+                        error = e
+                        print(f"[DeepSeekAPI] Модель {model} не ответила: {e}")
+                        break
+                    attempt += 1
+                    time.sleep(delay)
+                    continue
+                breaker.record_success()
+                record_route_latency(self.router, task, model, time.monotonic() - model_started)
+                observe_request(task, "ok", model, started)
+                return content
+        observe_request(task, type(error).__name__, error.model, started)
+        raise error
 
-    def ask(self, text):
+    def ask(self, text, timeout=None):
         """
         Реализует обычный запрос к DeepSeek
 
         Args:
             text (str): входной промпт для модели DeepSeek
+            timeout (float): общий срок ответа в секундах
 
         Returns:
              str: ответ модели
+
+        Raises:
+            LLMError: ни одна модель не ответила
         """
-        data = {
-            "model": self.model,
-            "messages": [
-                {"role": "user", "content": text}
-            ]
-        }
+        return self._complete(text, timeout)
 
-        response = requests.post(self.api_url, json=data, headers=self.headers)
+    def classify(self, text, timeout=None):
+        """
+        Реализует запрос к DeepSeek для классификации сообщения
 
-        if response.status_code == 200:
-            choices = response.json().get("choices", [])
-            if choices:
-                return choices[0].get("message", {}).get("content", "").strip()
-            else:
-                return "No response from model"
-        else:
-            return f"Error {response.status_code}: {response.text}"
+        Args:
+            text (str): входной текст пользователя
+            timeout (float): общий срок ответа в секундах
+
+        Returns:
+            str: ответ модели
 
-    def classify(self, text):
+        Raises:
+            LLMError: ни одна модель не ответила
         """
-        Реализует запрос к DeepSeek для классификации сообщения
+        return self._complete(build_classify_prompt(text), timeout, task="classify")
+
+    def collect_info(self, text, timeout=None):
+        """
+        Реализует запрос к DeepSeek для извлечения информации из сообщения
 
         Args:
             text (str): входной текст пользователя
+            timeout (float): общий срок ответа в секундах
 
         Returns:
             str: ответ модели
+
+        Raises:
+            LLMError: ни одна модель не ответила
+        """
+        return self._complete(build_collect_info_prompt(text), timeout, task="collect_info")
+
+    def collect_fields(self, text, fields, timeout=None):
+        """
+        Запрашивает у модели только недостающие поля заявки; ответ ограничен строгой JSON-схемой
+
+        Args:
+            text (str): входной текст пользователя
+            fields (list): названия полей: contact_info, fio, product
+            timeout (float): общий срок ответа в секундах
+
+        Returns:
+            str: ответ модели (JSON с запрошенными полями)
+
+        Raises:
+            LLMError: ни одна модель не ответила
+        """
+        return self._complete(build_collect_fields_prompt(text, fields), timeout, task="collect_info",
+                              response_format=lead_schema(fields))
+
+
+class AsyncDeepSeekAPI:
+    """
+    Асинхронный клиент DeepSeek, переиспользующий пул keep-alive соединений.
+    Запросы укладываются в общий срок, повторяются с паузами, при долгом ответе
+    дублируются (хеджирование), а при отказе модели переходят к резервной
+    """
+    def __init__(self, api_key: str, timeout: float = None, pool_size: int = LLM_POOL_SIZE,
+                 api_url: str = LLM_API_URL, models: list = None, max_retries: int = LLM_MAX_RETRIES,
+                 hedge: bool = LLM_HEDGE_ENABLED, routes: dict = None, limiter: AdaptiveRateLimiter = None):
+        """
+        Инициализирует объект подключения к DeepSeek. HTTP-сессия создается лениво
+        при первом запросе, так как ей нужен запущенный цикл событий
+
+        Args:
+            api_key (str): API-ключ подключения к сервису
+            timeout (float): общий срок ответа по умолчанию, в секундах; если не задан, берется из маршрута задачи
+            pool_size (int): максимальное количество одновременных соединений в пуле
+            api_url (str): адрес chat completions API
+            models (list): модели в порядке перебора для всех задач, по умолчанию модели берутся из маршрутов
+            max_retries (int): количество повторов запроса к одной модели
+            routes (dict): маршруты задач (модели, max_tokens, бюджет задержки), по умолчанию LLM_ROUTES
+            hedge (bool): отправлять дубль запроса, если ответ дольше обычного
+            limiter (AdaptiveRateLimiter): общий ограничитель запросов, см. get_client; None - без ограничения
+
+        Returns:
+            None
         """
-        prompt = (
-            f"Проанализируй следующий текст и классифицируй его по одной из меток: заявка, вопрос или спам.\n"
-            f"ВАЖНО, что эти сообщения адресуются конкретной компании и нерелевантные сообщения должны уходить "
-            f"в спам\n"
-            f"К вопросам должны относиться только те сообщения, где пользователь хочет что-то узнать по тематике "
-            f"компании\n"
-            f"К заявкам относятся сообщения, где видно, что пользователь хочет что-то купить, как-то проинвестировать "
-            f"или принести иную прбыль компании\n"
-            f"Текст:\n\"\"\"\n{text}\n\"\"\"\n"
-            "Ответь только одним словом — одной меткой, без пояснений и дополнительного текста."
-        )
-
-        data = {
-            "model": self.model,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ]
+        self.api_key = api_key
+        self.api_url = api_url
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
         }
+        self.router = ModelRouter(routes, models)
+        self.models = self.router.models
+        self.model = self.models[0]
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.limiter = limiter
+        self.breakers = {model: CircuitBreaker() for model in self.models}
+        self.latency = {model: LatencyTracker() for model in self.models}
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Возвращает общую HTTP-сессию, создавая ее при необходимости
+
+        Returns:
+            ClientSession: сессия с пулом соединений
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=LLM_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self._session
+
+    async def close(self):
+        """
+        Закрывает HTTP-сессию и все соединения пула
+
+        Returns:
+            None
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _acquire(self, task, timeout):
+        """
+        Занимает слот общего ограничителя запросов с приоритетом задачи
+
+        Args:
+            task (str): задача
+            timeout (float): таймаут попытки в секундах, ожидание слота входит в него
+
+        Returns:
+            float: время, оставшееся от таймаута попытки, всегда больше нуля
+
+        Raises:
+            TimeoutError: слот не освободился за время попытки или на запрос не осталось времени
+                (aiohttp считает ClientTimeout(total=0) отсутствием таймаута)
+        """
+        remaining = timeout
+        if self.limiter is not None and timeout > 0:
+            started = time.monotonic()
+            await asyncio.wait_for(self.limiter.acquire(TASK_PRIORITY.get(task, PRIORITY_DEFAULT)), timeout)
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                self.limiter.release()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return remaining
+
+    def _release(self, response=None):
+        """
+        Освобождает слот общего ограничителя и передает ему статус и заголовки ответа
+
+        Args:
+            response (ClientResponse): ответ сервиса или None, если ответа нет
+
+        Returns:
+            None
+        """
+        if self.limiter is None:
+            return
+        if response is not None:
+            self.limiter.record(response.status, response.headers)
+        self.limiter.release()
+
+    async def _post(self, prompt, model, timeout, task="ask", response_format=None):
+        """
+        Выполняет одну попытку запроса к модели
+
+        Args:
+            prompt (str): входной промпт
+            model (str): модель
+            timeout (float): таймаут попытки в секундах
+            task (str): тип запроса для метрик
+            response_format (dict): формат ответа, см. build_request
+
+        Returns:
+            str: ответ модели
+
+        Raises:
+            LLMError: попытка не удалась
+        """
+        data = build_request(prompt, model, self.router.route(task), response_format=response_format)
+
+        try:
+            client_timeout = aiohttp.ClientTimeout(total=await self._acquire(task, timeout))
+            response = None
+            try:
+                async with self._get_session().post(self.api_url, json=data, timeout=client_timeout) as response:
+                    if response.status != 200:
+                        raise status_error(response.status, await response.text(), model,
+                                           response.headers.get("Retry-After"))
+                    body = await response.json(content_type=None)
+            finally:
+                self._release(response)
+        except asyncio.TimeoutError:
+            LLM_ATTEMPTS_TOTAL.inc(model, LLMTimeoutError.__name__)
+            raise LLMTimeoutError(f"{model}: превышено время ожидания ответа модели", model)
+        except aiohttp.ClientError as e:
+            LLM_ATTEMPTS_TOTAL.inc(model, LLMConnectionError.__name__)
+            raise LLMConnectionError(f"{model}: {e}", model)
+        except ValueError as e:
+            LLM_ATTEMPTS_TOTAL.inc(model, LLMServerError.__name__)
+            raise LLMServerError(f"{model}: некорректный JSON в ответе: {e}", model, 200)
+        except LLMError as e:
+            LLM_ATTEMPTS_TOTAL.inc(model, type(e).__name__)
+            raise
+        LLM_ATTEMPTS_TOTAL.inc(model, "ok")
+        record_usage(model, task, body.get("usage"))
+        return extract_content(body, model)
+
+    async def _hedged_post(self, prompt, model, timeout, task="ask", response_format=None):
+        """
+        Выполняет попытку запроса; если ответ не пришел за обычное для модели время
+        (перцентиль LatencyTracker), отправляет дубль и возвращает первый успешный ответ
+
+        Args:
+            prompt (str): входной промпт
+            model (str): модель
+            timeout (float): таймаут попытки в секундах
+            task (str): тип запроса для метрик
+            response_format (dict): формат ответа, см. build_request
+
+        Returns:
+            str: ответ модели
+
+        Raises:
+            LLMError: обе копии запроса завершились ошибкой
+        """
+        started = time.monotonic()
+        delay = self.latency[model].hedge_delay() if self.hedge else None
+        if delay is None or delay >= timeout:
+            content = await self._post(prompt, model, timeout, task, response_format)
+            self.latency[model].record(time.monotonic() - started)
+            return content
+
+        primary = asyncio.create_task(self._post(prompt, model, timeout, task, response_format))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges_sent += 1
+                LLM_HEDGES_TOTAL.inc(model, "sent")
+                tasks.add(asyncio.create_task(self._post(prompt, model, timeout - delay, task, response_format)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is None:
+                        self.latency[model].record(time.monotonic() - started)
+                        if finished is not primary:
+                            self.hedges_won += 1
+                            LLM_HEDGES_TOTAL.inc(model, "won")
+                        return finished.result()
+                    error = finished.exception()
+            raise error
+        finally:
+            for pending in tasks:
+                pending.cancel()
+
+    async def _complete(self, prompt, timeout=None, task="ask", response_format=None):
+        """
+        Запрашивает ответ, повторяя попытки с паузами и переходя к резервным моделям.
+        Все попытки укладываются в общий срок timeout
+
+        Args:
+            prompt (str): входной промпт
+            timeout (float): общий срок ответа, по умолчанию self.timeout или срок из маршрута задачи
+            task (str): тип запроса для метрик
+            response_format (dict): формат ответа, см. build_request
+
+        Returns:
+            str: ответ модели
+
+        Raises:
+            LLMError: ни одна модель не ответила
+        """
+        started = time.perf_counter()
+        deadline = time.monotonic() + (timeout or self.timeout or self.router.route(task)["timeout"])
+        error = None
+        for model in self.router.order(task):
+            breaker = self.breakers[model]
+            if not breaker.allow():
+                error = error or LLMCircuitOpenError(f"{model}: модель временно отключена", model)
+                continue
+            attempt = 0
+            model_started = time.monotonic()
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        raise LLMTimeoutError(f"{model}: истек срок ответа", model)
+                    content = await self._hedged_post(prompt, model, min(remaining, LLM_ATTEMPT_TIMEOUT), task,
+                                                      response_format)
+                except LLMError as e:
+                    delay = retry_delay(e, attempt, self.max_retries, deadline)
+                    if delay is None:
+                        breaker.record_failure()
+                        if isinstance(e, LLMTimeoutError):
+                            record_route_latency(self.router, task, model, time.monotonic() - model_started)
+                        error = e
+                        print(f"[AsyncDeepSeekAPI] Модель {model} не ответила: {e}")
+                        break
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                breaker.record_success()
+                record_route_latency(self.router, task, model, time.monotonic() - model_started)
+                observe_request(task, "ok", model, started)
+                return content
+        observe_request(task, type(error).__name__, error.model, started)
+        raise error
+
+    async def _stream_once(self, prompt, model, deadline, task="ask_stream"):
+        """
+        Выполняет одну попытку потокового запроса. Блок usage OpenRouter присылает
+        в последнем событии потока. Поток без текста ответа (например, только рассуждения)
+        и поток, закрытый до [DONE], считаются неудачной попыткой
+
+        Args:
+            prompt (str): входной промпт
+            model (str): модель
+            deadline (float): общий срок ответа по time.monotonic()
+            task (str): тип запроса для метрик
+
+        Yields:
+            str: очередной фрагмент ответа модели
+
+        Raises:
+            LLMError: попытка не удалась
+        """
+        data = build_request(prompt, model, self.router.route(task), stream=True)
+
+        try:
+            # Общий срок ограничивает весь ответ, таймаут попытки - паузу между фрагментами
+            client_timeout = aiohttp.ClientTimeout(total=await self._acquire(task, deadline - time.monotonic()),
+                                                   sock_read=LLM_ATTEMPT_TIMEOUT)
+            response = None
+            received = False
+            finished = False
+            try:
+                async with self._get_session().post(self.api_url, json=data, timeout=client_timeout) as response:
+                    if response.status != 200:
+                        raise status_error(response.status, await response.text(), model,
+                                           response.headers.get("Retry-After"))
+                    async for raw_line in response.content:
+                        line = raw_line.decode("utf-8").strip()
+                        # Строки-комментарии SSE (": OPENROUTER PROCESSING") и пустые разделители пропускаются
+                        if not line.startswith("data:"):
+                            continue
+                        payload = line[len("data:"):].strip()
+                        if payload == "[DONE]":
+                            finished = True
+                            break
+                        event = json.loads(payload)
+                        record_usage(model, task, event.get("usage"))
+                        content = extract_content(event, model, stream=True)
+                        if content:
+                            received = received or bool(content.strip())
+                            yield content
+            finally:
+                self._release(response)
+            if not received:
+                raise LLMEmptyResponseError(f"{model}: пустой ответ модели", model)
+            if not finished:
+                raise LLMConnectionError(f"{model}: поток ответа оборвался до [DONE]", model)
+        except asyncio.TimeoutError:
+            LLM_ATTEMPTS_TOTAL.inc(model, LLMTimeoutError.__name__)
+            raise LLMTimeoutError(f"{model}: превышено время ожидания ответа модели", model)
+        except aiohttp.ClientError as e:
+            LLM_ATTEMPTS_TOTAL.inc(model, LLMConnectionError.__name__)
+            raise LLMConnectionError(f"{model}: {e}", model)
+        except ValueError as e:
+            LLM_ATTEMPTS_TOTAL.inc(model, LLMServerError.__name__)
+            raise LLMServerError(f"{model}: некорректное событие SSE: {e}", model, 200)
+        except LLMError as e:
+            LLM_ATTEMPTS_TOTAL.inc(model, type(e).__name__)
+            raise
+        LLM_ATTEMPTS_TOTAL.inc(model, "ok")
 
-        response = requests.post(self.api_url, json=data, headers=self.headers)
+    async def ask(self, text, timeout=None):
+        """
+        Реализует обычный запрос к DeepSeek
+
+        Args:
+            text (str): входной промпт для модели DeepSeek
+            timeout (float): общий срок ответа в секундах
+
+        Returns:
+             str: ответ модели
+
+        Raises:
+            LLMError: ни одна модель не ответила
+        """
+        return await self._complete(text, timeout)
+
+    async def ask_stream(self, text, timeout=None):
+        """
+        Реализует потоковый запрос к DeepSeek: ответ приходит через SSE
+        и отдается по мере генерации. Рассуждения модели (delta.reasoning) пропускаются.
+        Повторы и переход к резервной модели возможны только до первого фрагмента
+
+        Args:
+            text (str): входной промпт для модели DeepSeek
+            timeout (float): общий срок ответа в секундах
+
+        Yields:
+            str: очередной фрагмент ответа модели
+
+        Raises:
+            LLMError: ни одна модель не ответила или ответ оборвался
+        """
+        task = "ask_stream"
+        started = time.perf_counter()
+        deadline = time.monotonic() + (timeout or self.timeout or self.router.route(task)["timeout"])
+        error = None
+        for model in self.router.order(task):
+            breaker = self.breakers[model]
+            if not breaker.allow():
+                error = error or LLMCircuitOpenError(f"{model}: модель временно отключена", model)
+                continue
+            attempt = 0
+            model_started = time.monotonic()
+            while True:
+                streaming = False
+                try:
+                    if deadline <= time.monotonic():
+                        raise LLMTimeoutError(f"{model}: истек срок ответа", model)
+                    async for content in self._stream_once(text, model, deadline, task):
+                        if not streaming:
+                            streaming = True
+                            # Для потокового ответа бюджет задержки - время до первого фрагмента
+                            record_route_latency(self.router, task, model, time.monotonic() - model_started)
+                            log_event("llm_first_token", model=model,
+                                      seconds=round(time.perf_counter() - started, 4))
+                        yield content
+                except LLMError as e:
+                    delay = None if streaming else retry_delay(e, attempt, self.max_retries, deadline)
+                    if delay is None:
+                        breaker.record_failure()
+                        if streaming:
+                            observe_request(task, type(e).__name__, model, started)
+                            raise
+                        if isinstance(e, LLMTimeoutError):
+                            record_route_latency(self.router, task, model, time.monotonic() - model_started)
+                        error = e
+                        print(f"[AsyncDeepSeekAPI] Модель {model} не ответила: {e}")
+                        break
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                breaker.record_success()
+                observe_request(task, "ok", model, started)
+                return
+        observe_request(task, type(error).__name__, error.model, started)
+        raise error
 
-        if response.status_code == 200:
-            choices = response.json().get("choices", [])
-            if choices:
-                # Уберём лишние пробелы и перейдём на нижний регистр (по необходимости)
-                label = choices[0].get("message", {}).get("content", "").strip()
-                return label
-            else:
-                return "Нет ответа от модели"
-        else:
-            return f"Ошибка {response.status_code}: {response.text}"
+    async def classify(self, text, timeout=None):
+        """
+        Реализует запрос к DeepSeek для классификации сообщения
+
+        Args:
+            text (str): входной текст пользователя
+            timeout (float): общий срок ответа в секундах
+
+        Returns:
+            str: ответ модели
 
-    def collect_info(self, text):
+        Raises:
+            LLMError: ни одна модель не ответила
+        """
+        return await self._complete(build_classify_prompt(text), timeout, task="classify")
+
+    async def collect_info(self, text, timeout=None):
         """
         Реализует запрос к DeepSeek для извлечения информации из сообщения
 
         Args:
             text (str): входной текст пользователя
+            timeout (float): общий срок ответа в секундах
 
         Returns:
             str: ответ модели
+
+        Raises:
+            LLMError: ни одна модель не ответила
         """
-        prompt = (
-            f"Следующий текст является заявкой, которая потенциально должна принести компании прибыль\n"
-            f"Проанализируй текст и пойми какие данные из списка присутствуют в тексте\n"
-            f"Список: ФИО, продукт или товар, который автор сообщения хочет приобрести, контактные данные\n"
-            f"Текст:\n\"\"\"\n{text}\n\"\"\"\n"
-            f"Ответь JSON в формате {{\"contact_info\": контактные данные, \"fio\": фио клиента, "
-            f"\"product\": продукт, который хотят приобрести}}."
-            f"Никакий других данных в ответе быть не должно, только JSON, который можно распарсить\n"
-            f"Если каких-то данных нет в тексте, то на их месте пришли None\n"
-            f"Дополнительно проверь данные на валидность, чтобы номер соответствовал реальному номеру, "
-            f"ФИО было адекватным и не придуманным, данные о продукте заноси в именительном падеже "
-            f"с указанием количества, если оно присутствует"
-        )
-
-        data = {
-            "model": self.model,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ]
-        }
+        return await self._complete(build_collect_info_prompt(text), timeout, task="collect_info")
+
+    async def collect_fields(self, text, fields, timeout=None):
+        """
+        Запрашивает у модели только недостающие поля заявки; ответ ограничен строгой JSON-схемой
+
+        Args:
+            text (str): входной текст пользователя
+            fields (list): названия полей: contact_info, fio, product
+            timeout (float): общий срок ответа в секундах
+
+        Returns:
+            str: ответ модели (JSON с запрошенными полями)
+
+        Raises:
+            LLMError: ни одна модель не ответила
+        """
+        return await self._complete(build_collect_fields_prompt(text, fields), timeout, task="collect_info",
+                                    response_format=lead_schema(fields))
+
+    async def classify_and_collect(self, text, timeout=None):
+        """
+        Реализует один запрос к DeepSeek, который классифицирует сообщение
+        и извлекает данные заявки
+
+        Args:
+            text (str): входной текст пользователя
+            timeout (float): общий срок ответа в секундах
+
+        Returns:
+            str: ответ модели (JSON с полями label, contact_info, fio, product)
+
+        Raises:
+            LLMError: ни одна модель не ответила
+        """
+        return await self._complete(build_classify_and_collect_prompt(text), timeout, task="classify_and_collect")
+
+
+_clients = {}
+_rate_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter(api_url: str = LLM_API_URL) -> AdaptiveRateLimiter:
+    """
+    Общий для процесса ограничитель запросов к сервису
+
+    Args:
+        api_url (str): адрес chat completions API
+
+    Returns:
+        AdaptiveRateLimiter: ограничитель, один на адрес
+    """
+    with _registry_lock:
+        limiter = _rate_limiters.get(api_url)
+        if limiter is None:
+            limiter = _rate_limiters[api_url] = AdaptiveRateLimiter()
+        return limiter
+
+
+def get_client(api_key: str, asynchronous: bool = True, api_url: str = LLM_API_URL):
+    """
+    Общий для процесса клиент модели: все модули (агент, RAG) получают один объект
+    на ключ и адрес, с общим пулом соединений и общим ограничителем запросов
+
+    Args:
+        api_key (str): API-ключ подключения к сервису
+        asynchronous (bool): AsyncDeepSeekAPI или синхронный DeepSeekAPI
+        api_url (str): адрес chat completions API
+
+    Returns:
+        AsyncDeepSeekAPI | DeepSeekAPI: клиент
+    """
+    key = (asynchronous, api_key, api_url)
+    limiter = get_rate_limiter(api_url) if LLM_RATE_LIMIT_ENABLED else None
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is None:
+            client_class = AsyncDeepSeekAPI if asynchronous else DeepSeekAPI
+            client = _clients[key] = client_class(api_key, api_url=api_url, limiter=limiter)
+        return client
+
+
+def collect_limiter_metrics():
+    """
+    Переносит показатели общих ограничителей запросов в датчики метрик
+
+    Returns:
+        None
+    """
+    for api_url, limiter in list(_rate_limiters.items()):
+        for name, value in limiter.metrics().items():
+            LLM_LIMITER_STATE.set(api_url, name, value=value)
+
 
-        response = requests.post(self.api_url, json=data, headers=self.headers)
-
-        if response.status_code == 200:
-            choices = response.json().get("choices", [])
-            if choices:
-                label = choices[0].get("message", {}).get("content", "").strip()
-                return label
-            else:
-                return "Нет ответа от модели"
-        else:
-            return f"Ошибка {response.status_code}: {response.text}"
\ No newline at end of file
+registry.add_collector(collect_limiter_metrics)
@@ -1,24 +1,237 @@
 import os
+import time
+import asyncio
+import threading
 
 from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 
-from DeepSeekR1 import DeepSeekAPI
+from DeepSeekR1 import get_client
+from resilience import LLMError
+from metrics import RAG_STAGE_SECONDS, RAG_PROMPT_TOKENS, ANSWER_CACHE_TOTAL, timed, log_event
+from RAG_data import read_kb_version
+from semantic_cache import SemanticCache
+from retrieval import ChromaRetriever, NumpyRetriever
+from vector_index import NumpyVectorIndex
+from embedding_service import EmbeddingServiceClient, RemoteRetriever
+from lexical_index import LexicalIndex
+from parent_store import ParentStore
+from context import assemble_context, estimate_tokens
+from config import (VECTOR_DB_DIR, COLLECTION_NAME, EMBEDDING_MODEL, MANIFEST_PATH, ANSWER_CACHE_ENABLED,
+                    RETRIEVAL_BACKEND, NUMPY_INDEX_DIR, HYBRID_SEARCH, LEXICAL_INDEX_PATH, CONTEXT_CANDIDATES,
+                    LLM_ERROR_TEXT, EMBEDDING_SERVICE_SOCKET, CHUNKING, PARENT_STORE_PATH,
+                    ANSWER_CACHE_PATH)
 
 load_dotenv()
 
-embeddings = HuggingFaceEmbeddings(
-    model_name='sentence-transformers/all-MiniLM-L6-v2',
-    model_kwargs={'device': 'cpu'},  
-)
+_embeddings = None
+_vector_store = None
+_retriever = None
+_lexical_index = None
+_parent_store = None
+_answer_cache = None
+_load_lock = threading.Lock()
+
+# Длительность этапов загрузки, в секундах; заполняется по мере загрузки
+startup_timings = {}
+
+
+def get_embeddings():
+    """
+    Возвращает модель эмбеддингов, загружая ее при первом обращении
+
+    Returns:
+        HuggingFaceEmbeddings | EmbeddingServiceClient: модель эмбеддингов или клиент общего сервиса
+    """
+    global _embeddings
+    if _embeddings is None:
+        with _load_lock:
+            if _embeddings is None:
+                started = time.perf_counter()
+                if EMBEDDING_SERVICE_SOCKET:
+                    # Модель загружена один раз в общем сервисе, здесь только ждем его готовности
+                    client = EmbeddingServiceClient(EMBEDDING_SERVICE_SOCKET)
+                    client.ping()
+                    _embeddings = client
+                else:
+                    from langchain_huggingface import HuggingFaceEmbeddings
+
+                    _embeddings = HuggingFaceEmbeddings(
+                        model_name=EMBEDDING_MODEL,
+                        model_kwargs={'device': 'cpu'},
+                    )
+                startup_timings["model_load"] = time.perf_counter() - started
+    return _embeddings
+
+
+class LazyEmbeddings(Embeddings):
+    """
+    Обертка над get_embeddings, которую можно передавать в качестве модели
+    эмбеддингов до того, как модель фактически загружена
+    """
+    def embed_documents(self, texts):
+        """
+        Считает эмбеддинги документов
+
+        Args:
+            texts (list): тексты документов
+
+        Returns:
+            list: эмбеддинги
+        """
+        return get_embeddings().embed_documents(texts)
+
+    def embed_query(self, text):
+        """
+        Считает эмбеддинг запроса
+
+        Args:
+            text (str): текст запроса
+
+        Returns:
+            list: эмбеддинг
+        """
+        return get_embeddings().embed_query(text)
+
+
+embeddings = LazyEmbeddings()
+
+
+def get_vector_store():
+    """
+    Возвращает векторное хранилище, подключаясь к нему при первом обращении
+
+    Returns:
+        Chroma: векторное хранилище
+    """
+    global _vector_store
+    if _vector_store is None:
+        get_embeddings()
+        with _load_lock:
+            if _vector_store is None:
+                started = time.perf_counter()
+                from langchain_chroma import Chroma
+
+                _vector_store = Chroma(
+                    collection_name=COLLECTION_NAME,
+                    embedding_function=embeddings,
+                    persist_directory=VECTOR_DB_DIR,
+                )
+                startup_timings["vector_store_open"] = time.perf_counter() - started
+    return _vector_store
+
+
+def get_retriever():
+    """
+    Возвращает бэкенд поиска, выбранный в RETRIEVAL_BACKEND, или поиск через общий
+    сервис, если задан EMBEDDING_SERVICE_SOCKET
+
+    Returns:
+        ChromaRetriever | NumpyRetriever | RemoteRetriever: объект поиска чанков по эмбеддингу
+    """
+    global _retriever
+    if _retriever is None:
+        if EMBEDDING_SERVICE_SOCKET:
+            _retriever = RemoteRetriever(get_embeddings())
+        elif RETRIEVAL_BACKEND == "numpy":
+            started = time.perf_counter()
+            _retriever = NumpyRetriever(NumpyVectorIndex.load(NUMPY_INDEX_DIR))
+            startup_timings["vector_store_open"] = time.perf_counter() - started
+        else:
+            _retriever = ChromaRetriever(get_vector_store())
+    return _retriever
+
+
+def get_lexical_index():
+    """
+    Возвращает лексический индекс, загружая его при первом обращении
+
+    Returns:
+        LexicalIndex: индекс или None, если гибридный поиск выключен или индекс еще не построен
+    """
+    global _lexical_index
+    if _lexical_index is None and HYBRID_SEARCH and os.path.exists(LEXICAL_INDEX_PATH):
+        with _load_lock:
+            if _lexical_index is None:
+                started = time.perf_counter()
+                _lexical_index = LexicalIndex.load(LEXICAL_INDEX_PATH)
+                startup_timings["lexical_index_load"] = time.perf_counter() - started
+    return _lexical_index
+
+
+def get_parent_store():
+    """
+    Возвращает хранилище родительских фрагментов, загружая его при первом обращении
+
+    Returns:
+        ParentStore: хранилище или None, если разбиение не "markdown" или хранилище еще не построено
+    """
+    global _parent_store
+    if _parent_store is None and CHUNKING == "markdown" and os.path.exists(PARENT_STORE_PATH):
+        with _load_lock:
+            if _parent_store is None:
+                started = time.perf_counter()
+                _parent_store = ParentStore.load(PARENT_STORE_PATH)
+                startup_timings["parent_store_load"] = time.perf_counter() - started
+    return _parent_store
+
+
+def get_answer_cache():
+    """
+    Возвращает кэш ответов, открывая файл кэша при первом обращении
+
+    Returns:
+        SemanticCache: кэш или None, если кэш ответов выключен
+    """
+    global _answer_cache
+    if _answer_cache is None and ANSWER_CACHE_ENABLED:
+        with _load_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticCache(path=ANSWER_CACHE_PATH)
+    return _answer_cache
+
+
+def is_ready():
+    """
+    Проверяет, загружены ли модель эмбеддингов и бэкенд поиска
+
+    Returns:
+        bool: True, если RAG готов отвечать без задержки на загрузку
+    """
+    return _embeddings is not None and _retriever is not None
+
+
+def _warm_up_sync():
+    """
+    Загружает модель и бэкенд поиска и выполняет пробный запрос, чтобы первый
+    вопрос пользователя не платил за инициализацию
+
+    Returns:
+        None
+    """
+    retriever = get_retriever()
+    get_lexical_index()
+    get_parent_store()
+    query_embedding = get_embeddings().embed_query("вино")
+    started = time.perf_counter()
+    retriever.search_by_vector(query_embedding, k=1)
+    startup_timings["first_query"] = time.perf_counter() - started
+
+
+async def warm_up():
+    """
+    Фоновый прогрев RAG. Вопросы, пришедшие до окончания прогрева,
+    просто дождутся загрузки модели
+
+    Returns:
+        None
+    """
+    started = time.perf_counter()
+    await asyncio.to_thread(_warm_up_sync)
+    timings = ", ".join(f"{name}: {seconds:.2f} s" for name, seconds in startup_timings.items())
+    print(f"[RAG] Прогрев завершен за {time.perf_counter() - started:.2f} s ({timings})")
 
-vector_store = Chroma(
-    collection_name="wine_knowledge_db",
-    embedding_function=embeddings,
-    persist_directory="./wine_knowledge_db",
-)
 
 prompt_template = ChatPromptTemplate.from_template("""
     Ты - опытный сомелье, в задачу которого входит отвечать на вопросы пользователя про вина
@@ -32,7 +245,133 @@ prompt_template = ChatPromptTemplate.from_template("""
 
     Answer in detail:""")
 
-llm = DeepSeekAPI(api_key=os.environ["DEEP_API_TOKEN"])
+llm = get_client(os.environ["DEEP_API_TOKEN"], asynchronous=False)
+async_llm = get_client(os.environ["DEEP_API_TOKEN"])
+
+_manifest_mtime = None
+
+
+def _sync_kb_version():
+    """
+    Реагирует на переиндексацию базы знаний: сбрасывает кэш ответов и перечитывает индекс NumPy,
+    лексический индекс и хранилище родительских фрагментов. Манифест перечитывается только
+    при изменении времени его модификации
+
+    Returns:
+        None
+    """
+    global _manifest_mtime, _retriever, _lexical_index, _parent_store
+    try:
+        mtime = os.path.getmtime(MANIFEST_PATH)
+    except OSError:
+        return
+    if mtime == _manifest_mtime:
+        return
+    version = read_kb_version()
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer_cache.sync_version(version)
+    if isinstance(_retriever, NumpyRetriever) and _retriever.index.version != version:
+        _retriever = None
+    if _lexical_index is not None and _lexical_index.version != version:
+        _lexical_index = None
+    if _parent_store is not None and _parent_store.version != version:
+        _parent_store = None
+    _manifest_mtime = mtime
+
+
+def _lookup_cached(question):
+    """
+    Считает эмбеддинг вопроса и ищет по нему ответ в кэше
+
+    Args:
+        question (str): входной вопрос пользователя
+
+    Returns:
+        tuple: эмбеддинг вопроса и сохраненный ответ (или None)
+    """
+    with timed(RAG_STAGE_SECONDS, "embed"):
+        question_embedding = get_embeddings().embed_query(question)
+    _sync_kb_version()
+    answer_cache = get_answer_cache()
+    if answer_cache is None:
+        return question_embedding, None
+    with timed(RAG_STAGE_SECONDS, "cache_lookup"):
+        cached = answer_cache.get(question_embedding)
+    ANSWER_CACHE_TOTAL.inc("hit" if cached is not None else "miss")
+    return question_embedding, cached
+
+
+def _retrieve(question, question_embedding, k=3):
+    """
+    Находит чанки для вопроса. Если в вопросе прямо назван сорт или регион,
+    берутся чанки его статьи, иначе результаты векторного поиска объединяются с BM25
+
+    Args:
+        question (str): входной вопрос пользователя
+        question_embedding (list): эмбеддинг вопроса
+        k (int): количество чанков
+
+    Returns:
+        list: найденные документы
+    """
+    lexical_index = get_lexical_index()
+    if lexical_index is None:
+        return get_retriever().search_by_vector(question_embedding, k=k)
+
+    direct_docs = lexical_index.direct_hits(question, k)
+    if direct_docs:
+        return direct_docs
+    dense_docs = get_retriever().search_by_vector(question_embedding, k=k * 4)
+    return lexical_index.hybrid(question, dense_docs, k)
+
+
+def _build_prompt(question, question_embedding):
+    """
+    Находит контекст по эмбеддингу вопроса и формирует промпт. Найденные чанки заменяются
+    родительскими фрагментами без повторов (если индекс построен с разбиением "markdown"),
+    затем склеиваются и обрезаются по бюджету токенов (см. context.assemble_context)
+
+    Args:
+        question (str): входной вопрос пользователя
+        question_embedding (list): эмбеддинг вопроса
+
+    Returns:
+        str: промпт для модели
+    """
+    with timed(RAG_STAGE_SECONDS, "retrieve") as retrieval:
+        retrieved_docs = _retrieve(question, question_embedding, k=CONTEXT_CANDIDATES)
+    with timed(RAG_STAGE_SECONDS, "assemble"):
+        parent_store = get_parent_store()
+        context_docs = parent_store.expand(retrieved_docs) if parent_store is not None else retrieved_docs
+        docs_content, stats = assemble_context(context_docs)
+
+    prompt = prompt_template.format(question=question, context=docs_content)
+    prompt_tokens = estimate_tokens(prompt)
+    RAG_PROMPT_TOKENS.observe(value=prompt_tokens)
+    log_event("rag_prompt", retrieval_seconds=round(retrieval.seconds, 4), prompt_tokens=prompt_tokens,
+              context_tokens=stats["tokens"], raw_context_tokens=stats["raw_tokens"],
+              passages=stats["used"], chunks=len(retrieved_docs), parents=stats["chunks"])
+    return prompt
+
+
+def _store_answer(question, question_embedding, response):
+    """
+    Сохраняет ответ модели в кэш. Пустой ответ не сохраняется: иначе он отдавался бы
+    на все похожие вопросы
+
+    Args:
+        question (str): входной вопрос пользователя
+        question_embedding (list): эмбеддинг вопроса
+        response (str): ответ модели
+
+    Returns:
+        None
+    """
+    answer_cache = get_answer_cache()
+    if answer_cache is not None and response:
+        answer_cache.put(question, question_embedding, response)
+
 
 def ask_question(question):
     """
@@ -42,13 +381,75 @@ def ask_question(question):
         question (str): входной вопрос пользователя
 
     Returns:
-        str: ответ модели
+        str: ответ модели или LLM_ERROR_TEXT, если модель недоступна
     """
+    question_embedding, cached = _lookup_cached(question)
+    if cached is not None:
+        return cached
+
+    formatted_prompt = _build_prompt(question, question_embedding)
+
+    try:
+        response = llm.ask(formatted_prompt)
+    except LLMError as e:
+        print(f"[RAG] Модель не ответила: {e!r}")
+        return LLM_ERROR_TEXT
+    _store_answer(question, question_embedding, response)
+    return response
 
-    retrieved_docs = vector_store.similarity_search(question, k=3)
-    docs_content = "\n".join([doc.page_content for doc in retrieved_docs])
 
-    formatted_prompt = prompt_template.format(question=question, context=docs_content)
+async def aask_question(question):
+    """
+    Асинхронная версия ask_question: эмбеддинг, поиск и работа с кэшем выполняются
+    в отдельном потоке, а запрос к модели не блокирует цикл событий
 
-    response = llm.ask(formatted_prompt)
+    Args:
+        question (str): входной вопрос пользователя
+
+    Returns:
+        str: ответ модели или LLM_ERROR_TEXT, если модель недоступна
+    """
+    question_embedding, cached = await asyncio.to_thread(_lookup_cached, question)
+    if cached is not None:
+        return cached
+
+    formatted_prompt = await asyncio.to_thread(_build_prompt, question, question_embedding)
+
+    try:
+        response = await async_llm.ask(formatted_prompt)
+    except LLMError as e:
+        print(f"[RAG] Модель не ответила: {e!r}")
+        return LLM_ERROR_TEXT
+    await asyncio.to_thread(_store_answer, question, question_embedding, response)
     return response
+
+
+async def astream_question(question):
+    """
+    Потоковая версия aask_question: отдает ответ модели по мере генерации.
+    При попадании в кэш сохраненный ответ отдается одним фрагментом. Если модель
+    недоступна или ответ оборвался, последним фрагментом отдается LLM_ERROR_TEXT
+
+    Args:
+        question (str): входной вопрос пользователя
+
+    Yields:
+        str: очередной фрагмент ответа
+    """
+    question_embedding, cached = await asyncio.to_thread(_lookup_cached, question)
+    if cached is not None:
+        yield cached
+        return
+
+    formatted_prompt = await asyncio.to_thread(_build_prompt, question, question_embedding)
+
+    parts = []
+    try:
+        async for token in async_llm.ask_stream(formatted_prompt):
+            parts.append(token)
+            yield token
+    except LLMError as e:
+        print(f"[RAG] Модель не ответила: {e!r}")
+        yield f"\n\n{LLM_ERROR_TEXT}" if parts else LLM_ERROR_TEXT
+    else:
+        await asyncio.to_thread(_store_answer, question, question_embedding, "".join(parts).strip())
@@ -1,11 +1,25 @@
 import os
+import re
+import json
+import time
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-from langchain_chroma import Chroma
 from langchain_core.documents import Document
-from langchain.embeddings import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from config import WINES_DIR, REGIONS_DIR
+from config import (WINES_DIR, REGIONS_DIR, VECTOR_DB_DIR, COLLECTION_NAME, MANIFEST_PATH, EMBEDDING_MODEL,
+                    INGEST_WORKERS, EMBED_BATCH_SIZE, NUMPY_INDEX_DIR, LEXICAL_INDEX_PATH,
+                    EMBEDDING_SERVICE_SOCKET, CHUNKING, CHILD_CHUNK_SIZE, PARENT_CHUNK_SIZE, PARENT_STORE_PATH)
+from vector_index import NumpyVectorIndex
+from lexical_index import LexicalIndex
+from parent_store import ParentStore
+
+HEADER_PATTERN = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+# Абзац - непустая строка без пробелов по краям
+PARAGRAPH_PATTERN = re.compile(r"\S(?:[^\n]*\S)?")
 
 
 def load_documents_from_folder(folder_path: str):
@@ -38,36 +52,563 @@ def load_documents_from_folder(folder_path: str):
                 print(f"Ошибка при загрузке файла {filename}: {str(e)}")
     return documents
 
-print("Загрузка документов...")
-wine_docs = load_documents_from_folder(WINES_DIR)
-region_docs = load_documents_from_folder(REGIONS_DIR)
-all_docs = wine_docs + region_docs
-
-print(f"Всего документов: {len(all_docs)}")
-print(f"Из них вин: {len(wine_docs)}, регионов: {len(region_docs)}")
-
-print("Разбиение документов на чанки...")
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
-    add_start_index=True
-)
-all_splits = text_splitter.split_documents(all_docs)
-print(f"Всего чанков: {len(all_splits)}")
-
-print("Создание эмбеддингов...")
-embeddings = HuggingFaceEmbeddings(
-    model_name='sentence-transformers/all-MiniLM-L6-v2',
-    model_kwargs={'device': 'cpu'},
-)
-
-vector_store = Chroma(
-    collection_name="wine_knowledge_base",
-    embedding_function=embeddings,
-    persist_directory="./wine_knowledge_db",
-)
-
-print("Добавление документов")
-ids = vector_store.add_documents(all_splits)
-print(f"Всего добавлено векторов: {len(ids)}")
-print("Готово! Векторная база успешно создана.")
+
+def content_hash(text: str) -> str:
+    """
+    Вычисляет хэш содержимого текста
+
+    Args:
+        text (str): исходный текст
+
+    Returns:
+        str: hex-строка SHA-256
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(chunk: Document) -> str:
+    """
+    Детерминированный идентификатор чанка: зависит только от файла, позиции и текста,
+    поэтому повторная обработка неизмененного файла дает те же идентификаторы
+
+    Args:
+        chunk (Document): чанк с метаданными source и start_index
+
+    Returns:
+        str: идентификатор чанка
+    """
+    key = f"{chunk.metadata['source']}\0{chunk.metadata.get('start_index', 0)}\0{chunk.page_content}"
+    return content_hash(key)[:32]
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    """
+    Загружает манифест проиндексированных файлов
+
+    Args:
+        path (str): путь к файлу манифеста
+
+    Returns:
+        dict: манифест вида {"version": str, "files": {source: {"hash": str, "chunks": [id, ...]}}}
+              или None, если манифеста нет
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    """
+    Атомарно сохраняет манифест, чтобы прерванный запуск не оставил битый файл
+
+    Args:
+        manifest (dict): манифест проиндексированных файлов
+        path (str): путь к файлу манифеста
+
+    Returns:
+        None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def read_kb_version(path: str = MANIFEST_PATH) -> str:
+    """
+    Возвращает версию базы знаний из манифеста
+
+    Args:
+        path (str): путь к файлу манифеста
+
+    Returns:
+        str: версия базы знаний или None, если база еще не построена
+    """
+    manifest = load_manifest(path)
+    return manifest.get("version") if manifest else None
+
+
+def get_vector_store(persist_directory: str = VECTOR_DB_DIR, batch_size: int = EMBED_BATCH_SIZE):
+    """
+    Создает модель эмбеддингов (или клиент общего сервиса, если задан EMBEDDING_SERVICE_SOCKET)
+    и подключается к векторной базе. Импорты тяжелых
+    библиотек вынесены сюда, чтобы процессы-обработчики файлов их не загружали
+
+    Args:
+        persist_directory (str): каталог векторной базы
+        batch_size (int): размер батча при вычислении эмбеддингов
+
+    Returns:
+        Chroma: векторное хранилище
+    """
+    from langchain_chroma import Chroma
+
+    if EMBEDDING_SERVICE_SOCKET:
+        from embedding_service import EmbeddingServiceClient
+
+        embeddings = EmbeddingServiceClient(EMBEDDING_SERVICE_SOCKET)
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        embeddings = HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'batch_size': batch_size},
+        )
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings,
+        persist_directory=persist_directory,
+    )
+
+
+_text_splitter = None
+
+
+def get_text_splitter():
+    """
+    Возвращает сплиттер текста, создавая его один раз на процесс
+
+    Returns:
+        RecursiveCharacterTextSplitter: сплиттер документов на чанки
+    """
+    global _text_splitter
+    if _text_splitter is None:
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            add_start_index=True
+        )
+    return _text_splitter
+
+
+_child_splitter = None
+
+
+def get_child_splitter():
+    """
+    Возвращает сплиттер родительских фрагментов на чанки-потомки, создавая его один раз на процесс.
+    Фрагмент режется по абзацам, затем по предложениям, без перекрытия
+
+    Returns:
+        RecursiveCharacterTextSplitter: сплиттер фрагментов на чанки
+    """
+    global _child_splitter
+    if _child_splitter is None:
+        _child_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHILD_CHUNK_SIZE,
+            chunk_overlap=0,
+            separators=["\n", ". ", " ", ""],
+            keep_separator="end",
+            add_start_index=True
+        )
+    return _child_splitter
+
+
+def split_sections(text: str) -> list:
+    """
+    Делит markdown-текст на разделы по заголовкам любого уровня. Название раздела -
+    путь из заголовков, например "Бордо / Сорта"; у текста до первого заголовка названия нет
+
+    Args:
+        text (str): текст статьи
+
+    Returns:
+        list: разделы (название, начало, конец) - границы текста раздела без строки заголовка
+    """
+    sections = []
+    headers = []
+    name, start = "", 0
+    for match in HEADER_PATTERN.finditer(text):
+        sections.append((name, start, match.start()))
+        level = len(match.group(1))
+        headers = [(header_level, title) for header_level, title in headers if header_level < level]
+        headers.append((level, match.group(2).strip()))
+        name, start = " / ".join(title for _, title in headers), match.end()
+    sections.append((name, start, len(text)))
+    return [section for section in sections if text[section[1]:section[2]].strip()]
+
+
+def group_paragraphs(text: str, start: int, end: int, max_chars: int) -> list:
+    """
+    Группирует подряд идущие абзацы раздела во фрагменты не длиннее max_chars.
+    Абзац длиннее max_chars становится отдельным фрагментом
+
+    Args:
+        text (str): текст статьи
+        start (int): начало раздела
+        end (int): конец раздела
+        max_chars (int): максимальная длина фрагмента
+
+    Returns:
+        list: фрагменты (начало, конец)
+    """
+    groups = []
+    group_start = group_end = None
+    for match in PARAGRAPH_PATTERN.finditer(text, start, end):
+        if group_start is not None and match.end() - group_start > max_chars:
+            groups.append((group_start, group_end))
+            group_start = None
+        if group_start is None:
+            group_start = match.start()
+        group_end = match.end()
+    if group_start is not None:
+        groups.append((group_start, group_end))
+    return groups
+
+
+def split_parent_child(doc: Document, parent_size: int = PARENT_CHUNK_SIZE):
+    """
+    Разбивает статью по разделам на родительские фрагменты (группы абзацев раздела),
+    а фрагменты - на чанки-потомки для векторного индекса. У потомков в метаданных
+    parent_id фрагмента, название раздела и позиция в статье (start_index)
+
+    Args:
+        doc (Document): статья с метаданными source и title
+        parent_size (int): максимальная длина родительского фрагмента
+
+    Returns:
+        tuple: чанки-потомки (list) и фрагменты (dict: идентификатор -> {"text", "metadata"})
+    """
+    text = doc.page_content
+    children = []
+    parents = {}
+    for section, start, end in split_sections(text):
+        for parent_start, parent_end in group_paragraphs(text, start, end, parent_size):
+            parent = Document(
+                page_content=text[parent_start:parent_end],
+                metadata={**doc.metadata, "section": section or doc.metadata.get("title"),
+                          "start_index": parent_start},
+            )
+            parent_id = chunk_id(parent)
+            parents[parent_id] = {"text": parent.page_content, "metadata": parent.metadata}
+            for child in get_child_splitter().split_documents([parent]):
+                child.metadata["start_index"] += parent_start
+                child.metadata["parent_id"] = parent_id
+                children.append(child)
+    return children, parents
+
+
+def split_document(doc: Document, chunking: str = CHUNKING):
+    """
+    Разбивает статью на чанки выбранным способом
+
+    Args:
+        doc (Document): статья
+        chunking (str): "markdown" или "recursive", см. CHUNKING
+
+    Returns:
+        tuple: чанки (list) и родительские фрагменты (dict, пустой при "recursive")
+    """
+    if chunking == "markdown":
+        return split_parent_child(doc)
+    return get_text_splitter().split_documents([doc]), {}
+
+
+def list_markdown_files(*folders: str):
+    """
+    Перечисляет markdown-файлы корпуса
+
+    Args:
+        folders (str): папки с файлами
+
+    Returns:
+        list: отсортированный список путей к файлам
+    """
+    return sorted(
+        os.path.join(folder, filename)
+        for folder in folders
+        for filename in os.listdir(folder)
+        if filename.endswith(".md")
+    )
+
+
+def process_file(task):
+    """
+    Читает и разбивает на чанки один файл. Выполняется в пуле процессов
+
+    Args:
+        task (tuple): путь к файлу, хэш из манифеста (или None) и способ разбиения
+
+    Returns:
+        tuple: (путь, хэш содержимого, список чанков, родительские фрагменты). Список чанков
+               равен None, если файл не изменился; хэш равен None, если файл не удалось прочитать
+    """
+    file_path, old_hash, chunking = task
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            content = file.read()
+    except Exception as e:
+        print(f"Ошибка при загрузке файла {file_path}: {str(e)}")
+        return file_path, None, None, None
+
+    file_hash = content_hash(content)
+    if file_hash == old_hash:
+        return file_path, file_hash, None, None
+
+    doc = Document(
+        page_content=content,
+        metadata={
+            "source": file_path,
+            "title": os.path.splitext(os.path.basename(file_path))[0]
+        }
+    )
+    return (file_path, file_hash, *split_document(doc, chunking))
+
+
+def map_bounded(fn, tasks, workers: int):
+    """
+    Упорядоченный map по пулу процессов, держащий в работе не более workers * 4 задач,
+    чтобы результаты не накапливались в памяти быстрее, чем их потребляют
+
+    Args:
+        fn (callable): функция обработки задачи
+        tasks (iterable): задачи
+        workers (int): количество процессов; при 1 обработка идет в текущем процессе
+
+    Returns:
+        generator: результаты в порядке задач
+    """
+    if workers <= 1:
+        yield from map(fn, tasks)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(fn, task))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class VectorStoreWriter:
+    """
+    Пакетная запись чанков в векторную базу: эмбеддинги считаются и записываются
+    батчами по batch_size, поэтому в памяти находится не больше одного батча
+    """
+    def __init__(self, persist_directory: str, batch_size: int, reset: bool):
+        """
+        Args:
+            persist_directory (str): каталог векторной базы
+            batch_size (int): размер батча эмбеддингов и записи
+            reset (bool): пересоздать коллекцию при первом обращении
+
+        Returns:
+            None
+        """
+        self.persist_directory = persist_directory
+        self.batch_size = batch_size
+        self.reset = reset
+        self.added = 0
+        self.deleted = 0
+        self.embed_seconds = 0.0
+        self._store = None
+        self._pending = []
+
+    def get_store(self):
+        """
+        Векторное хранилище, открываемое (и загружающее модель) только при первой записи
+
+        Returns:
+            Chroma: векторное хранилище
+        """
+        if self._store is None:
+            self._store = get_vector_store(self.persist_directory, self.batch_size)
+            if self.reset:
+                # Без манифеста неизвестно, какие векторы уже лежат в коллекции, поэтому она пересоздается
+                print("Манифест не найден, коллекция пересоздается")
+                self._store.reset_collection()
+        return self._store
+
+    def add(self, split_id: str, split: Document):
+        """
+        Добавляет чанк в очередь записи
+
+        Args:
+            split_id (str): идентификатор чанка
+            split (Document): чанк
+
+        Returns:
+            None
+        """
+        self._pending.append((split_id, split))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def delete(self, ids):
+        """
+        Удаляет векторы по идентификаторам
+
+        Args:
+            ids (list): идентификаторы чанков
+
+        Returns:
+            None
+        """
+        if ids:
+            self.get_store().delete(ids=list(ids))
+            self.deleted += len(ids)
+
+    def flush(self):
+        """
+        Считает эмбеддинги накопленного батча и записывает его одним вызовом
+
+        Returns:
+            None
+        """
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        started = time.perf_counter()
+        self.get_store().add_documents([split for _, split in batch], ids=[split_id for split_id, _ in batch])
+        self.embed_seconds += time.perf_counter() - started
+        self.added += len(batch)
+        print(f"Записано векторов: {self.added}")
+
+
+def build_side_indexes(vector_store, version: str, index_directory: str, lexical_index_path: str):
+    """
+    Выгружает эмбеддинги, тексты и метаданные из Chroma и строит по ним индексы,
+    которые бот использует без обращения к Chroma: NumpyVectorIndex и LexicalIndex
+
+    Args:
+        vector_store (Chroma): векторное хранилище
+        version (str): версия базы знаний
+        index_directory (str): каталог индекса NumpyVectorIndex
+        lexical_index_path (str): путь к файлу LexicalIndex
+
+    Returns:
+        None
+    """
+    data = vector_store.get(include=["embeddings", "documents", "metadatas"])
+    NumpyVectorIndex.build(index_directory, data["ids"], data["embeddings"], data["documents"], data["metadatas"],
+                           version)
+    LexicalIndex.build(lexical_index_path, data["ids"], data["documents"], data["metadatas"], version)
+    print(f"Индексы NumPy и лексический построены: {len(data['ids'])} чанков")
+
+
+def ingest(full: bool = False,
+           workers: int = INGEST_WORKERS,
+           batch_size: int = EMBED_BATCH_SIZE,
+           persist_directory: str = VECTOR_DB_DIR,
+           manifest_path: str = MANIFEST_PATH,
+           index_directory: str = NUMPY_INDEX_DIR,
+           lexical_index_path: str = LEXICAL_INDEX_PATH,
+           chunking: str = CHUNKING,
+           parent_store_path: str = PARENT_STORE_PATH) -> dict:
+    """
+    Инкрементально обновляет векторную базу: эмбеддинги считаются только для новых
+    и измененных чанков, векторы удаленных файлов и устаревших чанков удаляются.
+    Чтение и разбиение файлов идет в пуле процессов, эмбеддинги и запись - батчами.
+    Если корпус не изменился, модель эмбеддингов даже не загружается. При разбиении
+    "markdown" рядом с индексами сохраняется хранилище родительских фрагментов
+
+    Args:
+        full (bool): полностью пересоздать коллекцию, игнорируя манифест
+        workers (int): количество процессов для чтения и разбиения файлов
+        batch_size (int): размер батча эмбеддингов и записи в базу
+        persist_directory (str): каталог векторной базы
+        manifest_path (str): путь к файлу манифеста
+        index_directory (str): каталог индекса NumpyVectorIndex
+        lexical_index_path (str): путь к файлу LexicalIndex
+        chunking (str): способ разбиения, см. CHUNKING
+        parent_store_path (str): путь к хранилищу родительских фрагментов
+
+    Returns:
+        dict: статистика запуска
+    """
+    started = time.perf_counter()
+    manifest = None if full else load_manifest(manifest_path)
+    if manifest is not None and manifest.get("chunking", "recursive") != chunking:
+        print(f"Способ разбиения изменился на {chunking}")
+        manifest = None
+    if manifest is not None and chunking == "markdown" and \
+            ParentStore.read_version(parent_store_path) != manifest["version"]:
+        print("Хранилище родительских фрагментов не соответствует манифесту")
+        manifest = None
+    old_files = manifest["files"] if manifest else {}
+    # Фрагменты неизмененных файлов переносятся из прежнего хранилища
+    old_parents = ParentStore.load(parent_store_path).parents if manifest and chunking == "markdown" else {}
+
+    files = list_markdown_files(WINES_DIR, REGIONS_DIR)
+    print(f"Всего документов: {len(files)}")
+
+    writer = VectorStoreWriter(persist_directory, batch_size, reset=manifest is None)
+    new_files = {}
+    unchanged_files = 0
+    chunks = 0
+    new_parents = {}
+    tasks = ((path, old_files.get(path, {}).get("hash"), chunking) for path in files)
+    for source, file_hash, splits, parents in map_bounded(process_file, tasks, workers):
+        old_entry = old_files.get(source)
+        if file_hash is None:
+            if old_entry:
+                new_files[source] = old_entry
+            continue
+        if splits is None:
+            new_files[source] = old_entry
+            unchanged_files += 1
+            continue
+
+        ids = [chunk_id(split) for split in splits]
+        chunks += len(ids)
+        old_ids = set(old_entry["chunks"]) if old_entry else set()
+        writer.delete(old_ids - set(ids))
+        for split_id, split in zip(ids, splits):
+            if split_id not in old_ids:
+                writer.add(split_id, split)
+        new_files[source] = {"hash": file_hash, "chunks": ids}
+        if parents:
+            new_files[source]["parents"] = sorted(parents)
+            new_parents.update(parents)
+
+    for source, old_entry in old_files.items():
+        if source not in new_files:
+            print(f"Файл удален: {source}")
+            writer.delete(old_entry["chunks"])
+
+    writer.flush()
+    if manifest is None:
+        # Коллекцию нужно пересоздать, даже если в корпусе не нашлось чанков для записи
+        writer.get_store()
+
+    all_ids = sorted(split_id for entry in new_files.values() for split_id in entry["chunks"])
+    version = content_hash("\n".join(all_ids))
+    if NumpyVectorIndex.read_version(index_directory) != version or \
+            LexicalIndex.read_version(lexical_index_path) != version:
+        build_side_indexes(writer.get_store(), version, index_directory, lexical_index_path)
+    parent_ids = [parent_id for entry in new_files.values() for parent_id in entry.get("parents", [])]
+    if chunking == "markdown" and ParentStore.read_version(parent_store_path) != version:
+        parents = {parent_id: new_parents.get(parent_id) or old_parents[parent_id] for parent_id in parent_ids}
+        ParentStore.build(parent_store_path, parents, version)
+        print(f"Хранилище родительских фрагментов построено: {len(parents)} фрагментов")
+    save_manifest({"version": version, "chunking": chunking, "files": new_files}, manifest_path)
+
+    stats = {
+        "files": len(files),
+        "changed_files": len(files) - unchanged_files,
+        "unchanged_files": unchanged_files,
+        "chunks": chunks,
+        "parents": len(parent_ids),
+        "added": writer.added,
+        "deleted": writer.deleted,
+        "embed_seconds": writer.embed_seconds,
+        "total_seconds": time.perf_counter() - started,
+    }
+    print(f"Без изменений: {unchanged_files} файлов, добавлено чанков: {writer.added}, удалено: {writer.deleted}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Построение векторной базы знаний")
+    parser.add_argument("--full", action="store_true", help="пересоздать базу с нуля")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="процессов для чтения и разбиения")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="размер батча эмбеддингов")
+    args = parser.parse_args()
+
+    ingest(full=args.full, workers=args.workers, batch_size=args.batch_size)
+    print("Готово! Векторная база успешно обновлена.")
@@ -1,22 +1,43 @@
 import os
 import json
 import re
+import time
+import asyncio
+import argparse
+from collections import OrderedDict
 
 from aiogram import types
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Awaitable, Union
 from typing_extensions import TypedDict
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
-
-from DeepSeekR1 import DeepSeekAPI
-from RAG import ask_question
+from langgraph.types import StreamWriter
+
+from DeepSeekR1 import get_client
+from resilience import LLMError
+from metrics import (instrument_node, new_trace_id, log_event, MESSAGES_TOTAL, FLOOD_TOTAL, EXTRACTION_TOTAL,
+                     start_metrics_server, stop_metrics_server)
+import RAG
+from RAG import aask_question, astream_question
 from config import *
 from database import UserMessagesDB
+from preclassifier import CentroidClassifier
+from flood import FloodDetector
+from extraction import extract_lead, profile_lead, merge_lead, missing_fields
+from message_record import MessageRecord
+from scheduler import PRIORITY_APPLICATION, PRIORITY_DEFAULT, PRIORITY_LOW
 
 
 load_dotenv()
 
-llm = DeepSeekAPI(os.environ["DEEP_API_TOKEN"])
+llm = get_client(os.environ["DEEP_API_TOKEN"])
+db = UserMessagesDB(DSN)
+preclassifier = CentroidClassifier(RAG.embeddings) if PRECLASSIFIER_ENABLED else None
+flood_detector = FloodDetector() if FLOOD_DETECTION else None
+warm_up_task = None
+# Метки локального классификатора, полученные при оценке приоритета: (chat_id, message_id) -> метка.
+# run_agent передает метку в состояние графа, чтобы classify_message не классифицировал текст повторно
+_local_labels = OrderedDict()
 
 
 def clean_json_string(raw_str: str) -> str:
@@ -37,32 +58,95 @@ def clean_json_string(raw_str: str) -> str:
         cleaned = match.group(1).strip()
         print(f"[clean_json_string] Удалена обёртка. Результат:\n{cleaned}")
         return cleaned
+    # Модель может добавить пояснение до или после JSON без обертки
+    match = re.search(r"\{.*\}", raw_str, re.DOTALL)
+    if match:
+        return match.group(0)
     else:
         print("[clean_json_string] Обёртка не найдена, возвращаем строку как есть.")
         return raw_str.strip()
 
 
+def parse_collected_info(raw_str: str) -> Dict[str, Any]:
+    """
+    Извлекает словарь с данными из JSON-ответа модели
+
+    Args:
+        raw_str (str): ответ модели, возможно обернутый в ```json ... ```
+
+    Returns:
+        Dict: распарсенные данные или пустой словарь, если JSON некорректен
+    """
+    cleaned_json = clean_json_string(raw_str)
+    print(f"Очищенный JSON-стринг:\n{cleaned_json}")
+
+    try:
+        collected_data = json.loads(cleaned_json)
+        print(f"Распарсенные данные: {collected_data}")
+    except json.JSONDecodeError as e:
+        print(f"Ошибка при парсинге JSON: {e}")
+        log_event("collected_info_invalid", error=str(e), raw=raw_str[:200])
+        collected_data = {}
+
+    return collected_data if isinstance(collected_data, dict) else {}
+
+
 class GraphState(TypedDict):
     """
     Определение структуры состояния графа
 
     Attributes:
-        user (Message): объект сообщения принимаемый на входе телеграмм-ботом
+        user (Message): объект сообщения принимаемый на входе телеграмм-ботом или MessageRecord
+            при обработке без Telegram (batch.py)
         message (str): текст сообщения
         response (str): сообщение для обратной связи пользователю
         status (str): текущий статус обработки сообщения
         next_node (str): узел выполнения, следующий за текущим
-        collected_info (Dict[str, Any]): список информации из сообщения пользователя для созранения в базу данных
+        collected_info (Dict[str, Any]): список информации из сообщения пользователя для созранения в базу данных;
+            заполняется уже на этапе классификации, если модель вернула метку и данные одним ответом
+        local_label (str): метка локального классификатора, полученная планировщиком (estimate_priority);
+            None - классификатор не уверен. Если поля нет, classify_message классифицирует сообщение сам
     """
-    user: types.Message
+    user: Union[types.Message, MessageRecord]
     message: str
     response: str
     status: str
     next_node: str
     collected_info: Dict[str, Any]
+    local_label: str
+
 
+SPAM_RESPONSE = "Пожалуйста, не присылайте бессмысленные сообщения"
+
+
+async def fingerprint(state: GraphState) -> Dict[str, Any]:
+    """
+    Проверка на флуд до классификации: почти повтор недавнего спама или слишком
+    частые сообщения пользователя сразу получают вердикт "спам" без обращения к модели.
+    Частота не проверяется для MessageRecord: пакетный прогон обрабатывает накопленные
+    сообщения быстрее, чем их присылали, и частота обработки ничего не говорит об авторе
+
+    Args:
+        state (GraphState): текущее состояние графа
 
-def classify_message(state: GraphState) -> Dict[str, Any]:
+    Returns:
+        Dict: словарь обновленного состояния графа
+    """
+    if flood_detector is None:
+        return {"next_node": "classify"}
+    user = state["user"]
+    user_id = user.from_user.id if user.from_user else user.chat.id
+    rate_user_id = None if isinstance(user, MessageRecord) else user_id
+    verdict, reason = flood_detector.check(state["message"], user_id=rate_user_id)
+    if verdict is None:
+        return {"next_node": "classify"}
+    FLOOD_TOTAL.inc(reason)
+    log_event("flood", reason=reason, user_id=user_id)
+    print(f"Сообщение отсеяно как флуд ({reason})")
+    return {"status": "spam", "next_node": "END", "response": SPAM_RESPONSE}
+
+
+async def classify_message(state: GraphState) -> Dict[str, Any]:
     """
     Классификация входящего сообщения
 
@@ -74,37 +158,68 @@ def classify_message(state: GraphState) -> Dict[str, Any]:
 
     """
     message = state["message"]
-    response = llm.classify(text=message).lower()
+    response = None
+    collected_data = None
+    if "local_label" in state:
+        response = state["local_label"]
+    elif preclassifier is not None:
+        response = await asyncio.to_thread(preclassifier.classify, message)
+    try:
+        if response is not None:
+            print("Сообщение классифицировано локально")
+        elif CLASSIFY_AND_EXTRACT:
+            raw_response = await llm.classify_and_collect(text=message)
+            collected_data = parse_collected_info(raw_response)
+            response = str(collected_data.pop("label", None) or raw_response).lower()
+        else:
+            response = (await llm.classify(text=message)).lower()
+    except LLMError as e:
+        print(f"Модель не классифицировала сообщение: {e!r}")
+        return {"status": "error", "next_node": "END", "response": LLM_ERROR_TEXT}
 
     if "спам" in response:
         print("Сообщение определено как спам")
-        return {"status": "spam", "next_node": "END", "response": "Пожалуйста, не присылайте бессмысленные сообщения"}
+        if flood_detector is not None:
+            flood_detector.remember(message, "спам")
+        return {"status": "spam", "next_node": "END", "response": SPAM_RESPONSE}
     elif "заявка" in response:
         print("Сообщение определено как заявка")
-        return {"status": "application", "next_node": "collect_info"}
+        update = {"status": "application", "next_node": "collect_info"}
+        if collected_data:
+            update["collected_info"] = collected_data
+        return update
     else:
         print("Сообщение определено как вопрос")
         return {"status": "question", "next_node": "retrieve"}
 
 
-def retrieve(state: GraphState) -> Dict[str, Any]:
+async def retrieve(state: GraphState, writer: StreamWriter) -> Dict[str, Any]:
     """
-    Поиск информации по вопросу
+    Поиск информации по вопросу. При включенном STREAM_ANSWERS фрагменты ответа
+    публикуются в поток custom графа по мере генерации
 
     Args:
         state (GraphState): текущее состояние графа
+        writer (StreamWriter): запись в поток custom, передается LangGraph
 
     Returns:
         Dict: словарь обновленного состояния графа"""
 
     text = state["message"]
-    response = ask_question(text)
+    if STREAM_ANSWERS:
+        parts = []
+        async for token in astream_question(text):
+            parts.append(token)
+            writer({"token": token})
+        response = "".join(parts).strip()
+    else:
+        response = await aask_question(text)
     return {
         "next_node": END,
         "response": response
     }
 
-def collect_info(state: GraphState) -> Dict[str, Any]:
+async def collect_info(state: GraphState) -> Dict[str, Any]:
     """
     Собирает контактную информацию из сообщения пользователя
 
@@ -115,18 +230,20 @@ def collect_info(state: GraphState) -> Dict[str, Any]:
         Dict: словарь обновленного состояния графа
     """
     print("collect_info")
-    collected_json_str = llm.collect_info(state["message"])
-    print(f"collected_json_str (repr): {repr(collected_json_str)}")
-
-    cleaned_json = clean_json_string(collected_json_str)
-    print(f"Очищенный JSON-стринг:\n{cleaned_json}")
-
-    try:
-        collected_data = json.loads(cleaned_json)
-        print(f"Распарсенные данные: {collected_data}")
-    except json.JSONDecodeError as e:
-        print(f"Ошибка при парсинге JSON: {e}")
-        collected_data = {}
+    collected_data = state.get("collected_info")
+    if LOCAL_EXTRACTION:
+        collected_data = await collect_missing_info(state["message"], state["user"].from_user, collected_data or {})
+    elif collected_data is None:
+        try:
+            collected_json_str = await llm.collect_info(state["message"])
+        except LLMError as e:
+            # Заявка все равно сохраняется: текст сообщения и автор остаются в базе
+            print(f"Модель не извлекла данные заявки: {e!r}")
+            collected_json_str = "{}"
+        print(f"collected_json_str (repr): {repr(collected_json_str)}")
+        collected_data = parse_collected_info(collected_json_str)
+    else:
+        print("Данные заявки уже извлечены при классификации")
 
     return {
         "response": f"Благодарим за обращение, в ближайшее время с вами свяжутся!",
@@ -135,6 +252,39 @@ def collect_info(state: GraphState) -> Dict[str, Any]:
     }
 
 
+async def collect_missing_info(text: str, user: types.User, collected_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Дополняет данные заявки: контакты, имя и продукт (если назван сорт из базы знаний)
+    извлекаются из текста локально и важнее ответа модели, имя и имя пользователя из профиля
+    Telegram заполняют то, чего нет в тексте. Модель запрашивается только о полях, которые
+    после этого остались пустыми; чаще всего это продукт, названный не сортом
+    ("ящик красного сухого", "сертификат")
+
+    Args:
+        text (str): текст сообщения
+        user (User): автор сообщения
+        collected_data (Dict): ответ модели при совмещенной классификации или пустой словарь
+
+    Returns:
+        Dict: данные заявки {"contact_info", "fio", "product"}
+    """
+    lead = merge_lead(merge_lead(extract_lead(text), collected_data), profile_lead(user))
+    # Поля, которые модель уже искала при классификации и не нашла, повторно не запрашиваются
+    missing = [field for field in missing_fields(lead) if field not in collected_data]
+    if not missing:
+        EXTRACTION_TOTAL.inc("local")
+        print("Данные заявки извлечены без отдельного запроса к модели")
+        return lead
+    EXTRACTION_TOTAL.inc("llm")
+    try:
+        raw_response = await llm.collect_fields(text, missing)
+    except LLMError as e:
+        # Заявка все равно сохраняется с тем, что удалось извлечь локально
+        print(f"Модель не извлекла поля {missing}: {e!r}")
+        return lead
+    return merge_lead(lead, parse_collected_info(raw_response))
+
+
 async def save_to_db(state: GraphState) -> Dict[str, Any]:
     """
     Сохраняет информацию в базу данных
@@ -146,14 +296,10 @@ async def save_to_db(state: GraphState) -> Dict[str, Any]:
         Dict: словарь обновленного состояния графа
     """
     print("save_to_db")
-    db = UserMessagesDB(DSN)
-    await db.connect()
-    await db.create_table()
-
     contact_info = state.get("collected_info", {}).get("contact_info")
     fio = state.get("collected_info", {}).get("fio")
     product = state.get("collected_info", {}).get("product")
-    await db.save_message(state["user"], contact_info, fio, product)
+    await db.enqueue_message(state["user"], contact_info, fio, product)
 
     return {
         "status": "completed",
@@ -163,12 +309,22 @@ async def save_to_db(state: GraphState) -> Dict[str, Any]:
 
 workflow = StateGraph(GraphState)
 
-workflow.add_node("classify", classify_message)
-workflow.add_node("retrieve", retrieve)
-workflow.add_node("collect_info", collect_info)
-workflow.add_node("save_to_db", save_to_db)
+workflow.add_node("fingerprint", instrument_node("fingerprint", fingerprint))
+workflow.add_node("classify", instrument_node("classify", classify_message))
+workflow.add_node("retrieve", instrument_node("retrieve", retrieve))
+workflow.add_node("collect_info", instrument_node("collect_info", collect_info))
+workflow.add_node("save_to_db", instrument_node("save_to_db", save_to_db))
 
-workflow.set_entry_point("classify")
+workflow.set_entry_point("fingerprint")
+
+workflow.add_conditional_edges(
+    "fingerprint",
+    lambda state: state["next_node"],
+    {
+        "classify": "classify",
+        "END": END
+    }
+)
 
 workflow.add_conditional_edges(
     "classify",
@@ -186,31 +342,147 @@ workflow.add_edge("save_to_db", END)
 
 graph = workflow.compile()
 
-graph_image = graph.get_graph().draw_mermaid_png()
-with open("../graph_image.png", "wb") as png:
-    png.write(graph_image)
-
-async def run_agent(message: types.Message) -> str:
+async def run_agent(message: types.Message, on_token: Callable[[str], Awaitable[None]] = None) -> str:
     """
-    Асинхронный запуск агента для обработки сообщения
+    Асинхронный запуск агента для обработки сообщения. Каждому сообщению назначается
+    trace_id, который попадает во все структурированные записи журнала по этому сообщению
 
     Args:
         message (Message): объект сообщения от пользователя
+        on_token (Callable): корутина, получающая фрагменты ответа по мере генерации
 
     Returns:
         last_response (str): Ответ пользователю
     """
     inputs = {"user": message, "message": message.text}
+    label_key = (message.chat.id, message.message_id)
+    if label_key in _local_labels:
+        inputs["local_label"] = _local_labels.pop(label_key)
     last_response = "Не удалось обработать запрос."
+    status = "unknown"
+    trace_id = new_trace_id()
+    started = time.perf_counter()
+    log_event("message_received", chat_id=message.chat.id, message_id=message.message_id)
 
     try:
-        async for output in graph.astream(inputs):
-            if output:
+        async for mode, output in graph.astream(inputs, stream_mode=["updates", "custom"]):
+            if mode == "custom":
+                if on_token is not None and "token" in output:
+                    await on_token(output["token"])
+            elif output:
                 last_node = list(output.keys())[0]
                 last_response = output[last_node].get("response", last_response)
+                status = output[last_node].get("status", status)
 
         return last_response
 
     except Exception as e:
-        print(f"Ошибка обработки: {e}")
-        return "Произошла ошибка при обработке запроса"
\ No newline at end of file
+        status = "failed"
+        print(f"Ошибка обработки ({trace_id}): {e}")
+        return "Произошла ошибка при обработке запроса"
+
+    finally:
+        MESSAGES_TOTAL.inc(status)
+        log_event("message_done", status=status, seconds=round(time.perf_counter() - started, 4))
+
+
+async def estimate_priority(message: types.Message) -> int:
+    """
+    Оценивает класс приоритета сообщения для планировщика по локальному классификатору.
+    Пока модель эмбеддингов не прогрета, все сообщения получают обычный приоритет.
+    Метка запоминается для run_agent, см. _local_labels
+
+    Args:
+        message (Message): объект сообщения от пользователя
+
+    Returns:
+        int: класс приоритета (меньше - раньше)
+    """
+    if preclassifier is None or not RAG.is_ready() or not message.text:
+        return PRIORITY_DEFAULT
+    label = await asyncio.to_thread(preclassifier.classify, message.text)
+    _local_labels[(message.chat.id, message.message_id)] = label
+    # Метки отклоненных планировщиком сообщений не будут забраны: храним не больше, чем сообщений в очередях
+    while len(_local_labels) > SCHEDULER_MAX_PENDING + SCHEDULER_MAX_CONCURRENCY:
+        _local_labels.popitem(last=False)
+    if label == "заявка":
+        return PRIORITY_APPLICATION
+    if label == "спам":
+        return PRIORITY_LOW
+    return PRIORITY_DEFAULT
+
+
+async def startup():
+    """
+    Подготавливает ресурсы агента: открывает пул соединений к базе данных,
+    создает таблицу заявок, запускает эндпоинт метрик и фоновый прогрев RAG. Вызывается один раз
+    при запуске бота
+
+    Returns:
+        None
+    """
+    global warm_up_task
+    await db.connect()
+    await db.create_table()
+    await start_metrics_server()
+    warm_up_task = asyncio.create_task(warm_up())
+
+
+async def warm_up():
+    """
+    Фоновый прогрев модели эмбеддингов, векторного хранилища и локального классификатора
+
+    Returns:
+        None
+    """
+    try:
+        await RAG.warm_up()
+        if preclassifier is not None:
+            await asyncio.to_thread(preclassifier.fit)
+    except Exception as e:
+        print(f"Ошибка прогрева: {e}")
+
+
+def render_graph(path: str):
+    """
+    Сохраняет схему графа агента в PNG. Рендеринг выполняется удаленным сервисом
+    mermaid, поэтому вызывается только явно
+
+    Args:
+        path (str): путь к файлу изображения
+
+    Returns:
+        None
+    """
+    graph_image = graph.get_graph().draw_mermaid_png()
+    with open(path, "wb") as png:
+        png.write(graph_image)
+
+
+async def shutdown():
+    """
+    Освобождает ресурсы агента: записывает буфер заявок, закрывает пул базы данных,
+    пулы HTTP-соединений к модели и эндпоинт метрик
+
+    Returns:
+        None
+    """
+    await stop_metrics_server()
+    try:
+        await db.close()
+    finally:
+        # Сессии модели закрываются, даже если последние заявки не удалось записать
+        await llm.close()
+        await RAG.async_llm.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Служебные команды агента")
+    parser.add_argument("--draw-graph", metavar="PATH", help="сохранить схему графа в PNG")
+    args = parser.parse_args()
+
+    if args.draw_graph:
+        render_graph(args.draw_graph)
+        print(f"Схема графа сохранена в {args.draw_graph}")
+    else:
+        parser.print_help()
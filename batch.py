@@ -0,0 +1,368 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+
+import agent
+from config import DSN, BATCH_CONCURRENCY, BATCH_RATE, BATCH_CHECKPOINT_EVERY
+from message_record import MessageRecord
+from metrics import new_trace_id, log_event, MESSAGES_TOTAL
+from database import UserMessagesDB
+
+
+class RateLimiter:
+    """
+    Ограничение частоты: вызовы acquire разносятся не чаще rate в секунду
+    """
+    def __init__(self, rate: float):
+        """
+        Args:
+            rate (float): допустимое количество вызовов в секунду; 0 - без ограничения
+
+        Returns:
+            None
+        """
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Дожидается очередного разрешенного момента
+
+        Returns:
+            None
+        """
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+
+class Checkpoint:
+    """
+    Контрольная точка пакетного прогона: номера обработанных строк входного файла
+    (все строки до watermark и отдельные строки после нее) и длина выходного файла
+    на момент сохранения
+    """
+    def __init__(self, path: str, input_path: str):
+        """
+        Args:
+            path (str): путь к файлу контрольной точки
+            input_path (str): путь к входному файлу (проверяется при возобновлении)
+
+        Returns:
+            None
+        """
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.watermark = 0
+        self.done = set()
+        self.output_size = 0
+
+    def load(self) -> bool:
+        """
+        Загружает сохраненную контрольную точку
+
+        Returns:
+            bool: True, если контрольная точка найдена
+
+        Raises:
+            ValueError: контрольная точка относится к другому входному файлу
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as file:
+            data = json.load(file)
+        if data["input"] != self.input_path:
+            raise ValueError(f"контрольная точка {self.path} относится к файлу {data['input']}")
+        self.watermark = data["watermark"]
+        self.done = set(data["done"])
+        self.output_size = data["output_size"]
+        return True
+
+    def is_done(self, line: int) -> bool:
+        """
+        Args:
+            line (int): номер строки входного файла, с нуля
+
+        Returns:
+            bool: True, если строка уже обработана
+        """
+        return line < self.watermark or line in self.done
+
+    def mark(self, line: int):
+        """
+        Отмечает строку обработанной и сдвигает watermark
+
+        Args:
+            line (int): номер строки входного файла, с нуля
+
+        Returns:
+            None
+        """
+        self.done.add(line)
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += 1
+
+    def save(self, watermark: int, done: set, output_size: int):
+        """
+        Атомарно записывает контрольную точку (через временный файл и os.replace)
+
+        Args:
+            watermark (int): все строки до этого номера обработаны
+            done (set): обработанные строки после watermark
+            output_size (int): длина выходного файла, в байтах
+
+        Returns:
+            None
+        """
+        data = {"input": self.input_path, "watermark": watermark, "done": sorted(done),
+                "output_size": output_size}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def read_records(path: str, checkpoint: Checkpoint):
+    """
+    Построчно читает входной файл, пропуская обработанные строки
+
+    Args:
+        path (str): путь к JSONL
+        checkpoint (Checkpoint): контрольная точка
+
+    Yields:
+        tuple: (номер строки, MessageRecord или None, ошибка разбора или None)
+    """
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file):
+            if checkpoint.is_done(line_number) or not line.strip():
+                continue
+            try:
+                yield line_number, MessageRecord.from_dict(json.loads(line), default_id=line_number + 1), None
+            except ValueError as e:
+                yield line_number, None, str(e)
+
+
+async def process_record(record: MessageRecord) -> dict:
+    """
+    Прогоняет сообщение через граф агента
+
+    Args:
+        record (MessageRecord): сообщение
+
+    Returns:
+        dict: status, response и collected_info итогового состояния графа
+    """
+    new_trace_id()
+    status = "failed"
+    started = time.perf_counter()
+    log_event("message_received", chat_id=record.chat.id, message_id=record.message_id, source="batch")
+    try:
+        state = await agent.graph.ainvoke({"user": record, "message": record.text})
+        status = state.get("status", "unknown")
+        return {"status": status, "response": state.get("response"), "collected_info": state.get("collected_info")}
+    finally:
+        MESSAGES_TOTAL.inc(status)
+        log_event("message_done", status=status, seconds=round(time.perf_counter() - started, 4))
+
+
+class BatchRunner:
+    """
+    Пакетный прогон очереди сообщений без Telegram. Входной JSONL читается построчно
+    (поля text, user_id, chat_id, message_id, username, first_name, last_name, date;
+    обязательно только text), сообщения проходят граф агента с ограничением параллельности
+    и частоты, результаты дописываются в выходной JSONL, заявки пишутся в user_requests
+    пакетами. Прогресс сохраняется в <output>.checkpoint, повторный запуск продолжает прогон
+    """
+    def __init__(self, input_path: str, output_path: str, concurrency: int = BATCH_CONCURRENCY,
+                 rate: float = BATCH_RATE, checkpoint_every: int = BATCH_CHECKPOINT_EVERY):
+        """
+        Args:
+            input_path (str): входной JSONL
+            output_path (str): выходной JSONL
+            concurrency (int): количество одновременно обрабатываемых сообщений
+            rate (float): сообщений в секунду; 0 - без ограничения
+            checkpoint_every (int): через сколько обработанных сообщений сохранять контрольную точку
+
+        Returns:
+            None
+        """
+        self.input_path = input_path
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint = Checkpoint(f"{output_path}.checkpoint", input_path)
+        self.stats = {"processed": 0, "failed": 0, "skipped": 0}
+        self._output = None
+        self._since_checkpoint = 0
+        self._checkpoint_lock = asyncio.Lock()
+
+    def _open_output(self):
+        """
+        Открывает выходной файл; при возобновлении отбрасывает строки, записанные
+        после последней контрольной точки (эти сообщения будут обработаны заново)
+
+        Returns:
+            None
+        """
+        resumed = self.checkpoint.load()
+        if resumed:
+            print(f"[batch] Продолжение: обработано строк до {self.checkpoint.watermark} "
+                  f"и еще {len(self.checkpoint.done)}")
+            if os.path.exists(self.output_path):
+                self._output = open(self.output_path, "r+b")
+                self._output.truncate(self.checkpoint.output_size)
+                self._output.seek(self.checkpoint.output_size)
+            else:
+                print(f"[batch] Выходной файл {self.output_path} не найден, результаты прошлых запусков потеряны")
+                self._output = open(self.output_path, "wb")
+        else:
+            self._output = open(self.output_path, "wb")
+
+    def _write_result(self, line: int, result: dict):
+        """
+        Дописывает результат в выходной файл и отмечает строку обработанной
+
+        Args:
+            line (int): номер строки входного файла
+            result (dict): результат обработки
+
+        Returns:
+            None
+        """
+        payload = json.dumps({"line": line, **result}, ensure_ascii=False, default=str)
+        self._output.write(payload.encode("utf-8") + b"\n")
+        self.checkpoint.mark(line)
+        self._since_checkpoint += 1
+
+    async def save_checkpoint(self):
+        """
+        Сохраняет контрольную точку. Состояние фиксируется до записи буфера заявок: заявки
+        всех отмеченных сообщений к этому моменту уже в буфере, поэтому после flush
+        контрольная точка не опережает базу данных
+
+        Returns:
+            None
+        """
+        async with self._checkpoint_lock:
+            self._since_checkpoint = 0
+            self._output.flush()
+            snapshot = (self.checkpoint.watermark, set(self.checkpoint.done), self._output.tell())
+            await agent.db.flush()
+            os.fsync(self._output.fileno())
+            self.checkpoint.save(*snapshot)
+
+    async def _worker(self, queue: asyncio.Queue):
+        """
+        Обрабатывает сообщения из очереди до получения None
+
+        Args:
+            queue (Queue): очередь (номер строки, запись, ошибка разбора)
+
+        Returns:
+            None
+        """
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            line, record, error = item
+            if record is None:
+                self.stats["skipped"] += 1
+                self._write_result(line, {"status": "invalid", "error": error})
+            else:
+                await self.limiter.acquire()
+                try:
+                    result = await process_record(record)
+                    self.stats["processed"] += 1
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    print(f"[batch] Ошибка обработки строки {line}: {e!r}")
+                    result = {"status": "failed", "error": repr(e)}
+                self._write_result(line, {"message_id": record.message_id, "chat_id": record.chat.id, **result})
+            if self._since_checkpoint >= self.checkpoint_every:
+                await self.save_checkpoint()
+
+    async def run(self):
+        """
+        Выполняет прогон. При отмене (Ctrl+C) сохраняет контрольную точку по уже
+        обработанным сообщениям
+
+        Returns:
+            dict: счетчики processed, failed, skipped
+        """
+        self._open_output()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        started = time.perf_counter()
+        try:
+            for item in read_records(self.input_path, self.checkpoint):
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.save_checkpoint()
+            self._output.close()
+        elapsed = time.perf_counter() - started
+        total = sum(self.stats.values())
+        print(f"[batch] Обработано: {self.stats['processed']}, ошибок: {self.stats['failed']}, "
+              f"пропущено некорректных строк: {self.stats['skipped']}, за {elapsed:.1f} s "
+              f"({total / elapsed if elapsed else 0:.2f} сообщ./s)")
+        return self.stats
+
+
+async def main(args):
+    """
+    Подготавливает агента и выполняет пакетный прогон
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    # Заявки пишутся только при сохранении контрольной точки, чтобы она не отставала от базы
+    agent.db = UserMessagesDB(args.dsn, flush_size=0, flush_interval=0)
+    await agent.db.connect()
+    await agent.db.create_table()
+    await agent.warm_up()
+    runner = BatchRunner(args.input, args.output, args.concurrency, args.rate, args.checkpoint_every)
+    try:
+        await runner.run()
+    finally:
+        await agent.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пакетная обработка сообщений через граф агента")
+    parser.add_argument("input", help="входной JSONL с сообщениями")
+    parser.add_argument("output", help="выходной JSONL с результатами")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=BATCH_RATE, help="сообщений в секунду, 0 - без ограничения")
+    parser.add_argument("--checkpoint-every", type=int, default=BATCH_CHECKPOINT_EVERY)
+    parser.add_argument("--dsn", default=DSN)
+    parser.add_argument("--restart", action="store_true", help="начать заново, удалив контрольную точку")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(f"{args.output}.checkpoint"):
+        os.remove(f"{args.output}.checkpoint")
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        print("[batch] Прервано, прогресс сохранен в контрольной точке")
@@ -0,0 +1,153 @@
+"""
+Сравнение разбиения статей: RecursiveCharacterTextSplitter (1000 символов, перекрытие 200)
+и разбиение по разделам на чанки-потомки с родительскими фрагментами (CHUNKING = "markdown")
+
+Для каждого способа разбивает корпус, считает эмбеддинги всех чанков моделью EMBEDDING_MODEL
+и отвечает на размеченные вопросы RETRIEVAL_EVAL_PATH векторным поиском (без BM25,
+чтобы сравнивалось только разбиение). Контекст собирается так же, как в RAG.py: найденные
+чанки (при "markdown" - их родительские фрагменты) проходят assemble_context с бюджетом
+CONTEXT_TOKEN_BUDGET. Печатает количество векторов, объем текста в индексе относительно
+корпуса, время разбиения и эмбеддингов, долю вопросов, для которых найдена нужная статья,
+долю вопросов, в контекст которых попал текст ответа, и средний размер контекста.
+
+Запуск из корня репозитория:
+    python -m benchmarks.chunking --k 6
+    python -m benchmarks.chunking --skip-embed    # только размер индекса, без модели
+"""
+import json
+import time
+import argparse
+
+import numpy as np
+
+from config import (WINES_DIR, REGIONS_DIR, EMBEDDING_MODEL, EMBED_BATCH_SIZE, CONTEXT_CANDIDATES,
+                    CONTEXT_TOKEN_BUDGET, RETRIEVAL_EVAL_PATH)
+from context import assemble_context
+from parent_store import ParentStore
+from RAG_data import load_documents_from_folder, split_document
+
+CHUNKINGS = ("recursive", "markdown")
+
+
+def load_questions(path: str) -> list:
+    """
+    Загружает размеченные вопросы
+
+    Args:
+        path (str): путь к файлу JSONL
+
+    Returns:
+        list: записи с полями question, title (статья с ответом) и answer (фрагмент текста ответа)
+    """
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def split_corpus(docs: list, chunking: str):
+    """
+    Разбивает статьи корпуса
+
+    Args:
+        docs (list): статьи
+        chunking (str): способ разбиения
+
+    Returns:
+        tuple: чанки, ParentStore (или None для "recursive") и время разбиения в секундах
+    """
+    started = time.perf_counter()
+    chunks = []
+    parents = {}
+    for doc in docs:
+        doc_chunks, doc_parents = split_document(doc, chunking)
+        chunks.extend(doc_chunks)
+        parents.update(doc_parents)
+    return chunks, ParentStore(parents) if parents else None, time.perf_counter() - started
+
+
+def evaluate(model, questions: list, chunks: list, matrix: np.ndarray, parent_store: ParentStore, k: int,
+             token_budget: int) -> dict:
+    """
+    Отвечает на вопросы векторным поиском и проверяет найденный контекст
+
+    Args:
+        model (Embeddings): модель эмбеддингов
+        questions (list): размеченные вопросы
+        chunks (list): чанки индекса
+        matrix (ndarray): нормированные эмбеддинги чанков
+        parent_store (ParentStore): родительские фрагменты или None
+        k (int): количество найденных чанков
+        token_budget (int): бюджет токенов контекста
+
+    Returns:
+        dict: source_hits, answer_hits, tokens (суммарно по вопросам)
+    """
+    result = {"source_hits": 0, "answer_hits": 0, "tokens": 0}
+    for record in questions:
+        vector = np.asarray(model.embed_query(record["question"]), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        top = np.argsort(-(matrix @ vector))[:k]
+        docs = [chunks[position] for position in top]
+        if parent_store is not None:
+            docs = parent_store.expand(docs)
+        context, stats = assemble_context(docs, token_budget)
+        result["source_hits"] += any(doc.metadata.get("title") == record["title"] for doc in docs)
+        result["answer_hits"] += record["answer"].lower() in context.lower()
+        result["tokens"] += stats["tokens"]
+    return result
+
+
+def main(args):
+    """
+    Сравнивает способы разбиения и печатает результаты
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    docs = load_documents_from_folder(WINES_DIR) + load_documents_from_folder(REGIONS_DIR)
+    corpus_chars = sum(len(doc.page_content) for doc in docs)
+    questions = load_questions(args.questions)
+    print(f"Статей: {len(docs)}, символов: {corpus_chars}, вопросов: {len(questions)}, k = {args.k}")
+
+    model = None
+    if not args.skip_embed:
+        # Импорт здесь, чтобы размер индекса можно было посчитать без модели
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, model_kwargs={'device': 'cpu'},
+                                      encode_kwargs={'batch_size': args.batch_size})
+        model.embed_query("вино")
+
+    for chunking in CHUNKINGS:
+        chunks, parent_store, split_seconds = split_corpus(docs, chunking)
+        chunk_chars = sum(len(chunk.page_content) for chunk in chunks)
+        line = (f"{chunking:<10} векторов {len(chunks):5d}, текста в индексе {chunk_chars / corpus_chars:.2f} "
+                f"корпуса, средний чанк {chunk_chars / max(len(chunks), 1):.0f} символов")
+        if parent_store is not None:
+            line += f", родительских фрагментов {len(parent_store)}"
+        print(f"{line}, разбиение {split_seconds:.2f} s")
+        if model is None:
+            continue
+
+        started = time.perf_counter()
+        matrix = np.asarray(model.embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32)
+        embed_seconds = time.perf_counter() - started
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        result = evaluate(model, questions, chunks, matrix, parent_store, args.k, args.token_budget)
+        total = len(questions)
+        print(f"{'':<10} эмбеддинги {embed_seconds:.1f} s; статья найдена {result['source_hits'] / total:.1%}, "
+              f"ответ в контексте {result['answer_hits'] / total:.1%}, "
+              f"контекст в среднем {result['tokens'] / total:.0f} токенов")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение способов разбиения статей на чанки")
+    parser.add_argument("--questions", default=RETRIEVAL_EVAL_PATH)
+    parser.add_argument("--k", type=int, default=CONTEXT_CANDIDATES, help="количество найденных чанков")
+    parser.add_argument("--token-budget", type=int, default=CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--skip-embed", action="store_true", help="не считать эмбеддинги, только размер индекса")
+    main(parser.parse_args())
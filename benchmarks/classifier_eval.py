@@ -0,0 +1,73 @@
+"""
+Оценка локального классификатора сообщений
+
+Обучает CentroidClassifier на CLASSIFIER_TRAIN_PATH и проверяет его на
+CLASSIFIER_EVAL_PATH. Печатает точность, долю сообщений, решенных локально
+(столько вызовов LLM удается избежать), точность уверенных решений и таблицу
+для подбора порогов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.classifier_eval
+"""
+import argparse
+from collections import Counter
+
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from config import (EMBEDDING_MODEL, CLASSIFIER_TRAIN_PATH, CLASSIFIER_EVAL_PATH,
+                    CLASSIFIER_MIN_SIMILARITY, CLASSIFIER_MIN_MARGIN)
+from preclassifier import CentroidClassifier, load_examples, LABELS
+
+
+def evaluate(predictions, min_similarity: float, min_margin: float):
+    """
+    Считает метрики при заданных порогах
+
+    Args:
+        predictions (list): кортежи (истинная метка, предсказанная метка, близость, отрыв)
+        min_similarity (float): порог близости
+        min_margin (float): порог отрыва
+
+    Returns:
+        tuple: (доля локальных решений, точность локальных решений)
+    """
+    local = [(true, predicted) for true, predicted, similarity, margin in predictions
+             if similarity >= min_similarity and margin >= min_margin]
+    coverage = len(local) / len(predictions)
+    accuracy = sum(true == predicted for true, predicted in local) / len(local) if local else 0.0
+    return coverage, accuracy
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Оценка локального классификатора")
+    parser.add_argument("--train", default=CLASSIFIER_TRAIN_PATH)
+    parser.add_argument("--eval", default=CLASSIFIER_EVAL_PATH)
+    args = parser.parse_args()
+
+    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, model_kwargs={'device': 'cpu'})
+    classifier = CentroidClassifier(embeddings)
+    classifier.fit(load_examples(args.train))
+
+    predictions = []
+    for text, label in load_examples(args.eval):
+        predicted, similarity, margin = classifier.predict(text)
+        predictions.append((label, predicted, similarity, margin))
+
+    accuracy = sum(true == predicted for true, predicted, _, _ in predictions) / len(predictions)
+    coverage, local_accuracy = evaluate(predictions, CLASSIFIER_MIN_SIMILARITY, CLASSIFIER_MIN_MARGIN)
+    print(f"Примеров: {len(predictions)}")
+    print(f"Точность без порогов: {accuracy:.3f}")
+    print(f"Пороги: similarity >= {CLASSIFIER_MIN_SIMILARITY}, margin >= {CLASSIFIER_MIN_MARGIN}")
+    print(f"Решено локально (вызовов LLM избежано): {coverage:.1%}")
+    print(f"Точность локальных решений: {local_accuracy:.3f}")
+
+    confusion = Counter((true, predicted) for true, predicted, _, _ in predictions)
+    print("\nМатрица ошибок (строки - истинная метка):")
+    print(" " * 10 + "".join(f"{label:>10}" for label in LABELS))
+    for true in LABELS:
+        print(f"{true:>10}" + "".join(f"{confusion[(true, predicted)]:>10}" for predicted in LABELS))
+
+    print("\nПодбор порогов (margin: доля локальных / точность):")
+    for min_margin in (0.0, 0.02, 0.05, 0.1, 0.15, 0.2):
+        coverage, local_accuracy = evaluate(predictions, CLASSIFIER_MIN_SIMILARITY, min_margin)
+        print(f"  {min_margin:.2f}: {coverage:6.1%} / {local_accuracy:.3f}")
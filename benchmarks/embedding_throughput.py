@@ -0,0 +1,143 @@
+"""
+Пропускная способность эмбеддингов: своя модель в процессе против общего сервиса
+
+Запросы идут из нескольких потоков одновременно, как из asyncio.to_thread в боте.
+В режиме local каждый поток вызывает модель процесса напрямую, в режиме service
+запросы уходят в сервис эмбеддингов (python embedding_service.py), который
+объединяет одновременные запросы в один прогон модели. Печатает пропускную
+способность, p50/p95 задержки, средний размер пачки и память процесса сервиса.
+
+Запуск из корня репозитория:
+    python -m benchmarks.embedding_throughput --threads 16 --queries 2000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.retrieval import percentile
+from benchmarks.synthetic import random_text
+
+
+def rss_mb(pid: int) -> float:
+    """
+    Резидентная память процесса по /proc (только Linux)
+
+    Args:
+        pid (int): идентификатор процесса
+
+    Returns:
+        float: память в МБ или 0, если прочитать не удалось
+    """
+    try:
+        with open(f"/proc/{pid}/status", "r") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def run_queries(model, texts: list, threads: int):
+    """
+    Считает эмбеддинги запросов из нескольких потоков
+
+    Args:
+        model (Embeddings): модель эмбеддингов или клиент сервиса
+        texts (list): тексты запросов
+        threads (int): количество потоков
+
+    Returns:
+        tuple: (время прогона в секундах, список задержек запросов)
+    """
+    def query(text):
+        started = time.perf_counter()
+        model.embed_query(text)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        latencies = list(executor.map(query, texts))
+    return time.perf_counter() - started, latencies
+
+
+def report(name: str, wall: float, latencies: list):
+    """
+    Печатает результаты прогона
+
+    Args:
+        name (str): название режима
+        wall (float): время прогона, в секундах
+        latencies (list): задержки запросов, в секундах
+
+    Returns:
+        None
+    """
+    print(f"{name:<8} {len(latencies) / wall:9.1f} запр./s   p50 {percentile(latencies, 0.5) * 1000:7.1f} ms   "
+          f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms")
+
+
+def main(args):
+    """
+    Прогоняет запросы в выбранных режимах
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    rng = random.Random(args.seed)
+    # Разные тексты, чтобы сервис не схлопывал одинаковые запросы одной пачки
+    texts = [f"{random_text('вопрос', rng)} {index}" for index in range(args.queries)]
+
+    if "local" in args.modes:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        from config import EMBEDDING_MODEL
+
+        started = time.perf_counter()
+        model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, model_kwargs={'device': 'cpu'})
+        print(f"Загрузка модели в процессе: {time.perf_counter() - started:.2f} s, "
+              f"память процесса: {rss_mb(os.getpid()):.0f} МБ")
+        model.embed_query("прогрев")
+        report("local", *run_queries(model, texts, args.threads))
+
+    if "service" in args.modes:
+        from embedding_service import EmbeddingServiceClient
+
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        service = subprocess.Popen([sys.executable, "embedding_service.py", "--socket", args.socket,
+                                    "--max-batch", str(args.max_batch), "--max-wait", str(args.max_wait)])
+        try:
+            client = EmbeddingServiceClient(args.socket)
+            started = time.perf_counter()
+            client.ping()
+            print(f"Запуск сервиса: {time.perf_counter() - started:.2f} s, "
+                  f"память сервиса: {rss_mb(service.pid):.0f} МБ")
+            client.embed_query("прогрев")
+            before = client.stats()
+            report("service", *run_queries(client, texts, args.threads))
+            after = client.stats()
+            batches = after["batches"] - before["batches"]
+            print(f"Пачек: {batches}, средний размер: {(after['texts'] - before['texts']) / max(batches, 1):.1f}, "
+                  f"максимальный: {after['max_batch']}")
+        finally:
+            service.terminate()
+            service.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Эмбеддинги: модель в процессе против общего сервиса")
+    parser.add_argument("--modes", nargs="+", default=["local", "service"], choices=["local", "service"])
+    parser.add_argument("--threads", type=int, default=16, help="одновременных запросов")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--socket", default="/tmp/wine-embeddings-bench.sock")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,125 @@
+"""
+Оценка локального извлечения данных заявки (extraction.py) на размеченной выборке
+
+Для каждой заявки из EXTRACTION_EVAL_PATH извлекает контакты, имя и продукт из текста,
+дополняет их профилем Telegram и сравнивает с разметкой. Печатает точность и полноту
+по контактам, долю верно определенных имен, сколько продуктов найдено по названиям
+сортов из базы знаний, задержку извлечения и сколько запросов к модели остается:
+раньше данные каждой заявки извлекались отдельным запросом, теперь модель спрашивают
+только о недостающих полях. Продукт локально находится, только если назван сорт
+из базы знаний, поэтому отдельно показано, сколько заявок требуют модели ради контактов
+или имени (при CLASSIFY_AND_EXTRACT продукт приходит вместе с меткой класса).
+
+Запуск из корня репозитория:
+    python -m benchmarks.extraction
+"""
+import re
+import json
+import time
+import argparse
+from collections import Counter
+
+from aiogram import types
+
+from config import EXTRACTION_EVAL_PATH
+from extraction import extract_lead, profile_lead, merge_lead, missing_fields
+from benchmarks.retrieval import percentile
+
+
+def load_leads(path: str) -> list:
+    """
+    Загружает размеченные заявки
+
+    Args:
+        path (str): путь к файлу JSONL
+
+    Returns:
+        list: записи с полями text, first_name, last_name, username, contacts, fio, product
+    """
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def make_user(record: dict) -> types.User:
+    """
+    Профиль Telegram автора заявки
+
+    Args:
+        record (dict): размеченная заявка
+
+    Returns:
+        User: пользователь aiogram
+    """
+    return types.User(id=1, is_bot=False, first_name=record["first_name"] or "", last_name=record["last_name"],
+                      username=record["username"])
+
+
+def main(args):
+    """
+    Извлекает данные из выборки и печатает метрики
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    records = load_leads(args.path)
+    latencies = []
+    true_positive = predicted_total = expected_total = 0
+    fio_correct = 0
+    product_found = product_correct = 0
+    requested = Counter()
+    without_product = 0
+    errors = []
+    for record in records:
+        user = make_user(record)
+        started = time.perf_counter()
+        lead = merge_lead(extract_lead(record["text"]), profile_lead(user))
+        latencies.append(time.perf_counter() - started)
+
+        predicted = set(lead["contact_info"].split(", ")) if lead["contact_info"] else set()
+        expected = set(record["contacts"])
+        true_positive += len(predicted & expected)
+        predicted_total += len(predicted)
+        expected_total += len(expected)
+        fio_ok = (lead["fio"] or "").lower() == (record["fio"] or "").lower()
+        fio_correct += fio_ok
+        if lead["product"]:
+            product_found += 1
+            # Совпадением считается найденный сорт в разметке продукта (без учета окончаний)
+            product_correct += re.split(r"[\s\-,]+", lead["product"].lower())[0][:5] in record["product"].lower()
+        if predicted != expected or not fio_ok:
+            errors.append((record["text"], lead, record))
+
+        missing = missing_fields(lead)
+        requested[tuple(missing)] += 1
+        if [field for field in missing if field != "product"]:
+            without_product += 1
+
+    total = len(records)
+    print(f"Заявок: {total}")
+    print(f"Контакты: точность {true_positive / max(predicted_total, 1):.3f}, "
+          f"полнота {true_positive / max(expected_total, 1):.3f}")
+    print(f"Имя верно: {fio_correct} из {total} ({fio_correct / total:.1%})")
+    print(f"Продукт найден по базе знаний: {product_found} из {total}, из них совпадает с разметкой "
+          f"{product_correct}")
+    print(f"Локальное извлечение: p50 {percentile(latencies, 0.5) * 1e6:.0f} us, "
+          f"p99 {percentile(latencies, 0.99) * 1e6:.0f} us")
+    print(f"Запросов к модели за данными заявки: было {total} (все поля), стало {total - requested[()]} "
+          f"(только недостающие поля); без продукта, который приходит из классификации: {without_product}")
+    print("Запрашиваемые поля:")
+    for fields, count in requested.most_common():
+        print(f"  {', '.join(fields) or '(ничего)':<28} {count}")
+    if args.show_errors:
+        print("\nРасхождения с разметкой:")
+        for text, lead, record in errors:
+            print(f"  {text}\n    извлечено: {lead['contact_info']} / {lead['fio']}\n"
+                  f"    ожидалось: {', '.join(record['contacts']) or None} / {record['fio']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Оценка локального извлечения данных заявки")
+    parser.add_argument("--path", default=EXTRACTION_EVAL_PATH)
+    parser.add_argument("--show-errors", action="store_true", help="напечатать расхождения с разметкой")
+    main(parser.parse_args())
@@ -0,0 +1,207 @@
+"""
+Локальная заглушка OpenRouter chat completions для проверки клиента модели без сети
+
+Отвечает в формате OpenRouter (обычный JSON и SSE при "stream": true) с настраиваемой
+задержкой, долей медленных ответов, ошибок 5xx и ответов 429 с Retry-After.
+Модели из --down всегда отвечают 503. С --ceiling заглушка, как провайдер, пропускает
+не больше заданного числа запросов в секунду, отвечает заголовками X-RateLimit-*
+и возвращает 429 сверх лимита.
+
+Запуск из корня репозитория:
+    python -m benchmarks.fake_openrouter --port 8089 --latency 0.2 --tail-prob 0.05 --tail-latency 5
+    OPENROUTER_API_URL=http://127.0.0.1:8089/api/v1/chat/completions python bot.py
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+from aiohttp import web
+
+ROUTE = "/api/v1/chat/completions"
+ANSWER = ("Рекомендую попробовать сухое красное вино из Бордо: Каберне Совиньон с Мерло "
+          "хорошо подойдет к стейку и выдержанным сырам.")
+
+
+class FakeOpenRouter:
+    """
+    Обработчик запросов заглушки и счетчики запросов по моделям и исходам
+    """
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, tail_prob: float = 0.0,
+                 tail_latency: float = 5.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 1.0, down: list = None, token_delay: float = 0.02, answer: str = ANSWER,
+                 model_latency: dict = None, ceiling: int = 0):
+        """
+        Args:
+            latency (float): средняя задержка ответа, в секундах
+            jitter (float): стандартное отклонение задержки
+            tail_prob (float): доля медленных ответов
+            tail_latency (float): задержка медленного ответа
+            error_rate (float): доля ответов 500
+            rate_limit_rate (float): доля ответов 429
+            retry_after (float): значение Retry-After для ответов 429
+            down (list): модели, которые всегда отвечают 503
+            token_delay (float): пауза между событиями потокового ответа
+            answer (str): текст ответа или функция prompt -> текст
+            model_latency (dict): средняя задержка отдельных моделей вместо latency (можно менять на ходу)
+            ceiling (int): лимит запросов в секунду (окно - календарная секунда); 0 - без лимита
+
+        Returns:
+            None
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_prob = tail_prob
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.down = set(down or [])
+        self.token_delay = token_delay
+        self.answer = answer
+        self.model_latency = dict(model_latency or {})
+        self.ceiling = ceiling
+        self.stats = Counter()
+        self._window = 0
+        self._window_requests = 0
+
+    def _rate_limit_headers(self):
+        """
+        Учитывает запрос в текущем окне лимита
+
+        Returns:
+            tuple: (превышен ли лимит, заголовки X-RateLimit-*); без лимита - (False, {})
+        """
+        if not self.ceiling:
+            return False, {}
+        now = time.time()
+        if int(now) != self._window:
+            self._window = int(now)
+            self._window_requests = 0
+        self._window_requests += 1
+        remaining = self.ceiling - self._window_requests
+        headers = {"X-RateLimit-Limit": str(self.ceiling), "X-RateLimit-Remaining": str(max(0, remaining)),
+                   "X-RateLimit-Reset": str((self._window + 1) * 1000)}
+        return remaining < 0, headers
+
+    def _answer_for(self, prompt: str) -> str:
+        """
+        Текст ответа на запрос
+
+        Args:
+            prompt (str): текст запроса
+
+        Returns:
+            str: текст ответа
+        """
+        return self.answer(prompt) if callable(self.answer) else self.answer
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        """
+        Обрабатывает запрос chat completions
+
+        Args:
+            request (Request): HTTP-запрос
+
+        Returns:
+            StreamResponse: ответ в формате OpenRouter
+        """
+        body = await request.json()
+        model = body.get("model", "")
+        self.stats["requests"] += 1
+        self.stats[f"model:{model}"] += 1
+        if body.get("max_tokens"):
+            self.stats["max_tokens"] += 1
+
+        if model in self.down:
+            self.stats["503"] += 1
+            return web.json_response({"error": {"code": 503, "message": "model is down"}}, status=503)
+        limited, headers = self._rate_limit_headers()
+        if limited:
+            self.stats["429"] += 1
+            return web.json_response({"error": {"code": 429, "message": "rate limit exceeded"}}, status=429,
+                                     headers=headers)
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self.stats["429"] += 1
+            return web.json_response({"error": {"code": 429, "message": "rate limited"}}, status=429,
+                                     headers={"Retry-After": str(self.retry_after)})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.stats["500"] += 1
+            return web.json_response({"error": {"code": 500, "message": "internal error"}}, status=500)
+
+        slow = random.random() < self.tail_prob
+        latency = self.model_latency.get(model, self.latency)
+        delay = self.tail_latency if slow else max(0.0, random.gauss(latency, self.jitter))
+        self.stats["slow" if slow else "fast"] += 1
+        await asyncio.sleep(delay)
+
+        prompt = body["messages"][-1]["content"]
+        answer = self._answer_for(prompt)
+        usage = {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(answer) // 3,
+                 "total_tokens": (len(prompt) + len(answer)) // 3}
+        if not body.get("stream"):
+            return web.json_response({
+                "id": "gen-fake", "model": model, "usage": usage,
+                "choices": [{"message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            }, headers=headers)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **headers})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+        for word in answer.split(" "):
+            event = {"id": "gen-fake", "model": model, "choices": [{"delta": {"content": word + " "}}]}
+            await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(self.token_delay)
+        final = {"id": "gen-fake", "model": model, "usage": usage,
+                 "choices": [{"delta": {}, "finish_reason": "stop"}]}
+        await response.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+async def start_server(fake: FakeOpenRouter, host: str = "127.0.0.1", port: int = 0):
+    """
+    Запускает заглушку в текущем цикле событий
+
+    Args:
+        fake (FakeOpenRouter): обработчик заглушки
+        host (str): адрес
+        port (int): порт, 0 - любой свободный
+
+    Returns:
+        tuple: AppRunner (для runner.cleanup()) и адрес chat completions API
+    """
+    app = web.Application()
+    app.router.add_post(ROUTE, fake.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}{ROUTE}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная заглушка OpenRouter")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--tail-prob", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--down", nargs="*", default=[], help="модели, которые всегда отвечают 503")
+    parser.add_argument("--ceiling", type=int, default=0, help="лимит запросов в секунду, 0 - без лимита")
+    args = parser.parse_args()
+
+    fake = FakeOpenRouter(args.latency, args.jitter, args.tail_prob, args.tail_latency, args.error_rate,
+                          args.rate_limit_rate, args.retry_after, args.down, ceiling=args.ceiling)
+    app = web.Application()
+    app.router.add_post(ROUTE, fake.handle)
+    print(f"Заглушка OpenRouter: http://{args.host}:{args.port}{ROUTE}")
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
@@ -0,0 +1,160 @@
+"""
+Сколько вызовов классификации экономит защита от флуда (flood.FloodDetector)
+
+Воспроизводит поток сообщений: несколько спам-кампаний, в каждой один текст рассылается
+много раз с мелкими правками (числа, регистр, эмодзи, ссылки, латинские двойники букв,
+окончания слов), часть копий шлет один пользователь подряд; вперемешку идут обычные
+вопросы и заявки. Классификатор заменен разметкой генератора: каждое сообщение,
+не отсеянное детектором, считается вызовом модели, а вердикт "спам" запоминается.
+
+Печатает количество сэкономленных вызовов, пропущенные копии, ложные срабатывания
+на обычных сообщениях и задержку проверки.
+
+Запуск из корня репозитория:
+    python -m benchmarks.flood --campaigns 20 --copies 50 --legit 1000
+"""
+import time
+import random
+import argparse
+from collections import Counter
+
+from config import FLOOD_MAX_DISTANCE
+from flood import FloodDetector
+from benchmarks.retrieval import percentile
+from benchmarks.synthetic import random_text
+
+CAMPAIGNS = [
+    "Заработок от {n} рублей в день без вложений, пиши в личку",
+    "Подпишись на канал с прогнозами на спорт, {n}% проходимость, первая неделя бесплатно",
+    "Продам аккаунт в игре, недорого, {n} уровень, все скины открыты",
+    "Купи криптовалюту сейчас, курс взлетит завтра! Ссылка в профиле",
+    "Ищем сотрудников на удаленную работу, доход от {n} тысяч, обучение бесплатно",
+    "Раздаем подарочные сертификаты на {n} рублей, переходи по ссылке и забирай",
+    "Быстрые займы без проверки кредитной истории до {n} тысяч на карту",
+    "Выиграй iPhone, нужно только подписаться и сделать репост, итоги через {n} дней",
+]
+EMOJI = ["🔥", "💰", "✅", "🚀", "!!!", "👉"]
+HOMOGLYPHS = {"а": "a", "е": "e", "о": "o", "р": "p", "с": "c", "х": "x"}
+ENDINGS = {"пиши": "пишите", "переходи": "переходите", "забирай": "забирайте", "рублей": "руб.",
+           "бесплатно": "бесплатная", "подписаться": "подписаться)"}
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    """
+    Вносит в текст кампании одну-три мелкие правки, как это делают спамеры
+
+    Args:
+        text (str): текст кампании
+        rng (Random): генератор случайных чисел
+
+    Returns:
+        str: измененная копия
+    """
+    for _ in range(rng.randint(1, 3)):
+        edit = rng.randrange(6)
+        if edit == 0:
+            text = text.upper() if rng.random() < 0.5 else text.capitalize()
+        elif edit == 1:
+            text = f"{text} {rng.choice(EMOJI)}"
+        elif edit == 2:
+            text = f"{text} https://t.me/spam{rng.randint(1, 999)}"
+        elif edit == 3:
+            letters = [HOMOGLYPHS.get(char, char) if rng.random() < 0.2 else char for char in text]
+            text = "".join(letters)
+        elif edit == 4:
+            word = rng.choice(list(ENDINGS))
+            text = text.replace(word, ENDINGS[word])
+        else:
+            text = text.replace(",", rng.choice(["", " -", ";"]))
+    return text
+
+
+def generate_flood(campaigns: int, copies: int, legit: int, burst: float, duration: float, seed: int):
+    """
+    Генерирует поток сообщений
+
+    Args:
+        campaigns (int): количество спам-кампаний
+        copies (int): копий в каждой кампании
+        legit (int): количество обычных сообщений
+        burst (float): доля копий, которые один пользователь шлет подряд
+        duration (float): длительность потока, в секундах
+        seed (int): зерно генератора
+
+    Returns:
+        list: сообщения (время, пользователь, текст, класс) по возрастанию времени
+    """
+    rng = random.Random(seed)
+    messages = []
+    for campaign in range(campaigns):
+        template = CAMPAIGNS[campaign % len(CAMPAIGNS)]
+        started = rng.uniform(0, duration * 0.8)
+        bot_user = 10 ** 7 + campaign
+        for copy in range(copies):
+            text = mutate(template.format(n=rng.randint(2, 500)), rng)
+            if rng.random() < burst:
+                messages.append((started + copy * 0.5, bot_user, text, "спам"))
+            else:
+                user = 2 * 10 ** 7 + rng.randrange(copies * campaigns)
+                messages.append((started + rng.uniform(0, duration * 0.2), user, text, "спам"))
+    for _ in range(legit):
+        kind = rng.choice(["вопрос", "вопрос", "заявка"])
+        messages.append((rng.uniform(0, duration), rng.randrange(10 ** 6, 10 ** 6 + legit), random_text(kind, rng),
+                         kind))
+    messages.sort(key=lambda message: message[0])
+    return messages
+
+
+def main(args):
+    """
+    Прогоняет поток через детектор и считает сэкономленные вызовы
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    messages = generate_flood(args.campaigns, args.copies, args.legit, args.burst, args.duration, args.seed)
+    detector = FloodDetector(max_distance=args.max_distance)
+    verdicts = Counter()
+    latencies = []
+    false_positives = []
+    llm_calls = 0
+    for now, user, text, label in messages:
+        started = time.perf_counter()
+        verdict, reason = detector.check(text, user_id=user, now=now)
+        latencies.append(time.perf_counter() - started)
+        if verdict is not None:
+            verdicts[(label, reason)] += 1
+            if label != "спам":
+                false_positives.append(text)
+            continue
+        llm_calls += 1
+        if label == "спам":
+            detector.remember(text, "спам", now=now)
+
+    spam = sum(1 for message in messages if message[3] == "спам")
+    saved = len(messages) - llm_calls
+    print(f"Сообщений: {len(messages)} (спам: {spam}), вызовов классификации: {llm_calls} вместо {len(messages)}, "
+          f"сэкономлено: {saved} ({saved / len(messages):.1%})")
+    print(f"Отсеяно почти повторов: {sum(n for (label, reason), n in verdicts.items() if reason == 'duplicate')}, "
+          f"по частоте: {sum(n for (label, reason), n in verdicts.items() if reason == 'rate')}; "
+          f"копий спама дошло до модели: {spam - sum(n for (label, _), n in verdicts.items() if label == 'спам')}")
+    print(f"Ложных срабатываний на обычных сообщениях: {len(false_positives)} из {len(messages) - spam}")
+    for text in false_positives[:5]:
+        print(f"  {text}")
+    print(f"Проверка: p50 {percentile(latencies, 0.5) * 1e6:.0f} us, p99 {percentile(latencies, 0.99) * 1e6:.0f} us, "
+          f"отпечатков в памяти: {len(detector)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экономия вызовов классификации на потоке флуда")
+    parser.add_argument("--campaigns", type=int, default=20)
+    parser.add_argument("--copies", type=int, default=50, help="копий в каждой кампании")
+    parser.add_argument("--legit", type=int, default=1000, help="обычных сообщений")
+    parser.add_argument("--burst", type=float, default=0.3, help="доля копий, которые один пользователь шлет подряд")
+    parser.add_argument("--duration", type=float, default=3600.0, help="длительность потока, s")
+    parser.add_argument("--max-distance", type=int, default=FLOOD_MAX_DISTANCE, help="порог расстояния Хэмминга")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
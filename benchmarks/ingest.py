@@ -0,0 +1,98 @@
+"""
+Бенчмарк индексации базы знаний
+
+Сравнивает исходный последовательный путь (чтение всех файлов, разбиение и одна
+запись всех чанков) с конвейером RAG_data.ingest и повторным инкрементальным запуском.
+Все базы создаются во временном каталоге, рабочая база не затрагивается.
+
+Запуск из корня репозитория:
+    python -m benchmarks.ingest --workers 4 --batch-size 256
+"""
+import os
+import time
+import argparse
+import tempfile
+
+from config import WINES_DIR, REGIONS_DIR
+from RAG_data import load_documents_from_folder, get_text_splitter, get_vector_store, ingest
+
+
+def report(name: str, docs: int, chunks: int, seconds: float):
+    """
+    Печатает строку отчета
+
+    Args:
+        name (str): название замера
+        docs (int): количество обработанных документов
+        chunks (int): количество обработанных чанков
+        seconds (float): затраченное время
+
+    Returns:
+        None
+    """
+    seconds = max(seconds, 1e-9)
+    print(f"{name:<28} {seconds:8.2f} s {docs / seconds:10.1f} docs/s {chunks / seconds:10.1f} chunks/s")
+
+
+def bench_serial(persist_directory: str, skip_embed: bool):
+    """
+    Исходный путь: последовательная загрузка, разбиение и запись одним вызовом
+
+    Args:
+        persist_directory (str): каталог временной базы
+        skip_embed (bool): не считать эмбеддинги
+
+    Returns:
+        None
+    """
+    started = time.perf_counter()
+    docs = load_documents_from_folder(WINES_DIR) + load_documents_from_folder(REGIONS_DIR)
+    splits = get_text_splitter().split_documents(docs)
+    report("serial load+split", len(docs), len(splits), time.perf_counter() - started)
+
+    if skip_embed:
+        return
+    vector_store = get_vector_store(persist_directory, batch_size=32)
+    started = time.perf_counter()
+    vector_store.add_documents(splits)
+    report("serial embed+write", len(docs), len(splits), time.perf_counter() - started)
+
+
+def bench_pipeline(persist_directory: str, workers: int, batch_size: int):
+    """
+    Конвейер RAG_data.ingest: полный прогон и повторный прогон без изменений
+
+    Args:
+        persist_directory (str): каталог временной базы
+        workers (int): количество процессов
+        batch_size (int): размер батча эмбеддингов
+
+    Returns:
+        None
+    """
+    manifest_path = os.path.join(persist_directory, "manifest.json")
+    index_directory = os.path.join(persist_directory, "numpy_index")
+    lexical_index_path = os.path.join(persist_directory, "lexical_index.json")
+    parent_store_path = os.path.join(persist_directory, "parents.json")
+    stats = ingest(full=True, workers=workers, batch_size=batch_size, persist_directory=persist_directory,
+                   manifest_path=manifest_path, index_directory=index_directory,
+                   lexical_index_path=lexical_index_path, parent_store_path=parent_store_path)
+    report("pipeline total", stats["files"], stats["chunks"], stats["total_seconds"])
+    report("pipeline embed+write", stats["files"], stats["chunks"], stats["embed_seconds"])
+
+    stats = ingest(workers=workers, batch_size=batch_size, persist_directory=persist_directory,
+                   manifest_path=manifest_path, index_directory=index_directory,
+                   lexical_index_path=lexical_index_path, parent_store_path=parent_store_path)
+    report("incremental rerun", stats["files"], stats["added"], stats["total_seconds"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк индексации базы знаний")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--skip-serial-embed", action="store_true", help="не замерять эмбеддинги исходного пути")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_serial(os.path.join(tmp, "serial"), args.skip_serial_embed)
+        bench_pipeline(os.path.join(tmp, "pipeline"), args.workers, args.batch_size)
@@ -0,0 +1,109 @@
+"""
+Хвостовые задержки клиента модели на локальной заглушке OpenRouter
+
+Сравнивает AsyncDeepSeekAPI без хеджирования и с ним при доле медленных ответов,
+а также переход к резервной модели при недоступной основной и ответах 429.
+Сеть и API-ключ не нужны.
+
+Запуск из корня репозитория:
+    python -m benchmarks.llm_tail --requests 400 --concurrency 20 --tail-prob 0.05
+"""
+import time
+import asyncio
+import argparse
+
+from benchmarks.fake_openrouter import FakeOpenRouter, start_server
+from benchmarks.retrieval import percentile
+from DeepSeekR1 import AsyncDeepSeekAPI
+from resilience import LLMError
+
+MODELS = ["primary/model", "fallback/model"]
+
+
+async def run_scenario(name: str, fake: FakeOpenRouter, requests: int, concurrency: int, **client_options) -> dict:
+    """
+    Отправляет запросы в заглушку с ограниченной параллельностью
+
+    Args:
+        name (str): название сценария
+        fake (FakeOpenRouter): настроенная заглушка
+        requests (int): количество запросов
+        concurrency (int): количество одновременных запросов
+        client_options: параметры AsyncDeepSeekAPI
+
+    Returns:
+        dict: перцентили задержки, ошибки и счетчики заглушки
+    """
+    runner, api_url = await start_server(fake)
+    client = AsyncDeepSeekAPI("test", api_url=api_url, models=MODELS, **client_options)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await client.ask(f"Вопрос {i}")
+            except LLMError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        await asyncio.gather(*(one(i) for i in range(requests)))
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+    return {
+        "name": name,
+        "p50": percentile(latencies, 0.5) if latencies else 0.0,
+        "p95": percentile(latencies, 0.95) if latencies else 0.0,
+        "p99": percentile(latencies, 0.99) if latencies else 0.0,
+        "errors": errors,
+        "hedges": f"{client.hedges_won}/{client.hedges_sent}",
+        "server_requests": fake.stats["requests"],
+        "fallback_requests": fake.stats[f"model:{MODELS[1]}"],
+    }
+
+
+async def main(args):
+    """
+    Прогоняет сценарии и печатает таблицу результатов
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    tail = dict(latency=args.latency, tail_prob=args.tail_prob, tail_latency=args.tail_latency)
+    results = [
+        await run_scenario("без хеджирования", FakeOpenRouter(**tail), args.requests, args.concurrency,
+                           hedge=False),
+        await run_scenario("хеджирование p95", FakeOpenRouter(**tail), args.requests, args.concurrency,
+                           hedge=True),
+        await run_scenario("основная модель 503", FakeOpenRouter(latency=args.latency, down=[MODELS[0]]),
+                           args.requests, args.concurrency, hedge=True),
+        await run_scenario("429 с Retry-After", FakeOpenRouter(latency=args.latency, rate_limit_rate=0.2,
+                                                               retry_after=0.2),
+                           args.requests, args.concurrency, hedge=True),
+    ]
+
+    print(f"{'сценарий':<22} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'ошибки':>7} {'хедж':>9} "
+          f"{'запросов':>9} {'резерв':>7}")
+    for r in results:
+        print(f"{r['name']:<22} {r['p50']:7.2f} {r['p95']:7.2f} {r['p99']:7.2f} {r['errors']:7d} "
+              f"{r['hedges']:>9} {r['server_requests']:9d} {r['fallback_requests']:7d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Хвостовые задержки клиента модели")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tail-prob", type=float, default=0.05)
+    parser.add_argument("--tail-latency", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,205 @@
+"""
+Нагрузочная проверка графа агента без OpenRouter, Telegram и Postgres
+
+Поднимает локальную заглушку OpenRouter (benchmarks/fake_openrouter.py), которая отвечает
+на промпты классификации, извлечения и RAG в зависимости от класса синтетического
+сообщения, подменяет базу заявок записью в память и прогоняет N одновременных переписок
+через скомпилированный граф. Печатает пропускную способность и p50/p95/p99 по узлам.
+
+Поиск по базе знаний и локальный классификатор работают по-настоящему, поэтому
+перед запуском нужно построить базу: python RAG_data.py
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_test --conversations 50 --messages 4 --latency 0.5 --tail-prob 0.02
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+from benchmarks.fake_openrouter import FakeOpenRouter, start_server, ANSWER
+from benchmarks.retrieval import percentile
+from benchmarks.synthetic import generate_conversations
+
+TEXT_PATTERN = re.compile(r'"""\n(.*?)\n"""', re.DOTALL)
+
+
+def fake_answer(labels: dict):
+    """
+    Создает функцию ответа заглушки, которая знает правильный класс каждого
+    синтетического сообщения
+
+    Args:
+        labels (dict): текст сообщения -> класс
+
+    Returns:
+        Callable: функция prompt -> текст ответа модели
+    """
+    def answer(prompt: str) -> str:
+        match = TEXT_PATTERN.search(prompt)
+        if match is None:
+            return ANSWER
+        text = match.group(1)
+        kind = labels.get(text, "вопрос")
+        application = kind == "заявка"
+        extracted = {
+            "contact_info": text.split(", ")[-1] if application else None,
+            "fio": None,
+            "product": text if application else None,
+        }
+        if '"label"' in prompt:
+            return json.dumps({"label": kind, **extracted}, ensure_ascii=False)
+        if "contact_info" in prompt:
+            return json.dumps(extracted, ensure_ascii=False)
+        return kind
+    return answer
+
+
+class MemoryMessagesDB:
+    """
+    Замена UserMessagesDB для нагрузочной проверки: строки заявок готовятся так же,
+    как для Postgres, но складываются в память
+    """
+    def __init__(self, latency: float = 0.0):
+        """
+        Args:
+            latency (float): имитируемая задержка записи, в секундах
+
+        Returns:
+            None
+        """
+        self.latency = latency
+        self.rows = []
+
+    async def enqueue_message(self, message, contact_info=None, fio=None, product_interest=None):
+        """
+        Сохраняет строку заявки в память
+
+        Args:
+            message (Message): объект сообщения от пользователя
+            contact_info (str): контактные данные
+            fio (str): ФИО клиента
+            product_interest (str): продукт, который хотят приобрести
+
+        Returns:
+            None
+        """
+        from database import UserMessagesDB
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.rows.append(UserMessagesDB._message_row(message, contact_info, fio, product_interest))
+
+
+async def replay(graph, dialog: list, samples: dict, errors: list):
+    """
+    Последовательно прогоняет сообщения одной переписки через граф, замеряя
+    длительность каждого узла, время до первого фрагмента ответа и полное время
+
+    Args:
+        graph (CompiledStateGraph): граф агента
+        dialog (list): сообщения переписки
+        samples (dict): название замера -> список длительностей, дополняется
+        errors (list): список ошибок, дополняется
+
+    Returns:
+        None
+    """
+    from metrics import new_trace_id
+
+    for message in dialog:
+        new_trace_id()
+        started = time.perf_counter()
+        last_update = started
+        first_token = None
+        try:
+            async for mode, output in graph.astream({"user": message, "message": message.text},
+                                                    stream_mode=["updates", "custom"]):
+                now = time.perf_counter()
+                if mode == "custom":
+                    if first_token is None:
+                        first_token = now - started
+                    continue
+                for node in output:
+                    samples[f"node:{node}"].append(now - last_update)
+                last_update = now
+        except Exception as e:
+            errors.append(repr(e))
+            continue
+        samples["total"].append(time.perf_counter() - started)
+        if first_token is not None:
+            samples["first_token"].append(first_token)
+
+
+async def main(args):
+    """
+    Запускает заглушку, подготавливает агента и прогоняет переписки
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    conversations, labels = generate_conversations(args.conversations, args.messages, seed=args.seed)
+    fake = FakeOpenRouter(latency=args.latency, jitter=args.latency / 4, tail_prob=args.tail_prob,
+                          tail_latency=args.tail_latency, error_rate=args.error_rate,
+                          rate_limit_rate=args.rate_limit_rate, retry_after=0.5, answer=fake_answer(labels))
+    runner, api_url = await start_server(fake)
+
+    # Адрес API и ключ читаются при импорте config и клиентов модели
+    os.environ["OPENROUTER_API_URL"] = api_url
+    os.environ.setdefault("DEEP_API_TOKEN", "load-test")
+    import agent
+    import RAG
+
+    agent.db = MemoryMessagesDB(args.db_latency)
+    if args.no_preclassifier:
+        agent.preclassifier = None
+    with tempfile.TemporaryDirectory() as tmp:
+        # Ответы заглушки не должны попасть в рабочий кэш ответов
+        RAG.ANSWER_CACHE_ENABLED = args.cache
+        RAG.ANSWER_CACHE_PATH = os.path.join(tmp, "cache.sqlite3")
+        await agent.warm_up()
+
+        samples = defaultdict(list)
+        errors = []
+        started = time.perf_counter()
+        await asyncio.gather(*(replay(agent.graph, dialog, samples, errors) for dialog in conversations))
+        wall = time.perf_counter() - started
+        await agent.llm.close()
+        await RAG.async_llm.close()
+    await runner.cleanup()
+
+    total = len(samples["total"])
+    print(f"Переписок: {args.conversations}, сообщений: {total + len(errors)}, ошибок: {len(errors)}, "
+          f"время: {wall:.2f} s, пропускная способность: {total / wall:.1f} сообщ./s")
+    print(f"Запросов к заглушке: {fake.stats['requests']} (429: {fake.stats['429']}, 500: {fake.stats['500']}, "
+          f"медленных: {fake.stats['slow']}), заявок записано: {len(agent.db.rows)}")
+    print(f"{'замер':<20} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name in sorted(samples):
+        values = samples[name]
+        print(f"{name:<20} {len(values):6d} {percentile(values, 0.5) * 1000:9.1f} "
+              f"{percentile(values, 0.95) * 1000:9.1f} {percentile(values, 0.99) * 1000:9.1f}")
+    for error in errors[:5]:
+        print(f"Ошибка: {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка графа агента")
+    parser.add_argument("--conversations", type=int, default=50, help="количество одновременных переписок")
+    parser.add_argument("--messages", type=int, default=4, help="сообщений в каждой переписке")
+    parser.add_argument("--latency", type=float, default=0.5, help="средняя задержка заглушки, s")
+    parser.add_argument("--tail-prob", type=float, default=0.02)
+    parser.add_argument("--tail-latency", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--db-latency", type=float, default=0.0, help="имитируемая задержка записи заявки, s")
+    parser.add_argument("--no-preclassifier", action="store_true", help="классифицировать только моделью")
+    parser.add_argument("--cache", action="store_true", help="включить кэш ответов (во временном файле)")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,130 @@
+"""
+Общий адаптивный ограничитель запросов (resilience.AdaptiveRateLimiter) на локальной заглушке OpenRouter
+
+Заглушка пропускает не больше --ceiling запросов в секунду и отвечает 429 сверх лимита,
+как бесплатный тариф OpenRouter. Одна и та же волна запросов (классификация, ответы RAG,
+извлечение данных заявки вперемешку) отправляется разом без ограничителя (как раньше:
+каждый модуль шлет запросы сам по себе) и через общий ограничитель get_client.
+Печатает полезную пропускную способность относительно лимита провайдера, количество
+ответов 429, вызовы, которые так и не получили ответа, задержку по задачам
+(порядок приоритетов: данные заявки, затем ответы, затем классификация)
+и итоговые лимиты ограничителя.
+
+Запуск из корня репозитория:
+    python -m benchmarks.rate_limit --requests 150 --ceiling 10 2>/dev/null
+"""
+import io
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+from collections import defaultdict
+
+from benchmarks.fake_openrouter import FakeOpenRouter, start_server
+from benchmarks.retrieval import percentile
+from resilience import LLMError, AdaptiveRateLimiter
+from DeepSeekR1 import AsyncDeepSeekAPI, TASK_PRIORITY
+
+# Доли задач в волне запросов: классификация каждого сообщения, ответы на вопросы, данные заявок
+TASK_MIX = (("classify", 0.6), ("ask", 0.3), ("collect_info", 0.1))
+
+
+def make_tasks(count: int, seed: int) -> list:
+    """
+    Случайная последовательность задач в пропорциях TASK_MIX
+
+    Args:
+        count (int): количество запросов
+        seed (int): зерно генератора
+
+    Returns:
+        list: названия задач
+    """
+    rng = random.Random(seed)
+    names, weights = zip(*TASK_MIX)
+    return rng.choices(names, weights, k=count)
+
+
+async def run_wave(client: AsyncDeepSeekAPI, tasks: list) -> dict:
+    """
+    Отправляет все запросы одновременно
+
+    Args:
+        client (AsyncDeepSeekAPI): клиент модели
+        tasks (list): названия задач
+
+    Returns:
+        dict: задача -> список задержек успешных вызовов, а также "failed" и "seconds"
+    """
+    latencies = defaultdict(list)
+    failed = 0
+
+    async def one(task):
+        nonlocal failed
+        started = time.perf_counter()
+        try:
+            await getattr(client, task)("Подойдет ли Каберне к стейку? Мой телефон +7 900 123-45-67")
+        except LLMError:
+            failed += 1
+            return
+        latencies[task].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(task) for task in tasks))
+    return {"latencies": latencies, "failed": failed, "seconds": time.perf_counter() - started}
+
+
+async def main(args):
+    """
+    Прогоняет сценарии и печатает результаты
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    tasks = make_tasks(args.requests, args.seed)
+    scenarios = [
+        ("без ограничителя", None),
+        ("общий ограничитель", AdaptiveRateLimiter()),
+    ]
+    print(f"Запросов: {len(tasks)}, лимит провайдера: {args.ceiling} запр./s, задержка ответа {args.latency} s")
+    for name, limiter in scenarios:
+        fake = FakeOpenRouter(latency=args.latency, jitter=args.latency / 5, ceiling=args.ceiling)
+        runner, api_url = await start_server(fake)
+        client = AsyncDeepSeekAPI("test", api_url=api_url, hedge=False, limiter=limiter)
+        try:
+            # Клиент печатает каждый повтор после 429; в отчете нужны только итоги
+            output = io.StringIO() if not args.verbose else None
+            with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+                result = await run_wave(client, tasks)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+        answered = sum(len(values) for values in result["latencies"].values())
+        goodput = answered / result["seconds"]
+        print(f"\n{name}: ответов {answered} из {len(tasks)}, без ответа {result['failed']}, "
+              f"за {result['seconds']:.1f} s ({goodput:.1f} ответов/s, {goodput / args.ceiling:.0%} лимита); "
+              f"запросов к заглушке {fake.stats['requests']}, из них 429: {fake.stats['429']}")
+        for task, _ in sorted(TASK_MIX, key=lambda item: TASK_PRIORITY[item[0]]):
+            values = result["latencies"].get(task, [])
+            if values:
+                print(f"  {task:<14} приоритет {TASK_PRIORITY[task]}: p50 {percentile(values, 0.5):6.2f} s, "
+                      f"p95 {percentile(values, 0.95):6.2f} s ({len(values)} ответов)")
+        if limiter is not None:
+            state = limiter.metrics()
+            print(f"  итоговые лимиты: {state['rate']:.1f} запр./s, {state['concurrency']} одновременных; "
+                  f"ответов 429 учтено: {state['rate_limited']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Общий адаптивный ограничитель запросов к модели")
+    parser.add_argument("--requests", type=int, default=150, help="количество запросов в волне")
+    parser.add_argument("--ceiling", type=int, default=10, help="лимит провайдера, запросов в секунду")
+    parser.add_argument("--latency", type=float, default=0.3, help="задержка ответа модели, s")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="не скрывать журнал повторов клиента")
+    asyncio.run(main(parser.parse_args()))
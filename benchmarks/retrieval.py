@@ -0,0 +1,126 @@
+"""
+Сравнение бэкендов поиска: Chroma и NumpyVectorIndex
+
+Каждый бэкенд замеряется в отдельном процессе, чтобы прирост памяти не смешивался.
+Эмбеддинги запросов считаются заранее, поэтому в задержку входит только поиск.
+Перед запуском нужно построить базу: python RAG_data.py
+
+Запуск из корня репозитория:
+    python -m benchmarks.retrieval --queries 500 --k 3
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+QUESTIONS = [
+    "Что подать к стейку?",
+    "Какое вино подходит к рыбе?",
+    "Расскажи про регион Бордо",
+    "Чем отличается Каберне Совиньон от Мерло?",
+    "Где выращивают Альбариньо?",
+    "Какое вино выбрать к сыру?",
+    "Какие сорта растут в Тоскане?",
+    "Посоветуй вино к морепродуктам",
+]
+
+
+def rss_mb() -> float:
+    """
+    Текущий резидентный объем памяти процесса
+
+    Returns:
+        float: RSS в мегабайтах
+    """
+    with open("/proc/self/statm") as file:
+        pages = int(file.read().split()[1])
+    return pages * 4096 / 2 ** 20
+
+
+def percentile(values, q: float) -> float:
+    """
+    Перцентиль по отсортированному списку
+
+    Args:
+        values (list): значения
+        q (float): доля от 0 до 1
+
+    Returns:
+        float: значение перцентиля
+    """
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+def run_child(backend: str, queries: int, k: int) -> dict:
+    """
+    Замеры одного бэкенда внутри дочернего процесса
+
+    Args:
+        backend (str): "chroma" или "numpy"
+        queries (int): количество запросов
+        k (int): количество результатов на запрос
+
+    Returns:
+        dict: результаты замеров
+    """
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from config import EMBEDDING_MODEL, NUMPY_INDEX_DIR
+    from retrieval import ChromaRetriever, NumpyRetriever
+    from vector_index import NumpyVectorIndex
+
+    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, model_kwargs={'device': 'cpu'})
+    vectors = embeddings.embed_documents(QUESTIONS)
+    rss_before = rss_mb()
+
+    started = time.perf_counter()
+    if backend == "numpy":
+        retriever = NumpyRetriever(NumpyVectorIndex.load(NUMPY_INDEX_DIR))
+    else:
+        from RAG_data import get_vector_store
+        retriever = ChromaRetriever(get_vector_store())
+    open_seconds = time.perf_counter() - started
+
+    retriever.search_by_vector(vectors[0], k)
+    latencies = []
+    for i in range(queries):
+        started = time.perf_counter()
+        retriever.search_by_vector(vectors[i % len(vectors)], k)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    retriever.search_batch(vectors, k)
+    batch_seconds = time.perf_counter() - started
+
+    return {
+        "backend": backend,
+        "open_ms": open_seconds * 1000,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "batch_ms_per_query": batch_seconds * 1000 / len(vectors),
+        "rss_delta_mb": rss_mb() - rss_before,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение бэкендов поиска")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--child", choices=["chroma", "numpy"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.queries, args.k)))
+        sys.exit(0)
+
+    print(f"{'backend':<8} {'open ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'batch ms/q':>11} {'RSS +MB':>9}")
+    for backend in ("chroma", "numpy"):
+        output = subprocess.check_output(
+            [sys.executable, "-m", "benchmarks.retrieval", "--child", backend,
+             "--queries", str(args.queries), "--k", str(args.k)],
+            text=True,
+        )
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{backend:<8} {result['open_ms']:9.1f} {result['p50_ms']:9.3f} {result['p95_ms']:9.3f} "
+              f"{result['batch_ms_per_query']:11.3f} {result['rss_delta_mb']:9.1f}")
@@ -0,0 +1,151 @@
+"""
+Маршрутизация задач по моделям (resilience.ModelRouter) на локальной заглушке OpenRouter
+
+Сравнивает классификацию и извлечение данных заявки в двух вариантах:
+все задачи идут в модель с рассуждениями (как раньше, без max_tokens) и задачи
+по маршрутам LLM_ROUTES (быстрые модели, лимит токенов, рассуждения исключены).
+Задержки моделей задаются заглушке: R1 отвечает медленно, остальные модели быстро.
+Затем проверяет переход на резервную быструю модель: посреди прогона первая быстрая
+модель замедляется сверх бюджета задачи, и маршрутизатор должен перевести задачу.
+
+Запуск из корня репозитория:
+    python -m benchmarks.routing --requests 60 --reasoning-latency 8 --fast-latency 0.3
+"""
+import time
+import asyncio
+import argparse
+
+from config import LLM_MODELS, LLM_FAST_MODELS, LLM_ROUTES
+from benchmarks.fake_openrouter import FakeOpenRouter, start_server
+from benchmarks.load_test import fake_answer
+from benchmarks.retrieval import percentile
+from benchmarks.synthetic import generate_conversations
+from DeepSeekR1 import AsyncDeepSeekAPI
+
+TASKS = ("classify", "collect_info")
+
+
+def single_model_routes(model: str) -> dict:
+    """
+    Маршруты "как раньше": все задачи идут в одну модель без лимита токенов и с рассуждениями
+
+    Args:
+        model (str): модель
+
+    Returns:
+        dict: маршруты для AsyncDeepSeekAPI
+    """
+    return {task: dict(route, models=[model], max_tokens=None, reasoning=True, budget=float("inf"))
+            for task, route in LLM_ROUTES.items()}
+
+
+async def run_tasks(client: AsyncDeepSeekAPI, texts: list, concurrency: int, on_progress=None) -> dict:
+    """
+    Классифицирует сообщения и извлекает из них данные заявки
+
+    Args:
+        client (AsyncDeepSeekAPI): клиент модели
+        texts (list): тексты сообщений
+        concurrency (int): количество одновременных запросов
+        on_progress (Callable): вызывается с количеством обработанных сообщений
+
+    Returns:
+        dict: задача -> список задержек
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {task: [] for task in TASKS}
+    done = 0
+
+    async def one(text):
+        nonlocal done
+        async with semaphore:
+            for task in TASKS:
+                started = time.perf_counter()
+                await getattr(client, task)(text)
+                latencies[task].append(time.perf_counter() - started)
+            done += 1
+            if on_progress is not None:
+                on_progress(done)
+
+    await asyncio.gather(*(one(text) for text in texts))
+    return latencies
+
+
+def print_latencies(name: str, latencies: dict, fake: FakeOpenRouter):
+    """
+    Печатает перцентили задержки по задачам и распределение запросов по моделям
+
+    Args:
+        name (str): название сценария
+        latencies (dict): задача -> список задержек
+        fake (FakeOpenRouter): заглушка со счетчиками
+
+    Returns:
+        None
+    """
+    for task, values in latencies.items():
+        print(f"{name:<22} {task:<14} p50 {percentile(values, 0.5):6.2f} s, p95 {percentile(values, 0.95):6.2f} s")
+    models = {key[len("model:"):]: count for key, count in fake.stats.items() if key.startswith("model:")}
+    print(f"{'':<22} запросов по моделям: {models}, с max_tokens: {fake.stats['max_tokens']}")
+
+
+async def main(args):
+    """
+    Прогоняет сценарии и печатает результаты
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    dialogs, labels = generate_conversations(max(1, args.requests // 4), 4, seed=args.seed)
+    texts = [message.text for dialog in dialogs for message in dialog][:args.requests]
+    # R1 остается последним резервом быстрых задач, но отвечает медленно
+    model_latency = {model: args.fast_latency for model in LLM_MODELS + LLM_FAST_MODELS}
+    model_latency[LLM_MODELS[0]] = args.reasoning_latency
+
+    scenarios = [
+        ("все задачи на R1", dict(routes=single_model_routes(LLM_MODELS[0]))),
+        ("маршруты LLM_ROUTES", dict()),
+    ]
+    for name, options in scenarios:
+        fake = FakeOpenRouter(jitter=args.fast_latency / 5, answer=fake_answer(labels), model_latency=model_latency)
+        runner, api_url = await start_server(fake)
+        client = AsyncDeepSeekAPI("test", api_url=api_url, hedge=False, **options)
+        try:
+            latencies = await run_tasks(client, texts, args.concurrency)
+        finally:
+            await client.close()
+            await runner.cleanup()
+        print_latencies(name, latencies, fake)
+
+    # Первая быстрая модель замедляется на половине прогона
+    fake = FakeOpenRouter(jitter=args.fast_latency / 5, answer=fake_answer(labels), model_latency=model_latency)
+    runner, api_url = await start_server(fake)
+    client = AsyncDeepSeekAPI("test", api_url=api_url, hedge=False)
+
+    def slow_down(done):
+        if done == len(texts) // 2:
+            fake.model_latency[LLM_FAST_MODELS[0]] = args.degraded_latency
+
+    try:
+        latencies = await run_tasks(client, texts, args.concurrency, slow_down)
+    finally:
+        await client.close()
+        await runner.cleanup()
+    print_latencies("замедление модели", latencies, fake)
+    for task in TASKS:
+        print(f"{'':<22} {task}: текущий порядок моделей {client.router.order(task)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Маршрутизация задач по моделям")
+    parser.add_argument("--requests", type=int, default=60, help="количество сообщений")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--reasoning-latency", type=float, default=8.0, help="задержка модели с рассуждениями, s")
+    parser.add_argument("--fast-latency", type=float, default=0.3, help="задержка быстрой модели, s")
+    parser.add_argument("--degraded-latency", type=float, default=4.0,
+                        help="задержка замедлившейся быстрой модели, s")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
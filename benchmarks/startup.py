@@ -0,0 +1,45 @@
+"""
+Отчет о времени запуска
+
+Замеряет в свежем процессе импорт agent (без загрузки модели), загрузку модели
+эмбеддингов, подключение к векторной базе, первый и повторный поиск по базе
+и обучение локального классификатора.
+
+Запуск из корня репозитория:
+    python -m benchmarks.startup
+"""
+import time
+
+started = time.perf_counter()
+import agent
+import RAG
+import_seconds = time.perf_counter() - started
+
+
+def measure(name: str, fn):
+    """
+    Выполняет fn и печатает затраченное время
+
+    Args:
+        name (str): название этапа
+        fn (callable): замеряемая функция
+
+    Returns:
+        float: длительность в секундах
+    """
+    started = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - started
+    print(f"{name:<28} {seconds:8.3f} s")
+    return seconds
+
+
+if __name__ == "__main__":
+    print(f"{'import agent':<28} {import_seconds:8.3f} s")
+    print(f"{'RAG ready after import':<28} {str(RAG.is_ready()):>8}")
+    measure("model load", RAG.get_embeddings)
+    measure("vector store open", RAG.get_vector_store)
+    measure("first query", lambda: RAG.get_vector_store().similarity_search("Что подать к стейку?", k=3))
+    measure("second query", lambda: RAG.get_vector_store().similarity_search("Расскажи про Бордо", k=3))
+    if agent.preclassifier is not None:
+        measure("preclassifier fit", agent.preclassifier.fit)
@@ -0,0 +1,114 @@
+"""
+Синтетические сообщения Telegram для нагрузочных проверок
+
+Сообщения собираются из шаблонов трех классов (спам, вопрос, заявка) и оформляются
+как aiogram types.Message, поэтому проходят через граф агента так же, как настоящие.
+"""
+import random
+import datetime
+
+from aiogram import types
+
+SPAM = [
+    "Заработок от {n} рублей в день без вложений, пиши в личку",
+    "Купи криптовалюту сейчас, курс взлетит завтра! Ссылка в профиле",
+    "Привет",
+    "Подпишись на канал с прогнозами на спорт, {n}% проходимость",
+    "Продам аккаунт в игре, недорого, {n} уровень",
+    "asdf {n}",
+]
+QUESTIONS = [
+    "Что подать к стейку?",
+    "Какое вино подходит к рыбе?",
+    "Расскажи про регион {region}",
+    "Чем отличается {grape} от Мерло?",
+    "Где выращивают {grape}?",
+    "Какое вино выбрать к сыру?",
+    "Посоветуй вино к морепродуктам",
+    "Какие сорта растут в регионе {region}?",
+]
+APPLICATIONS = [
+    "Хочу заказать {n} бутылок {grape}, мой телефон +7 9{phone}",
+    "Здравствуйте, меня зовут {name}, хочу купить ящик вина {grape}. Почта {email}",
+    "Интересует оптовая поставка вина из региона {region}, звоните 8 9{phone}, {name}",
+    "Готов приобрести {n} бутылок к празднику, {name}, тел. +7 9{phone}",
+]
+GRAPES = ["Каберне Совиньон", "Альбариньо", "Пино Нуар", "Рислинг", "Шардоне", "Санджовезе"]
+REGIONS = ["Бордо", "Тоскана", "Риоха", "Бургундия", "Мозель", "Пьемонт"]
+NAMES = ["Иванов Иван", "Петрова Анна", "Сидоров Петр", "Смирнова Ольга"]
+KINDS = {"спам": SPAM, "вопрос": QUESTIONS, "заявка": APPLICATIONS}
+
+
+def random_text(kind: str, rng: random.Random) -> str:
+    """
+    Собирает текст сообщения заданного класса из шаблона
+
+    Args:
+        kind (str): "спам", "вопрос" или "заявка"
+        rng (Random): генератор случайных чисел
+
+    Returns:
+        str: текст сообщения
+    """
+    template = rng.choice(KINDS[kind])
+    return template.format(
+        n=rng.randint(2, 500),
+        grape=rng.choice(GRAPES),
+        region=rng.choice(REGIONS),
+        name=rng.choice(NAMES),
+        phone="".join(str(rng.randint(0, 9)) for _ in range(9)),
+        email=f"client{rng.randint(1, 999)}@example.com",
+    )
+
+
+def make_message(text: str, chat_id: int, message_id: int) -> types.Message:
+    """
+    Оформляет текст как сообщение Telegram из личного чата
+
+    Args:
+        text (str): текст сообщения
+        chat_id (int): идентификатор чата и пользователя
+        message_id (int): идентификатор сообщения
+
+    Returns:
+        Message: сообщение aiogram
+    """
+    return types.Message(
+        message_id=message_id,
+        date=datetime.datetime.now(datetime.timezone.utc),
+        chat=types.Chat(id=chat_id, type="private"),
+        from_user=types.User(id=chat_id, is_bot=False, first_name="Тест", username=f"user{chat_id}"),
+        text=text,
+    )
+
+
+def generate_conversations(conversations: int, messages: int, mix: dict = None, seed: int = 0):
+    """
+    Генерирует переписки: у каждой свой чат и последовательность сообщений
+
+    Args:
+        conversations (int): количество чатов
+        messages (int): количество сообщений в каждом чате
+        mix (dict): доли классов, по умолчанию {"спам": 0.2, "вопрос": 0.6, "заявка": 0.2}
+        seed (int): зерно генератора для воспроизводимости
+
+    Returns:
+        tuple: список переписок (списков Message) и словарь текст -> класс
+    """
+    rng = random.Random(seed)
+    mix = mix or {"спам": 0.2, "вопрос": 0.6, "заявка": 0.2}
+    kinds, weights = zip(*mix.items())
+    labels = {}
+    result = []
+    message_id = 1
+    for chat in range(conversations):
+        chat_id = 10 ** 6 + chat
+        dialog = []
+        for _ in range(messages):
+            kind = rng.choices(kinds, weights)[0]
+            text = random_text(kind, rng)
+            labels[text] = kind
+            dialog.append(make_message(text, chat_id, message_id))
+            message_id += 1
+        result.append(dialog)
+    return result, labels
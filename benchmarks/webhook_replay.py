@@ -0,0 +1,224 @@
+"""
+Проверка режима webhook: повтор обновлений Telegram в несколько процессов
+
+Поднимает локальные заглушки Bot API Telegram и OpenRouter, запускает
+python webhook.py --workers N --no-set-webhook и отправляет на него синтетические
+обновления с заголовком секрета, часть update_id - повторно (как при повторной доставке
+Telegram). Затем посылает SIGTERM и проверяет, что процессы дорабатывают принятые
+сообщения: каждое уникальное обновление должно быть обработано ровно один раз.
+
+Нужны Postgres (DSN из config.py) и построенная база знаний: python RAG_data.py
+
+Запуск из корня репозитория:
+    python -m benchmarks.webhook_replay --workers 4 --updates 200 --duplicates 0.1
+"""
+import os
+import sys
+import time
+import random
+import signal
+import asyncio
+import argparse
+import subprocess
+from collections import Counter
+
+from aiohttp import web, ClientSession
+
+from benchmarks.fake_openrouter import FakeOpenRouter, start_server
+from benchmarks.load_test import fake_answer
+from benchmarks.retrieval import percentile
+from benchmarks.synthetic import generate_conversations
+
+TOKEN = "123456:TEST"
+SECRET = "replay-secret"
+WEBHOOK_PATH = "/telegram/webhook"
+
+
+class FakeTelegram:
+    """
+    Заглушка Bot API: принимает вызовы методов и считает ответы пользователям по чатам
+    """
+    def __init__(self):
+        """
+        Returns:
+            None
+        """
+        self.calls = Counter()
+        self.replies = Counter()
+        self._message_id = 10 ** 6
+
+    async def handle(self, request):
+        """
+        Отвечает на вызов метода Bot API
+
+        Args:
+            request (Request): запрос aiohttp
+
+        Returns:
+            Response: ответ в формате Bot API
+        """
+        method = request.match_info["method"]
+        data = await request.post()
+        self.calls[method] += 1
+        if method not in ("sendMessage", "editMessageText"):
+            return web.json_response({"ok": True, "result": True})
+        chat_id = int(data["chat_id"])
+        if method == "sendMessage":
+            self.replies[chat_id] += 1
+        self._message_id += 1
+        return web.json_response({"ok": True, "result": {
+            "message_id": int(data.get("message_id") or self._message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data.get("text", ""),
+        }})
+
+
+async def start_telegram(fake: FakeTelegram):
+    """
+    Запускает заглушку Bot API на свободном порту
+
+    Args:
+        fake (FakeTelegram): заглушка
+
+    Returns:
+        tuple: (AppRunner, адрес сервера для TELEGRAM_API_URL)
+    """
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+async def wait_healthy(session: ClientSession, url: str, timeout: float):
+    """
+    Ждет, пока процессы webhook начнут отвечать
+
+    Args:
+        session (ClientSession): HTTP-сессия
+        url (str): адрес /healthz
+        timeout (float): максимальное ожидание, в секундах
+
+    Returns:
+        None
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"webhook не ответил за {timeout} s")
+
+
+async def post_update(session: ClientSession, url: str, payload: dict, latencies: list, statuses: Counter):
+    """
+    Отправляет обновление как Telegram и замеряет время ответа
+
+    Args:
+        session (ClientSession): HTTP-сессия
+        url (str): адрес webhook
+        payload (dict): обновление
+        latencies (list): длительности ответов, дополняется
+        statuses (Counter): коды ответов, дополняется
+
+    Returns:
+        None
+    """
+    started = time.perf_counter()
+    async with session.post(url, json=payload, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as response:
+        await response.read()
+        statuses[response.status] += 1
+    latencies.append(time.perf_counter() - started)
+
+
+async def main(args):
+    """
+    Запускает заглушки и процессы webhook, отправляет обновления и останавливает процессы
+
+    Args:
+        args (Namespace): параметры командной строки
+
+    Returns:
+        None
+    """
+    conversations = max(1, args.updates // args.messages)
+    dialogs, labels = generate_conversations(conversations, args.messages, seed=args.seed)
+    telegram = FakeTelegram()
+    openrouter = FakeOpenRouter(latency=args.latency, jitter=args.latency / 4, answer=fake_answer(labels))
+    telegram_runner, telegram_url = await start_telegram(telegram)
+    openrouter_runner, api_url = await start_server(openrouter)
+
+    env = dict(os.environ, TELEGRAM_API_URL=telegram_url, OPENROUTER_API_URL=api_url, BOT_TOKEN=TOKEN,
+               WEBHOOK_SECRET=SECRET, DEEP_API_TOKEN=os.environ.get("DEEP_API_TOKEN", "replay"))
+    process = subprocess.Popen([sys.executable, "webhook.py", "--workers", str(args.workers), "--host", "127.0.0.1",
+                                "--port", str(args.port), "--no-set-webhook"], env=env)
+    base = f"http://127.0.0.1:{args.port}"
+    rng = random.Random(args.seed)
+    # update_id уникален для прогона, чтобы отметки прошлых запусков в processed_updates не мешали
+    first_id = int(time.time()) * 1000
+    updates = []
+    for dialog in dialogs:
+        for message in dialog:
+            message_json = message.model_dump(mode="json", by_alias=True, exclude_none=True)
+            updates.append({"update_id": first_id + len(updates), "message": message_json})
+    duplicates = rng.sample(updates, int(len(updates) * args.duplicates))
+
+    latencies = []
+    statuses = Counter()
+    try:
+        async with ClientSession() as session:
+            await wait_healthy(session, base + "/healthz", args.startup_timeout)
+            started = time.perf_counter()
+
+            # Сообщения одного чата идут по порядку, чаты - параллельно, повторы - вперемешку с ними
+            async def send_dialog(index):
+                for payload in updates[index * args.messages:(index + 1) * args.messages]:
+                    await post_update(session, base + WEBHOOK_PATH, payload, latencies, statuses)
+
+            async def send_duplicates():
+                for payload in duplicates:
+                    await asyncio.sleep(rng.random() * 0.05)
+                    await post_update(session, base + WEBHOOK_PATH, payload, latencies, statuses)
+
+            await asyncio.gather(*(send_dialog(index) for index in range(len(dialogs))), send_duplicates())
+            accepted = time.perf_counter() - started
+    finally:
+        stop_started = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        exit_code = await asyncio.to_thread(process.wait)
+        drain = time.perf_counter() - stop_started
+        await telegram_runner.cleanup()
+        await openrouter_runner.cleanup()
+
+    replied_chats = len(telegram.replies)
+    print(f"Процессов: {args.workers}, обновлений: {len(updates)}, повторов: {len(duplicates)}, "
+          f"приняты за {accepted:.2f} s ({(len(updates) + len(duplicates)) / accepted:.1f} запр./s)")
+    print(f"Ответ webhook: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+          f"коды: {dict(statuses)}")
+    print(f"Остановка: {drain:.2f} s, код выхода {exit_code}")
+    print(f"Вызовы Bot API: {dict(telegram.calls)}, чатов с ответом: {replied_chats} из {len(dialogs)}")
+    # Каждое уникальное обновление дает ровно одно действие "печатает"; повтор - лишнее
+    typing = telegram.calls["sendChatAction"]
+    print(f"Обработано сообщений: {typing} из {len(updates)}"
+          + ("" if typing == len(updates) else " - ПОТЕРИ ИЛИ ДУБЛИ"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Повтор обновлений Telegram через режим webhook")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--updates", type=int, default=200, help="количество уникальных обновлений")
+    parser.add_argument("--messages", type=int, default=4, help="сообщений в каждом чате")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="доля повторно доставленных обновлений")
+    parser.add_argument("--latency", type=float, default=0.3, help="средняя задержка заглушки OpenRouter, s")
+    parser.add_argument("--port", type=int, default=8181)
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
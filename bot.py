@@ -1,21 +1,165 @@
 import os
+import time
+from collections import OrderedDict
 
 import asyncio
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from dotenv import load_dotenv
 
-from agent import run_agent
+from agent import run_agent, startup, shutdown, estimate_priority, db
+from config import (STREAM_EDIT_INTERVAL, TELEGRAM_MESSAGE_LIMIT, SCHEDULER_BUSY_TEXT, TELEGRAM_API_URL,
+                    LLM_ERROR_TEXT, STREAM_FINAL_EDIT_ATTEMPTS)
+from scheduler import ChatScheduler
+from metrics import registry, SCHEDULER_STATE
 
 load_dotenv()
 
-bot = Bot(token=os.environ["BOT_TOKEN"])
+
+
+def create_bot() -> Bot:
+    """
+    Создает объект бота. Если задан TELEGRAM_API_URL, запросы идут на этот сервер Bot API
+
+    Returns:
+        Bot: объект бота
+    """
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    return Bot(token=os.environ["BOT_TOKEN"], session=session)
+
+
+bot = create_bot()
 dp = Dispatcher()
+_recent_updates = OrderedDict()
 
 
-@dp.message()
-async def start_handler(message: types.Message):
+class StreamingReply:
+    """
+    Постепенно показывает ответ пользователю: первое сообщение отправляется
+    с первым фрагментом ответа, дальше оно редактируется не чаще одного раза
+    в STREAM_EDIT_INTERVAL секунд, чтобы не упираться в лимиты Telegram на правки
+    """
+    def __init__(self, message: types.Message, interval: float = STREAM_EDIT_INTERVAL):
+        """
+        Args:
+            message (Message): сообщение пользователя, на которое дается ответ
+            interval (float): минимальный интервал между правками, в секундах
+
+        Returns:
+            None
+        """
+        self.message = message
+        self.interval = interval
+        self.text = ""
+        self.reply = None
+        self._shown = ""
+        self._next_edit = 0.0
+
+    async def on_token(self, token: str):
+        """
+        Добавляет фрагмент ответа и при необходимости обновляет сообщение
+
+        Args:
+            token (str): очередной фрагмент ответа
+
+        Returns:
+            None
+        """
+        self.text += token
+        if not self.text.strip() or time.monotonic() < self._next_edit:
+            return
+        await self._show(self.text + " …")
+
+    async def finish(self, response: str):
+        """
+        Показывает итоговый ответ. Текст длиннее лимита Telegram досылается
+        отдельными сообщениями; вместо пустого ответа показывается LLM_ERROR_TEXT
+        (Telegram не принимает пустые сообщения). Если отредактировать потоковое сообщение
+        не удалось, ответ отправляется новым сообщением, чтобы пользователь не остался
+        с недописанным текстом
+
+        Args:
+            response (str): итоговый ответ агента
+
+        Returns:
+            None
+        """
+        if not (response or "").strip():
+            response = LLM_ERROR_TEXT
+        parts = [response[i:i + TELEGRAM_MESSAGE_LIMIT] for i in range(0, len(response), TELEGRAM_MESSAGE_LIMIT)]
+        parts = parts or [response]
+        if self.reply is None or not await self._show(parts[0], attempts=STREAM_FINAL_EDIT_ATTEMPTS):
+            await self.message.answer(parts[0])
+        for part in parts[1:]:
+            await self.message.answer(part)
+
+    async def _show(self, text: str, attempts: int = 1) -> bool:
+        """
+        Отправляет или редактирует сообщение с ответом
+
+        Args:
+            text (str): текст для показа
+            attempts (int): сколько раз пробовать при ограничении частоты; между попытками
+                ожидается указанное Telegram время. При одной попытке правка просто пропускается
+
+        Returns:
+            bool: True, если сообщение показывает text
+        """
+        text = text[:TELEGRAM_MESSAGE_LIMIT]
+        for attempt in range(attempts):
+            if text == self._shown:
+                return True
+            try:
+                if self.reply is None:
+                    self.reply = await self.message.answer(text)
+                else:
+                    await self.reply.edit_text(text)
+                self._shown = text
+                self._next_edit = time.monotonic() + self.interval
+                return True
+            except TelegramRetryAfter as e:
+                self._next_edit = time.monotonic() + e.retry_after
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                print(f"Не удалось обновить сообщение: {e}")
+                self._next_edit = time.monotonic() + self.interval
+                return False
+        return False
+
+
+@dp.startup()
+async def on_startup():
+    """
+    Подготавливает ресурсы агента при запуске бота
+
+    Returns:
+        None
+    """
+    await startup()
+
+
+@dp.shutdown()
+async def on_shutdown():
+    """
+    Дожидается обработки принятых сообщений и освобождает ресурсы агента
+    при остановке бота
+
+    Returns:
+        None
     """
-    Обрабатывает любое сообщение от пользователя телеграмм-боту
+    await scheduler.drain()
+    print(f"[ChatScheduler] {scheduler.metrics()}")
+    await shutdown()
+
+
+async def process_message(message: types.Message):
+    """
+    Запускает агента для сообщения и отправляет пользователю ответ
 
     Args:
         message (Message): объект сообщения от пользователя
@@ -25,9 +169,87 @@ async def start_handler(message: types.Message):
     """
     await bot.send_chat_action(chat_id=message.chat.id, action="typing")
     print("start agent")
-    response = await run_agent(message)
+    reply = StreamingReply(message)
+    response = await run_agent(message, on_token=reply.on_token)
     print("agent is done")
-    await message.answer(response)
+    await reply.finish(response)
+
+
+async def reply_busy(message: types.Message):
+    """
+    Сообщает пользователю, что его сообщение не принято из-за перегрузки
+
+    Args:
+        message (Message): объект сообщения от пользователя
+
+    Returns:
+        None
+    """
+    await message.answer(SCHEDULER_BUSY_TEXT)
+
+
+scheduler = ChatScheduler(process_message, priority_fn=estimate_priority, on_overflow=reply_busy)
+
+
+def collect_scheduler_metrics():
+    """
+    Переносит показатели планировщика в метрики перед экспортом
+
+    Returns:
+        None
+    """
+    for name, value in scheduler.metrics().items():
+        SCHEDULER_STATE.set(name, value=value)
+
+
+registry.add_collector(collect_scheduler_metrics)
+
+
+@dp.message()
+async def start_handler(message: types.Message):
+    """
+    Обрабатывает любое сообщение от пользователя телеграмм-боту: ставит его
+    в очередь планировщика
+
+    Args:
+        message (Message): объект сообщения от пользователя
+
+    Returns:
+        None
+    """
+    await scheduler.submit(message)
+
+
+async def deduplicate_updates(handler, update: types.Update, data: dict):
+    """
+    Внешний middleware обновлений: пропускает повторные доставки одного update_id.
+    Недавние идентификаторы проверяются в памяти, остальные - в общей таблице
+    processed_updates, чтобы повтор не прошел и через другой процесс webhook.
+    Если база недоступна, обновление обрабатывается
+
+    Args:
+        handler (Callable): следующий обработчик
+        update (Update): обновление Telegram
+        data (dict): данные контекста aiogram
+
+    Returns:
+        Any: результат обработчика или None для повтора
+    """
+    if update.update_id in _recent_updates:
+        print(f"Повторная доставка update_id={update.update_id} пропущена")
+        return None
+    _recent_updates[update.update_id] = None
+    if len(_recent_updates) > 10000:
+        _recent_updates.popitem(last=False)
+    try:
+        first = await db.claim_update(update.update_id)
+    except Exception as e:
+        print(f"Не удалось проверить update_id={update.update_id}: {e}")
+        first = True
+    if not first:
+        print(f"Повторная доставка update_id={update.update_id} пропущена")
+        return None
+    return await handler(update, data)
 
 
 async def main():
@@ -0,0 +1,152 @@
+import re
+import math
+from typing import List
+
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_CHARS_PER_TOKEN, CONTEXT_DUPLICATE_THRESHOLD
+
+WORD_PATTERN = re.compile(r"\w+")
+SHINGLE_SIZE = 3
+# Сплиттер срезает пробелы и переводы строк на границах чанков, поэтому соседние
+# чанки без перекрытия разделены несколькими символами
+ADJACENT_GAP = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценивает количество токенов текста для модели. Точного токенизатора DeepSeek
+    в окружении бота нет, поэтому используется среднее число символов на токен
+
+    Args:
+        text (str): текст
+
+    Returns:
+        int: оценка количества токенов
+    """
+    return math.ceil(len(text) / CONTEXT_CHARS_PER_TOKEN)
+
+
+def _shingles(text: str) -> set:
+    """
+    Разбивает текст на пересекающиеся тройки слов
+
+    Args:
+        text (str): текст
+
+    Returns:
+        set: множество троек слов
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def merge_overlapping(docs: list) -> List[dict]:
+    """
+    Склеивает найденные чанки одной статьи, которые пересекаются или идут подряд
+    в исходном тексте (по метаданным source и start_index). Перекрытие выбрасывается,
+    соседние чанки без перекрытия разделяются переводом строки. Чанки без start_index
+    остаются отдельными фрагментами
+
+    Args:
+        docs (list): документы в порядке убывания релевантности
+
+    Returns:
+        List[dict]: фрагменты {"text", "source", "rank", "chunks"}, где rank - лучший
+                    номер входящего в фрагмент чанка в исходной выдаче
+    """
+    passages = []
+    spans = {}
+    for rank, doc in enumerate(docs):
+        source = doc.metadata.get("source")
+        start = doc.metadata.get("start_index")
+        if source is None or start is None or start < 0:
+            passages.append({"text": doc.page_content, "source": source, "rank": rank, "chunks": 1})
+            continue
+        spans.setdefault(source, []).append((start, start + len(doc.page_content), rank, doc.page_content))
+
+    for source, items in spans.items():
+        items.sort()
+        start, end, rank, text = items[0]
+        chunks = 1
+        for next_start, next_end, next_rank, next_text in items[1:]:
+            if next_start <= end + ADJACENT_GAP:
+                if next_start > end:
+                    text += "\n" + next_text
+                    end = next_end
+                elif next_end > end:
+                    text += next_text[end - next_start:]
+                    end = next_end
+                rank = min(rank, next_rank)
+                chunks += 1
+                continue
+            passages.append({"text": text, "source": source, "rank": rank, "chunks": chunks})
+            start, end, rank, text, chunks = next_start, next_end, next_rank, next_text, 1
+        passages.append({"text": text, "source": source, "rank": rank, "chunks": chunks})
+
+    passages.sort(key=lambda passage: passage["rank"])
+    return passages
+
+
+def drop_near_duplicates(passages: List[dict], threshold: float = CONTEXT_DUPLICATE_THRESHOLD) -> List[dict]:
+    """
+    Убирает фрагменты, почти целиком содержащиеся в более релевантных фрагментах
+    (одинаковые абзацы в разных статьях, перепечатки)
+
+    Args:
+        passages (List[dict]): фрагменты в порядке убывания релевантности
+        threshold (float): доля общих троек слов, начиная с которой фрагмент считается дубликатом
+
+    Returns:
+        List[dict]: фрагменты без дубликатов
+    """
+    kept = []
+    kept_shingles = []
+    for passage in passages:
+        shingles = _shingles(passage["text"])
+        duplicate = any(
+            shingles and len(shingles & other) / len(shingles) >= threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(passage)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def assemble_context(docs: list, token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Собирает контекст для промпта: склеивает пересекающиеся чанки, убирает дубликаты
+    и добавляет фрагменты в порядке релевантности, пока они помещаются в бюджет токенов.
+    Если не помещается даже первый фрагмент, он обрезается по бюджету
+
+    Args:
+        docs (list): найденные документы в порядке убывания релевантности
+        token_budget (int): максимальное количество токенов контекста
+
+    Returns:
+        tuple: текст контекста и статистика {"chunks", "passages", "used", "tokens", "raw_tokens"}
+    """
+    passages = drop_near_duplicates(merge_overlapping(docs))
+
+    selected = []
+    used_tokens = 0
+    for passage in passages:
+        tokens = estimate_tokens(passage["text"])
+        if used_tokens + tokens > token_budget:
+            continue
+        selected.append(passage["text"])
+        used_tokens += tokens
+    if not selected and passages:
+        text = passages[0]["text"][:int(token_budget * CONTEXT_CHARS_PER_TOKEN)]
+        selected.append(text)
+        used_tokens = estimate_tokens(text)
+
+    stats = {
+        "chunks": len(docs),
+        "passages": len(passages),
+        "used": len(selected),
+        "tokens": used_tokens,
+        "raw_tokens": sum(estimate_tokens(doc.page_content) for doc in docs),
+    }
+    return "\n\n".join(selected), stats
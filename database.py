@@ -1,35 +1,168 @@
+import time
+import asyncio
+
 from aiogram import types
 import asyncpg
 
+from config import (DB_FLUSH_SIZE, DB_FLUSH_INTERVAL, DB_BUFFER_LIMIT, UPDATE_DEDUP_TTL_HOURS,
+                    LEAD_MERGE_WINDOW_HOURS, LEADS_PAGE_SIZE)
+from metrics import DB_FLUSH_SECONDS, DB_ROWS_TOTAL
+
+
+# Заявка пользователя, уже оставившего заявку за последние $12 секунд, объединяется с ней:
+# текст и дата берутся из новой, непустые поля новой заменяют старые, счетчик растет
+UPSERT_MESSAGE_QUERY = '''
+WITH recent AS (
+    SELECT id FROM user_requests
+    WHERE user_id = $2 AND created_at > NOW() - make_interval(secs => $12)
+    ORDER BY created_at DESC
+    LIMIT 1
+), merged AS (
+    UPDATE user_requests r SET
+        message_id = $1,
+        username = COALESCE($3, r.username),
+        first_name = COALESCE($4, r.first_name),
+        last_name = COALESCE($5, r.last_name),
+        chat_id = $6,
+        message_date = $7,
+        message_text = $8,
+        contact_info = COALESCE($9, r.contact_info),
+        fio = COALESCE($10, r.fio),
+        product_interest = COALESCE($11, r.product_interest),
+        submissions = r.submissions + 1,
+        updated_at = NOW()
+    FROM recent
+    WHERE r.id = recent.id
+    RETURNING r.id
+)
+INSERT INTO user_requests (
+    message_id,
+    user_id,
+    username,
+    first_name,
+    last_name,
+    chat_id,
+    message_date,
+    message_text,
+    contact_info,
+    fio,
+    product_interest
+)
+SELECT $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11
+WHERE NOT EXISTS (SELECT 1 FROM merged)
+'''
+
+# Ключ advisory-блокировки записи заявок: объединение по окну должно видеть заявки,
+# записанные другими процессами бота
+LEADS_LOCK_KEY = 0x1EAD5
+
+LEAD_COLUMNS = ('''id, message_id, user_id, username, first_name, last_name, chat_id, message_date, message_text,
+    contact_info, fio, product_interest, submissions, created_at, updated_at''')
+
+INSERT_MESSAGE_QUERY = '''
+INSERT INTO user_requests (
+    message_id,
+    user_id,
+    username,
+    first_name,
+    last_name,
+    chat_id,
+    message_date,
+    message_text,
+    contact_info,
+    fio,
+    product_interest
+) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+'''
+
+# Порядок значений в строках буфера (_message_row)
+ROW_COLUMNS = ("message_id", "user_id", "username", "first_name", "last_name", "chat_id", "message_date",
+               "message_text", "contact_info", "fio", "product_interest")
+
+CLAIM_UPDATE_QUERY = '''
+INSERT INTO processed_updates (update_id) VALUES ($1)
+ON CONFLICT (update_id) DO NOTHING
+RETURNING update_id
+'''
+
 class UserMessagesDB:
     """
     Класс пользовательской базы данных
     """
-    def __init__(self, dsn: str):
+    def __init__(self, dsn: str, flush_size: int = DB_FLUSH_SIZE, flush_interval: float = DB_FLUSH_INTERVAL,
+                 merge_window_hours: float = LEAD_MERGE_WINDOW_HOURS):
         """
         Инициализирует объект с параметром подключения к базе данных
 
         Args:
             dsn (str): Строка подключения к базе данных
+            flush_size (int): количество записей в буфере, при котором он сбрасывается в базу;
+                0 - только явным вызовом flush
+            flush_interval (float): период фонового сброса буфера, в секундах; 0 - без фонового сброса
+            merge_window_hours (float): окно, в котором повторная заявка пользователя объединяется
+                с предыдущей, в часах; 0 - каждая заявка записывается отдельно
 
         Returns:
             None
         """
         self.dsn = dsn
         self.pool = None
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.merge_window_hours = merge_window_hours
+        self._buffer = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
 
     async def connect(self):
         """
-        Подключение к серверу базы данных
+        Подключение к серверу базы данных и запуск фонового сброса буфера.
+        Повторный вызов не создает новый пул
 
         Returns:
             None
         """
-        self.pool = await asyncpg.create_pool(self.dsn)
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(self.dsn)
+        if self._flush_task is None and self.flush_interval:
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """
+        Останавливает фоновый сброс, записывает остаток буфера и закрывает пул.
+        Пул закрывается, даже если запись не удалась; незаписанные заявки печатаются
+        в журнал, чтобы их можно было восстановить вручную
+
+        Returns:
+            None
+
+        Raises:
+            Exception: ошибка записи остатка буфера (после закрытия пула)
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self.pool is not None:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[UserMessagesDB] Ошибка записи буфера при закрытии: {e}; "
+                      f"не записано сообщений: {len(self._buffer)}")
+                self._log_lost_rows(self._buffer)
+                self._buffer = []
+                raise
+            finally:
+                await self.pool.close()
+                self.pool = None
 
     async def create_table(self):
         """
-        Создание таблицы пользовательских сообщений
+        Создание таблицы пользовательских сообщений и ее индексов. Таблица, созданная
+        прежней версией, дополняется новыми колонками
 
         Returns:
             None
@@ -40,7 +173,7 @@ class UserMessagesDB:
                     message_id BIGINT NOT NULL,
                     user_id BIGINT NOT NULL,
                     username VARCHAR(64),
-                    first_name VARCHAR(128) NOT NULL,
+                    first_name VARCHAR(128),
                     last_name VARCHAR(128),
                     chat_id BIGINT NOT NULL,
                     message_date TIMESTAMP NOT NULL,
@@ -50,10 +183,172 @@ class UserMessagesDB:
                     product_interest VARCHAR(255),
                     created_at TIMESTAMP DEFAULT NOW()
                 );
+                -- У пользователя Telegram может не быть имени, а в пакетном режиме профиля нет вовсе
+                ALTER TABLE user_requests ALTER COLUMN first_name DROP NOT NULL;
+                ALTER TABLE user_requests ADD COLUMN IF NOT EXISTS submissions INTEGER NOT NULL DEFAULT 1;
+                ALTER TABLE user_requests ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+                CREATE INDEX IF NOT EXISTS user_requests_user_id_idx
+                    ON user_requests (user_id, created_at);
+                CREATE INDEX IF NOT EXISTS user_requests_created_at_idx
+                    ON user_requests (created_at, id);
+                CREATE INDEX IF NOT EXISTS user_requests_product_interest_idx
+                    ON user_requests (lower(product_interest), created_at, id);
+                CREATE TABLE IF NOT EXISTS processed_updates (
+                    update_id BIGINT PRIMARY KEY,
+                    received_at TIMESTAMP NOT NULL DEFAULT NOW()
+                );
+                CREATE INDEX IF NOT EXISTS processed_updates_received_at_idx
+                    ON processed_updates (received_at);
                 '''
         async with self.pool.acquire() as conn:
             await conn.execute(query)
 
+    async def claim_update(self, update_id: int) -> bool:
+        """
+        Отмечает обновление Telegram как принятое. Таблица общая для всех процессов
+        бота, поэтому повторная доставка того же update_id в любой процесс не пройдет
+
+        Args:
+            update_id (int): идентификатор обновления Telegram
+
+        Returns:
+            bool: True, если обновление пришло впервые
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(CLAIM_UPDATE_QUERY, update_id) is not None
+
+    async def prune_updates(self, max_age_hours: float = UPDATE_DEDUP_TTL_HOURS) -> int:
+        """
+        Удаляет отметки о старых обновлениях: Telegram повторяет доставку
+        только в течение суток
+
+        Args:
+            max_age_hours (float): возраст отметки, после которого она удаляется, в часах
+
+        Returns:
+            int: количество удаленных отметок
+        """
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(
+                "DELETE FROM processed_updates WHERE received_at < NOW() - make_interval(secs => $1)",
+                max_age_hours * 3600,
+            )
+        return int(status.split()[-1])
+
+    async def list_leads(self, limit: int = LEADS_PAGE_SIZE, cursor: tuple = None, user_id: int = None,
+                         product: str = None, since=None, until=None):
+        """
+        Возвращает страницу заявок от новых к старым. Пагинация по ключу (created_at, id):
+        следующая страница начинается сразу после курсора, поэтому запрос идет по индексу
+        и не замедляется на дальних страницах, как OFFSET
+
+        Args:
+            limit (int): размер страницы
+            cursor (tuple): курсор из предыдущего вызова или None для первой страницы
+            user_id (int): только заявки пользователя
+            product (str): только заявки с этим продуктом (без учета регистра)
+            since (datetime): только заявки, созданные не раньше
+            until (datetime): только заявки, созданные раньше
+
+        Returns:
+            tuple: список заявок (dict) и курсор следующей страницы или None, если это последняя
+        """
+        conditions = []
+        args = []
+        for condition, value in (("user_id = ?", user_id), ("lower(product_interest) = lower(?)", product),
+                                 ("created_at >= ?", since), ("created_at < ?", until)):
+            if value is not None:
+                args.append(value)
+                conditions.append(condition.replace("?", f"${len(args)}"))
+        if cursor is not None:
+            args.extend(cursor)
+            conditions.append(f"(created_at, id) < (${len(args) - 1}, ${len(args)})")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        args.append(limit)
+        query = (f"SELECT {LEAD_COLUMNS} FROM user_requests {where} "
+                 f"ORDER BY created_at DESC, id DESC LIMIT ${len(args)}")
+        async with self.pool.acquire() as conn:
+            rows = [dict(row) for row in await conn.fetch(query, *args)]
+        next_cursor = (rows[-1]["created_at"], rows[-1]["id"]) if len(rows) == limit else None
+        return rows, next_cursor
+
+    async def iterate_leads(self, page_size: int = LEADS_PAGE_SIZE, **filters):
+        """
+        Перебирает все заявки, подходящие под фильтры, постранично
+
+        Args:
+            page_size (int): размер страницы
+            filters: фильтры list_leads (user_id, product, since, until)
+
+        Yields:
+            dict: заявка
+        """
+        cursor = None
+        while True:
+            rows, cursor = await self.list_leads(page_size, cursor, **filters)
+            for row in rows:
+                yield row
+            if cursor is None:
+                return
+
+    @staticmethod
+    def _message_row(message: types.Message,
+                     contact_info: str = None,
+                     fio: str = None,
+                     product_interest: str = None) -> tuple:
+        """
+        Преобразует сообщение в кортеж значений для INSERT_MESSAGE_QUERY
+
+        Args:
+            message (Message): объект сообщения от пользователя или MessageRecord
+            contact_info (str): строка с контактными данными пользователя
+            fio (str): фио пользователя
+            product_interest (str): желаемый продукт
+
+        Returns:
+            tuple: значения колонок таблицы user_requests
+        """
+        raw_date = message.date if message.date else None
+        if raw_date:
+            db_date = raw_date.replace(tzinfo=None)
+        else:
+            db_date = None
+
+        return (
+            message.message_id,
+            message.from_user.id if message.from_user else None,
+            message.from_user.username if message.from_user else None,
+            message.from_user.first_name if message.from_user else None,
+            message.from_user.last_name if message.from_user else None,
+            message.chat.id if message.chat else None,
+            db_date,
+            message.text,
+            contact_info,
+            fio,
+            product_interest
+        )
+
+    async def _write_rows(self, conn, rows: list):
+        """
+        Записывает строки заявок с объединением повторных заявок в пределах merge_window.
+        Запись идет в одной транзакции под advisory-блокировкой, поэтому два процесса
+        не создадут две заявки одного пользователя вместо одной
+
+        Args:
+            conn (Connection): соединение с базой данных
+            rows (list): строки от _message_row
+
+        Returns:
+            None
+        """
+        window = self.merge_window_hours * 3600
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", LEADS_LOCK_KEY)
+            if window > 0:
+                await conn.executemany(UPSERT_MESSAGE_QUERY, [row + (window,) for row in rows])
+            else:
+                await conn.executemany(INSERT_MESSAGE_QUERY, rows)
+
     async def save_message(self, message: types.Message,
                            contact_info: str = None,
                            fio: str = None,
@@ -62,7 +357,7 @@ class UserMessagesDB:
         Сохранение сообщения в базе данных
 
         Args:
-            message (Message): объект сообщения от пользователя
+            message (Message): объект сообщения от пользователя или MessageRecord
             contact_info (str): строка с контактными данными пользователя
             fio (str): фио пользователя
             product_interest (str): желаемый продукт
@@ -70,40 +365,88 @@ class UserMessagesDB:
         Returns:
             None
         """
-        query = '''
-        INSERT INTO user_requests (
-            message_id,
-            user_id,
-            username,
-            first_name,
-            last_name,
-            chat_id,
-            message_date,
-            message_text,
-            contact_info,
-            fio,
-            product_interest
-        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-        '''
+        row = self._message_row(message, contact_info, fio, product_interest)
+        async with self.pool.acquire() as conn:
+            await self._write_rows(conn, [row])
 
-        raw_date = message.date if message.date else None
-        if raw_date:
-            db_date = raw_date.replace(tzinfo=None)
-        else:
-            db_date = None
+    async def enqueue_message(self, message: types.Message,
+                              contact_info: str = None,
+                              fio: str = None,
+                              product_interest: str = None):
+        """
+        Добавляет сообщение в буфер отложенной записи. Буфер сбрасывается в базу
+        при достижении flush_size, по таймеру или при закрытии
 
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                query,
-                message.message_id,
-                message.from_user.id if message.from_user else None,
-                message.from_user.username if message.from_user else None,
-                message.from_user.first_name if message.from_user else None,
-                message.from_user.last_name if message.from_user else None,
-                message.chat.id if message.chat else None,
-                db_date,
-                message.text,
-                contact_info,
-                fio,
-                product_interest
-            )
+        Args:
+            message (Message): объект сообщения от пользователя или MessageRecord
+            contact_info (str): строка с контактными данными пользователя
+            fio (str): фио пользователя
+            product_interest (str): желаемый продукт
+
+        Returns:
+            None
+        """
+        self._buffer.append(self._message_row(message, contact_info, fio, product_interest))
+        if self.flush_size and len(self._buffer) >= self.flush_size:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[UserMessagesDB] Ошибка записи буфера: {e}")
+
+    async def flush(self):
+        """
+        Записывает накопленные в буфере сообщения одним пакетом через executemany.
+        При ошибке записи строки возвращаются в буфер до следующей попытки; строки сверх
+        DB_BUFFER_LIMIT, начиная с самых старых, выводятся в лог для ручного восстановления
+
+        Returns:
+            None
+        """
+        async with self._flush_lock:
+            rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            started = time.perf_counter()
+            try:
+                async with self.pool.acquire() as conn:
+                    await self._write_rows(conn, rows)
+            except Exception:
+                DB_FLUSH_SECONDS.observe("error", value=time.perf_counter() - started)
+                rows += self._buffer
+                overflow = max(len(rows) - DB_BUFFER_LIMIT, 0)
+                if overflow:
+                    print(f"[UserMessagesDB] Буфер переполнен, не будет записано сообщений: {overflow}")
+                    self._log_lost_rows(rows[:overflow])
+                self._buffer = rows[overflow:]
+                raise
+            DB_FLUSH_SECONDS.observe("ok", value=time.perf_counter() - started)
+            DB_ROWS_TOTAL.inc(amount=len(rows))
+            print(f"[UserMessagesDB] Записано сообщений: {len(rows)}")
+
+    @staticmethod
+    def _log_lost_rows(rows: list):
+        """
+        Выводит в лог строки, которые не будут записаны в базу, чтобы их можно было восстановить вручную
+
+        Args:
+            rows (list): строки в порядке ROW_COLUMNS
+
+        Returns:
+            None
+        """
+        for row in rows:
+            print(f"[UserMessagesDB] Не записано: {dict(zip(ROW_COLUMNS, row))}")
+
+    async def _flush_periodically(self):
+        """
+        Фоновая задача, сбрасывающая буфер каждые flush_interval секунд
+
+        Returns:
+            None
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[UserMessagesDB] Ошибка записи буфера: {e}")
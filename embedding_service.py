@@ -0,0 +1,603 @@
+import os
+import json
+import time
+import base64
+import signal
+import socket
+import struct
+import asyncio
+import argparse
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from config import (EMBEDDING_MODEL, EMBED_BATCH_SIZE, RETRIEVAL_BACKEND, NUMPY_INDEX_DIR, VECTOR_DB_DIR,
+                    COLLECTION_NAME, MANIFEST_PATH, EMBEDDING_SERVICE_SOCKET, EMBEDDING_SERVICE_MAX_BATCH,
+                    EMBEDDING_SERVICE_MAX_WAIT, EMBEDDING_SERVICE_CONNECT_TIMEOUT, EMBEDDING_SERVICE_TIMEOUT)
+
+# Кадр протокола: длина тела (4 байта, big-endian) и тело в JSON
+HEADER = struct.Struct(">I")
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def encode_vectors(vectors) -> List[str]:
+    """
+    Упаковывает векторы в base64 от float32: вчетверо компактнее списка чисел в JSON
+
+    Args:
+        vectors (list): векторы
+
+    Returns:
+        List[str]: строки base64
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return [base64.b64encode(row.tobytes()).decode("ascii") for row in matrix]
+
+
+def decode_vectors(encoded: List[str]) -> List[list]:
+    """
+    Распаковывает векторы, упакованные encode_vectors
+
+    Args:
+        encoded (List[str]): строки base64
+
+    Returns:
+        List[list]: векторы
+    """
+    return [np.frombuffer(base64.b64decode(item), dtype=np.float32).tolist() for item in encoded]
+
+
+def _pack(payload: dict) -> bytes:
+    """
+    Формирует кадр протокола
+
+    Args:
+        payload (dict): тело сообщения
+
+    Returns:
+        bytes: кадр
+    """
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return HEADER.pack(len(body)) + body
+
+
+class _Request:
+    """
+    Тексты одного запроса на эмбеддинги и future, в который попадет результат
+    """
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: list, future: asyncio.Future):
+        """
+        Args:
+            texts (list): тексты
+            future (Future): результат - эмбеддинги в порядке текстов
+
+        Returns:
+            None
+        """
+        self.texts = texts
+        self.future = future
+
+
+class EmbeddingBatcher:
+    """
+    Объединяет одновременные запросы на эмбеддинги в один прогон модели. Первый запрос
+    ждет попутчиков не дольше max_wait, пачка ограничена max_batch текстами; прогоны
+    выполняются по одному в отдельном потоке, пока следующая пачка набирается
+    """
+    def __init__(self, model, max_batch: int = EMBEDDING_SERVICE_MAX_BATCH,
+                 max_wait: float = EMBEDDING_SERVICE_MAX_WAIT):
+        """
+        Args:
+            model (Embeddings): модель эмбеддингов
+            max_batch (int): максимальное количество текстов в прогоне
+            max_wait (float): сколько ждать попутные запросы, в секундах
+
+        Returns:
+            None
+        """
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "max_batch": 0, "model_seconds": 0.0}
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        """
+        Запускает цикл сборки пачек в текущем цикле событий
+
+        Returns:
+            None
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Останавливает цикл сборки пачек
+
+        Returns:
+            None
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def embed(self, texts: list) -> list:
+        """
+        Ставит тексты в очередь и дожидается их эмбеддингов
+
+        Args:
+            texts (list): тексты
+
+        Returns:
+            list: эмбеддинги в порядке текстов
+        """
+        if not texts:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Request(texts, future))
+        return await future
+
+    async def _collect(self) -> list:
+        """
+        Набирает пачку запросов: берет первый и добавляет пришедшие за max_wait
+
+        Returns:
+            list: запросы пачки
+        """
+        batch = [await self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while size < self.max_batch:
+            try:
+                request = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    async def _run(self):
+        """
+        Цикл: набрать пачку, посчитать эмбеддинги уникальных текстов, раздать результаты
+
+        Returns:
+            None
+        """
+        while True:
+            batch = await self._collect()
+            unique = list(dict.fromkeys(text for request in batch for text in request.texts))
+            started = time.perf_counter()
+            try:
+                vectors = await asyncio.to_thread(self.model.embed_documents, unique)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            self.stats["model_seconds"] += time.perf_counter() - started
+            self.stats["requests"] += len(batch)
+            self.stats["texts"] += len(unique)
+            self.stats["batches"] += 1
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(unique))
+            by_text = dict(zip(unique, vectors))
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_result([by_text[text] for text in request.texts])
+
+
+class EmbeddingService:
+    """
+    Сервер эмбеддингов и поиска на Unix-сокете. Держит одну копию модели и индекса
+    на все процессы бота. Операции: ping, embed, search, stats
+    """
+    def __init__(self, socket_path: str, max_batch: int = EMBEDDING_SERVICE_MAX_BATCH,
+                 max_wait: float = EMBEDDING_SERVICE_MAX_WAIT):
+        """
+        Args:
+            socket_path (str): путь к Unix-сокету
+            max_batch (int): максимальное количество текстов в прогоне модели
+            max_wait (float): сколько ждать попутные запросы, в секундах
+
+        Returns:
+            None
+        """
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.model = None
+        self.batcher = None
+        self._retriever = None
+        self._manifest_mtime = None
+        self._server = None
+        self._stop = None
+
+    def _load_model(self):
+        """
+        Загружает модель эмбеддингов
+
+        Returns:
+            HuggingFaceEmbeddings: модель
+        """
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'batch_size': EMBED_BATCH_SIZE},
+        )
+
+    def _get_retriever(self):
+        """
+        Возвращает бэкенд поиска, выбранный в RETRIEVAL_BACKEND. Индекс NumPy
+        перечитывается после переиндексации базы знаний
+
+        Returns:
+            ChromaRetriever | NumpyRetriever: объект поиска чанков по эмбеддингу
+        """
+        from retrieval import ChromaRetriever, NumpyRetriever
+        from vector_index import NumpyVectorIndex
+
+        if RETRIEVAL_BACKEND != "numpy":
+            if self._retriever is None:
+                from langchain_chroma import Chroma
+
+                self._retriever = ChromaRetriever(Chroma(
+                    collection_name=COLLECTION_NAME,
+                    embedding_function=self.model,
+                    persist_directory=VECTOR_DB_DIR,
+                ))
+            return self._retriever
+
+        try:
+            mtime = os.path.getmtime(MANIFEST_PATH)
+        except OSError:
+            mtime = None
+        if self._retriever is None or mtime != self._manifest_mtime:
+            version = NumpyVectorIndex.read_version(NUMPY_INDEX_DIR)
+            if self._retriever is None or self._retriever.index.version != version:
+                self._retriever = NumpyRetriever(NumpyVectorIndex.load(NUMPY_INDEX_DIR))
+            self._manifest_mtime = mtime
+        return self._retriever
+
+    async def _dispatch(self, request: dict) -> dict:
+        """
+        Выполняет одну операцию
+
+        Args:
+            request (dict): {"op": ..., параметры операции}
+
+        Returns:
+            dict: ответ операции
+        """
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True}
+        if op == "embed":
+            vectors = await self.batcher.embed(request["texts"])
+            return {"ok": True, "vectors": encode_vectors(vectors)}
+        if op == "search":
+            vectors = decode_vectors(request["vectors"])
+            results = await asyncio.to_thread(
+                lambda: self._get_retriever().search_batch(vectors, int(request["k"])))
+            return {"ok": True, "results": [
+                [{"id": doc.id, "text": doc.page_content, "metadata": doc.metadata} for doc in docs]
+                for docs in results
+            ]}
+        if op == "stats":
+            return {"ok": True, "stats": self.batcher.stats}
+        return {"ok": False, "error": f"неизвестная операция: {op}"}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Обслуживает одно соединение: запросы читаются и выполняются по очереди,
+        параллельность дают соединения разных потоков и процессов
+
+        Args:
+            reader (StreamReader): поток чтения
+            writer (StreamWriter): поток записи
+
+        Returns:
+            None
+        """
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                (length,) = HEADER.unpack(header)
+                if length > MAX_FRAME:
+                    break
+                request = json.loads(await reader.readexactly(length))
+                try:
+                    response = await self._dispatch(request)
+                except Exception as e:
+                    response = {"ok": False, "error": repr(e)}
+                writer.write(_pack(response))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """
+        Загружает модель и индекс и обслуживает запросы до SIGTERM/SIGINT
+
+        Returns:
+            None
+        """
+        started = time.perf_counter()
+        self.model = await asyncio.to_thread(self._load_model)
+        try:
+            await asyncio.to_thread(self._get_retriever)
+        except Exception as e:
+            # Эмбеддинги нужны и без индекса (классификатор, кэш ответов), поиск заработает после индексации
+            print(f"[embeddings] Индекс не загружен: {e}")
+        self.batcher = EmbeddingBatcher(self.model, self.max_batch, self.max_wait)
+        self.batcher.start()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        print(f"[embeddings] Сервис готов за {time.perf_counter() - started:.2f} s: {self.socket_path}")
+
+        self._stop = asyncio.Event()
+        if threading.current_thread() is threading.main_thread():
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, self._stop.set)
+        try:
+            await self._stop.wait()
+        finally:
+            self._server.close()
+            await self._server.wait_closed()
+            await self.batcher.stop()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            print(f"[embeddings] Сервис остановлен: {self.batcher.stats}")
+
+
+def serve(socket_path: str = EMBEDDING_SERVICE_SOCKET):
+    """
+    Запускает сервис эмбеддингов в текущем процессе
+
+    Args:
+        socket_path (str): путь к Unix-сокету
+
+    Returns:
+        None
+    """
+    asyncio.run(EmbeddingService(socket_path).serve())
+
+
+class EmbeddingServiceError(RuntimeError):
+    """
+    Сервис эмбеддингов недоступен или вернул ошибку
+    """
+
+
+class EmbeddingServiceClient(Embeddings):
+    """
+    Модель эмбеддингов, которая считает векторы в общем сервисе. Синхронная, как
+    HuggingFaceEmbeddings: у каждого потока свое соединение, поэтому вызовы из
+    asyncio.to_thread идут параллельно и объединяются сервисом в общие пачки
+    """
+    def __init__(self, socket_path: str = EMBEDDING_SERVICE_SOCKET, timeout: float = EMBEDDING_SERVICE_TIMEOUT,
+                 connect_timeout: float = EMBEDDING_SERVICE_CONNECT_TIMEOUT):
+        """
+        Args:
+            socket_path (str): путь к Unix-сокету сервиса
+            timeout (float): таймаут одного запроса, в секундах
+            connect_timeout (float): сколько ждать запуска сервиса (загрузки модели), в секундах
+
+        Returns:
+            None
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        """
+        Подключается к сервису, дожидаясь его запуска
+
+        Returns:
+            socket: соединение
+
+        Raises:
+            EmbeddingServiceError: сервис не запустился за connect_timeout
+        """
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+                return sock
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise EmbeddingServiceError(f"сервис эмбеддингов недоступен: {self.socket_path}") from e
+                time.sleep(0.2)
+
+    def _recv_exactly(self, sock: socket.socket, size: int) -> bytes:
+        """
+        Читает из сокета ровно size байт
+
+        Args:
+            sock (socket): соединение
+            size (int): количество байт
+
+        Returns:
+            bytes: прочитанные данные
+        """
+        chunks = []
+        while size:
+            chunk = sock.recv(min(size, 1 << 20))
+            if not chunk:
+                raise ConnectionError("сервис эмбеддингов закрыл соединение")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def _call(self, payload: dict) -> dict:
+        """
+        Выполняет запрос к сервису. При обрыве соединения (например, после перезапуска
+        сервиса) запрос повторяется один раз на новом соединении
+
+        Args:
+            payload (dict): запрос
+
+        Returns:
+            dict: ответ сервиса
+
+        Raises:
+            EmbeddingServiceError: сервис недоступен или вернул ошибку
+        """
+        frame = _pack(payload)
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            if sock is None:
+                sock = self._local.sock = self._connect()
+            try:
+                sock.sendall(frame)
+                (length,) = HEADER.unpack(self._recv_exactly(sock, HEADER.size))
+                response = json.loads(self._recv_exactly(sock, length))
+                break
+            except OSError as e:
+                sock.close()
+                self._local.sock = None
+                if attempt or isinstance(e, socket.timeout):
+                    raise EmbeddingServiceError(f"ошибка обмена с сервисом эмбеддингов: {e}") from e
+        if not response.get("ok"):
+            raise EmbeddingServiceError(response.get("error", "неизвестная ошибка сервиса эмбеддингов"))
+        return response
+
+    def ping(self):
+        """
+        Дожидается готовности сервиса
+
+        Returns:
+            None
+        """
+        self._call({"op": "ping"})
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: счетчики пачек сервиса
+        """
+        return self._call({"op": "stats"})["stats"]
+
+    def embed_documents(self, texts):
+        """
+        Считает эмбеддинги документов
+
+        Args:
+            texts (list): тексты документов
+
+        Returns:
+            list: эмбеддинги
+        """
+        if not texts:
+            return []
+        return decode_vectors(self._call({"op": "embed", "texts": list(texts)})["vectors"])
+
+    def embed_query(self, text):
+        """
+        Считает эмбеддинг запроса
+
+        Args:
+            text (str): текст запроса
+
+        Returns:
+            list: эмбеддинг
+        """
+        return self.embed_documents([text])[0]
+
+    def search_batch(self, vectors, k: int) -> List[List[Document]]:
+        """
+        Находит ближайшие чанки для нескольких запросов индексом сервиса
+
+        Args:
+            vectors (list): эмбеддинги запросов
+            k (int): количество результатов на запрос
+
+        Returns:
+            List[List[Document]]: найденные чанки для каждого запроса
+        """
+        results = self._call({"op": "search", "vectors": encode_vectors(vectors), "k": k})["results"]
+        return [
+            [Document(page_content=item["text"], metadata=item["metadata"], id=item["id"]) for item in items]
+            for items in results
+        ]
+
+
+class RemoteRetriever:
+    """
+    Поиск чанков через общий сервис эмбеддингов, с тем же интерфейсом, что у
+    ChromaRetriever и NumpyRetriever
+    """
+    def __init__(self, client: EmbeddingServiceClient):
+        """
+        Args:
+            client (EmbeddingServiceClient): клиент сервиса
+
+        Returns:
+            None
+        """
+        self.client = client
+
+    def search_by_vector(self, vector, k: int) -> List[Document]:
+        """
+        Находит k ближайших чанков к эмбеддингу запроса
+
+        Args:
+            vector (list): эмбеддинг запроса
+            k (int): количество результатов
+
+        Returns:
+            List[Document]: найденные чанки по убыванию близости
+        """
+        return self.client.search_batch([vector], k)[0]
+
+    def search_batch(self, vectors, k: int) -> List[List[Document]]:
+        """
+        Находит ближайшие чанки для нескольких запросов
+
+        Args:
+            vectors (list): эмбеддинги запросов
+            k (int): количество результатов на запрос
+
+        Returns:
+            List[List[Document]]: найденные чанки для каждого запроса
+        """
+        return self.client.search_batch(vectors, k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Общий сервис эмбеддингов и поиска для процессов бота")
+    parser.add_argument("--socket", default=EMBEDDING_SERVICE_SOCKET or "/tmp/wine-embeddings.sock",
+                        help="путь к Unix-сокету")
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_SERVICE_MAX_BATCH)
+    parser.add_argument("--max-wait", type=float, default=EMBEDDING_SERVICE_MAX_WAIT,
+                        help="сколько ждать попутные запросы, s")
+    args = parser.parse_args()
+    asyncio.run(EmbeddingService(args.socket, args.max_batch, args.max_wait).serve())
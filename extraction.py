@@ -0,0 +1,246 @@
+import os
+import re
+
+from config import WINES_DIR
+
+LEAD_FIELDS = ("contact_info", "fio", "product")
+
+# Номер из 10-15 цифр с необязательным "+" и разделителями между цифрами: пробел, дефис, скобки, точка
+PHONE_PATTERN = re.compile(r"(?<![\w+])\+?\d(?:[\s\-‐-―().]{0,3}\d){9,14}(?![\w])")
+EMAIL_PATTERN = re.compile(r"(?<![\w.+-])[\w.+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}")
+# Имя пользователя Telegram: 5-32 символа, начинается с буквы; также ссылки t.me/имя
+HANDLE_PATTERN = re.compile(r"(?:(?<![\w.@])@|(?:https?://)?t\.me/)([A-Za-z][A-Za-z0-9_]{4,31})(?![\w@.])")
+NAME_PATTERN = re.compile(
+    r"(?i:меня зовут|мо[её] имя|с уважением,?|контактное лицо:?|я\s*[-—])\s+"
+    r"([А-ЯЁ][а-яё]+(?:[ \t]+[А-ЯЁ][а-яё]+){0,2})")
+# Количество товара: "4 бутылки", "ящик", "2 шт"
+QUANTITY_PATTERN = re.compile(r"(?i)(?<!\w)(?:\d+\s*)?(?:бутыл\w*|ящик\w*|шт)(?!\w)")
+_EMPTY_VALUES = {"", "none", "null", "нет", "-", "не указано", "не указан", "не указаны"}
+
+
+def normalize_phone(raw: str):
+    """
+    Приводит номер телефона к виду +<код страны><номер>. Российские номера в форматах
+    8XXXXXXXXXX, 7XXXXXXXXXX и 9XXXXXXXXX приводятся к +7XXXXXXXXXX
+
+    Args:
+        raw (str): номер в том виде, как он написан в тексте
+
+    Returns:
+        str: нормализованный номер или None, если строка не похожа на номер телефона
+    """
+    digits = re.sub(r"\D", "", raw)
+    if len(digits) == 11 and digits[0] in "78" and not raw.lstrip().startswith("+8"):
+        return "+7" + digits[1:]
+    if len(digits) == 10 and digits[0] == "9":
+        return "+7" + digits
+    if raw.lstrip().startswith("+") and 11 <= len(digits) <= 15:
+        return "+" + digits
+    return None
+
+
+def extract_contacts(text: str) -> dict:
+    """
+    Находит в тексте телефоны, адреса электронной почты и имена пользователей Telegram
+
+    Args:
+        text (str): текст сообщения
+
+    Returns:
+        dict: {"phones": [...], "emails": [...], "handles": [...]} без повторов, в порядке появления
+    """
+    text = text or ""
+    emails = list(dict.fromkeys(match.lower() for match in EMAIL_PATTERN.findall(text)))
+    # Адреса почты вырезаются, чтобы часть адреса после @ не считалась именем пользователя
+    rest = EMAIL_PATTERN.sub(" ", text)
+    phones = list(dict.fromkeys(filter(None, map(normalize_phone, PHONE_PATTERN.findall(rest)))))
+    handles = list(dict.fromkeys(f"@{handle}" for handle in HANDLE_PATTERN.findall(rest)))
+    return {"phones": phones, "emails": emails, "handles": handles}
+
+
+def profile_lead(user) -> dict:
+    """
+    Данные заявки из профиля Telegram: имя и фамилия, а контактом - имя пользователя
+
+    Args:
+        user (User): автор сообщения (message.from_user) или None
+
+    Returns:
+        dict: {"contact_info", "fio", "product"}; ненайденные поля - None
+    """
+    if user is None:
+        return dict.fromkeys(LEAD_FIELDS)
+    fio = " ".join(part.strip() for part in (user.first_name, user.last_name) if part and part.strip())
+    return {
+        "contact_info": f"@{user.username}" if user.username else None,
+        "fio": fio or None,
+        "product": None,
+    }
+
+
+def title_pattern(title: str) -> str:
+    """
+    Регулярное выражение названия с учетом падежных окончаний: у слов длиннее четырех букв
+    последняя гласная отбрасывается и допускается окончание до трех букв ("Мальбек" - "Мальбека",
+    "Риоха" - "Риохи"), слова разделяются пробелами или дефисами
+
+    Args:
+        title (str): название
+
+    Returns:
+        str: выражение без флагов
+    """
+    parts = []
+    for word in re.split(r"[\s\-]+", title.strip()):
+        if len(word) > 4:
+            stem = word[:-1] if word[-1].lower() in "аяоеиыуюьй" else word
+            parts.append(re.escape(stem) + r"\w{0,3}")
+        else:
+            parts.append(re.escape(word))
+    return r"[\s\-]+".join(parts)
+
+
+class ProductCatalog:
+    """
+    Названия вин из базы знаний для определения продукта заявки без модели. Берутся
+    названия статей о сортах (WINES_DIR); регионы не используются: их названия
+    совпадают с адресами доставки ("Нью-Йорк", "Техас")
+    """
+    def __init__(self, titles: list):
+        """
+        Args:
+            titles (list): названия продуктов
+
+        Returns:
+            None
+        """
+        # Длинные названия раньше коротких: "Совиньон блан" не должен найтись как "Совиньон"
+        self.titles = sorted({title.strip() for title in titles if len(title.strip()) > 2}, key=len, reverse=True)
+        self.pattern = None
+        if self.titles:
+            alternatives = "|".join(f"({title_pattern(title)})" for title in self.titles)
+            self.pattern = re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)", re.IGNORECASE)
+
+    @classmethod
+    def from_folder(cls, path: str = WINES_DIR) -> "ProductCatalog":
+        """
+        Args:
+            path (str): папка статей базы знаний (название статьи - имя файла .md)
+
+        Returns:
+            ProductCatalog: каталог; пустой, если папки нет
+        """
+        if not os.path.isdir(path):
+            return cls([])
+        return cls([os.path.splitext(name)[0] for name in os.listdir(path) if name.endswith(".md")])
+
+    def find(self, text: str) -> list:
+        """
+        Args:
+            text (str): текст сообщения
+
+        Returns:
+            list: найденные названия без повторов в порядке появления в тексте
+        """
+        if self.pattern is None:
+            return []
+        return list(dict.fromkeys(self.titles[match.lastindex - 1] for match in self.pattern.finditer(text or "")))
+
+
+_catalog = None
+
+
+def get_catalog() -> ProductCatalog:
+    """
+    Каталог продуктов по статьям WINES_DIR, создается при первом обращении
+
+    Returns:
+        ProductCatalog: каталог
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = ProductCatalog.from_folder()
+    return _catalog
+
+
+def extract_product(text: str, catalog: ProductCatalog = None):
+    """
+    Определяет продукт заявки по названиям вин из базы знаний и количество, если оно указано
+
+    Args:
+        text (str): текст сообщения
+        catalog (ProductCatalog): каталог, по умолчанию get_catalog()
+
+    Returns:
+        str: например "Мерло, 2 бутылки" или None, если вино из базы знаний не названо
+    """
+    titles = (catalog or get_catalog()).find(text)
+    if not titles:
+        return None
+    quantity = QUANTITY_PATTERN.search(text)
+    return ", ".join(titles + ([quantity.group(0)] if quantity else []))
+
+
+def clean_value(value):
+    """
+    Приводит значение поля заявки от модели к строке; "None", "null" и пустые значения - к None
+
+    Args:
+        value: значение из ответа модели
+
+    Returns:
+        str: значение или None
+    """
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        value = ", ".join(str(item) for item in value if clean_value(item))
+    value = str(value).strip()
+    return None if value.lower() in _EMPTY_VALUES else value
+
+
+def extract_lead(text: str) -> dict:
+    """
+    Извлекает данные заявки из текста без модели: контакты (телефоны нормализуются),
+    имя, если автор представился, и продукт, если назван сорт из базы знаний
+
+    Args:
+        text (str): текст сообщения
+
+    Returns:
+        dict: {"contact_info", "fio", "product"}; ненайденные поля - None
+    """
+    contacts = extract_contacts(text)
+    match = NAME_PATTERN.search(text or "")
+    return {
+        "contact_info": ", ".join(contacts["phones"] + contacts["emails"] + contacts["handles"]) or None,
+        "fio": match.group(1) if match else None,
+        "product": extract_product(text),
+    }
+
+
+def merge_lead(primary: dict, secondary: dict) -> dict:
+    """
+    Объединяет данные заявки: значения primary важнее, пустые поля дополняются из secondary
+
+    Args:
+        primary (dict): данные с приоритетом (например, извлеченные локально)
+        secondary (dict): дополнительные данные (например, ответ модели)
+
+    Returns:
+        dict: {"contact_info", "fio", "product"}
+    """
+    return {field: clean_value(primary.get(field)) or clean_value(secondary.get(field)) for field in LEAD_FIELDS}
+
+
+def missing_fields(lead: dict) -> list:
+    """
+    Поля заявки, которые еще не заполнены
+
+    Args:
+        lead (dict): данные заявки
+
+    Returns:
+        list: названия полей в порядке LEAD_FIELDS
+    """
+    return [field for field in LEAD_FIELDS if not clean_value(lead.get(field))]
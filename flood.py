@@ -0,0 +1,301 @@
+import re
+import time
+import hashlib
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from config import (FLOOD_WINDOW, FLOOD_MAX_ENTRIES, FLOOD_MAX_DISTANCE, FLOOD_MIN_LENGTH, FLOOD_USER_RATE,
+                    FLOOD_RATE_WINDOW)
+
+BITS = 64
+SHINGLE = 4
+_SHIFTS = np.arange(BITS, dtype=np.uint64)
+
+# Латинские буквы, которыми спамеры подменяют похожие кириллические
+_HOMOGLYPHS = str.maketrans("aceopxykmhtb", "асеорхукмнтв")
+
+_URL = re.compile(r"https?://\S+|www\.\S+|t\.me/\S+")
+_DIGITS = re.compile(r"\d+")
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Приводит текст к виду, в котором мелкие правки спамеров не различаются:
+    нижний регистр, ё -> е, латинские двойники кириллических букв заменены, ссылки и числа
+    заменены метками, пунктуация и эмодзи убраны
+
+    Args:
+        text (str): исходный текст
+
+    Returns:
+        str: нормализованный текст
+    """
+    text = text.lower().replace("ё", "е")
+    text = _URL.sub(" url ", text)
+    text = _DIGITS.sub("0", text)
+    # Двойники заменяются только в словах, где уже есть кириллица: латинские слова не трогаем
+    text = " ".join(word.translate(_HOMOGLYPHS) if re.search("[а-я]", word) else word for word in text.split())
+    return " ".join(_NON_WORD.sub(" ", text).replace("_", " ").split())
+
+
+def _hash(feature: str) -> int:
+    """
+    Стабильный между процессами 64-битный хэш признака
+
+    Args:
+        feature (str): признак
+
+    Returns:
+        int: хэш
+    """
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(normalized: str) -> int:
+    """
+    SimHash по символьным 4-граммам нормализованного текста: близкие тексты
+    дают отпечатки с малым расстоянием Хэмминга
+
+    Args:
+        normalized (str): нормализованный текст
+
+    Returns:
+        int: 64-битный отпечаток
+    """
+    if len(normalized) <= SHINGLE:
+        features = [normalized]
+    else:
+        features = [normalized[i:i + SHINGLE] for i in range(len(normalized) - SHINGLE + 1)]
+    values = np.fromiter(map(_hash, features), dtype=np.uint64, count=len(features))
+    ones = ((values[:, None] >> _SHIFTS) & np.uint64(1)).sum(axis=0)
+    # Бит отпечатка равен 1, если у большинства признаков этот бит хэша равен 1
+    return int(sum(1 << bit for bit in np.flatnonzero(ones * 2 > len(features))))
+
+
+def band_layout(max_distance: int):
+    """
+    Делит биты отпечатка на max_distance + 1 полос. Если расстояние Хэмминга не больше
+    max_distance, хотя бы одна полоса совпадает целиком, поэтому кандидаты ищутся
+    по словарю полос, а не перебором всех отпечатков
+
+    Args:
+        max_distance (int): максимальное расстояние Хэмминга
+
+    Returns:
+        list: пары (сдвиг, маска) полос
+    """
+    bands = max_distance + 1
+    layout = []
+    start = 0
+    for band in range(bands):
+        width = BITS // bands + (1 if band < BITS % bands else 0)
+        layout.append((start, (1 << width) - 1))
+        start += width
+    return layout
+
+
+class FloodDetector:
+    """
+    Быстрая проверка сообщения перед классификацией. Вердикт "спам" выдается без модели, если
+    сообщение почти повторяет недавний спам (SimHash, расстояние Хэмминга не больше max_distance)
+    или пользователь прислал больше user_rate сообщений за rate_window секунд.
+    Хранилище ограничено по размеру и вытесняет записи старше window секунд
+    """
+    def __init__(self, window: float = FLOOD_WINDOW,
+                 max_entries: int = FLOOD_MAX_ENTRIES,
+                 max_distance: int = FLOOD_MAX_DISTANCE,
+                 min_length: int = FLOOD_MIN_LENGTH,
+                 user_rate: int = FLOOD_USER_RATE,
+                 rate_window: float = FLOOD_RATE_WINDOW):
+        """
+        Args:
+            window (float): сколько помнить отпечатки спама, в секундах
+            max_entries (int): максимальное количество отпечатков и отслеживаемых пользователей
+            max_distance (int): максимальное расстояние Хэмминга между отпечатками почти повторов
+            min_length (int): минимальная длина нормализованного текста для нечеткого сравнения;
+                более короткие тексты сравниваются точно
+            user_rate (int): сколько сообщений пользователя допускается за rate_window
+            rate_window (float): окно подсчета сообщений пользователя, в секундах
+
+        Returns:
+            None
+        """
+        self.window = window
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.user_rate = user_rate
+        self.rate_window = rate_window
+        self.stats = {"checked": 0, "duplicate": 0, "rate": 0}
+        # отпечаток -> (время добавления, вердикт); порядок - от старых к новым
+        self._entries = OrderedDict()
+        # (номер полосы, значение) -> множество отпечатков
+        self._bands = {}
+        # пользователь -> времена последних сообщений; порядок - от давно писавших
+        self._users = OrderedDict()
+        self._layout = band_layout(max_distance)
+
+    def __len__(self):
+        """
+        Returns:
+            int: количество хранимых отпечатков
+        """
+        return len(self._entries)
+
+    def _evict(self, now: float):
+        """
+        Удаляет отпечатки старше окна и лишние сверх max_entries
+
+        Args:
+            now (float): текущее время
+
+        Returns:
+            None
+        """
+        while self._entries:
+            fingerprint, (added, _) = next(iter(self._entries.items()))
+            if now - added <= self.window and len(self._entries) <= self.max_entries:
+                break
+            self._remove(fingerprint)
+
+    def _remove(self, fingerprint: int):
+        """
+        Удаляет отпечаток из хранилища и словаря полос
+
+        Args:
+            fingerprint (int): отпечаток
+
+        Returns:
+            None
+        """
+        del self._entries[fingerprint]
+        for key in self._band_keys(fingerprint):
+            bucket = self._bands.get(key)
+            if bucket is not None:
+                bucket.discard(fingerprint)
+                if not bucket:
+                    del self._bands[key]
+
+    def _band_keys(self, fingerprint: int):
+        """
+        Ключи полос отпечатка для словаря кандидатов
+
+        Args:
+            fingerprint (int): отпечаток
+
+        Returns:
+            list: пары (номер полосы, значение полосы)
+        """
+        return [(band, fingerprint >> shift & mask) for band, (shift, mask) in enumerate(self._layout)]
+
+    def _fingerprint(self, text: str):
+        """
+        Считает отпечаток текста
+
+        Args:
+            text (str): текст сообщения
+
+        Returns:
+            tuple: (отпечаток, допустимое расстояние) или (None, 0) для пустого текста
+        """
+        normalized = normalize_text(text or "")
+        if not normalized:
+            return None, 0
+        distance = self.max_distance if len(normalized) >= self.min_length else 0
+        return simhash(normalized), distance
+
+    def _find(self, fingerprint: int, distance: int):
+        """
+        Ищет сохраненный отпечаток не дальше distance
+
+        Args:
+            fingerprint (int): отпечаток
+            distance (int): допустимое расстояние Хэмминга
+
+        Returns:
+            str: вердикт найденного отпечатка или None
+        """
+        if distance == 0:
+            entry = self._entries.get(fingerprint)
+            return entry[1] if entry else None
+        seen = set()
+        for key in self._band_keys(fingerprint):
+            for candidate in self._bands.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if bin(candidate ^ fingerprint).count("1") <= distance:
+                    return self._entries[candidate][1]
+        return None
+
+    def _over_rate(self, user_id, now: float) -> bool:
+        """
+        Учитывает сообщение пользователя и проверяет, не превышена ли частота
+
+        Args:
+            user_id (int): идентификатор пользователя
+            now (float): текущее время
+
+        Returns:
+            bool: True, если сообщений за окно больше user_rate
+        """
+        times = self._users.pop(user_id, None) or deque()
+        times.append(now)
+        while times and now - times[0] > self.rate_window:
+            times.popleft()
+        self._users[user_id] = times
+        while len(self._users) > self.max_entries:
+            self._users.popitem(last=False)
+        return len(times) > self.user_rate
+
+    def check(self, text: str, user_id=None, now: float = None):
+        """
+        Проверяет сообщение до классификации
+
+        Args:
+            text (str): текст сообщения
+            user_id (int): идентификатор пользователя или None, если частота не учитывается
+            now (float): текущее время (для проверок), по умолчанию time.monotonic()
+
+        Returns:
+            tuple: (вердикт, причина) - ("спам", "duplicate" | "rate") или (None, None)
+        """
+        now = time.monotonic() if now is None else now
+        self.stats["checked"] += 1
+        self._evict(now)
+        if user_id is not None and self.user_rate and self._over_rate(user_id, now):
+            self.stats["rate"] += 1
+            return "спам", "rate"
+        fingerprint, distance = self._fingerprint(text)
+        if fingerprint is None:
+            return None, None
+        verdict = self._find(fingerprint, distance)
+        if verdict is not None:
+            self.stats["duplicate"] += 1
+            return verdict, "duplicate"
+        return None, None
+
+    def remember(self, text: str, verdict: str = "спам", now: float = None):
+        """
+        Запоминает отпечаток классифицированного сообщения
+
+        Args:
+            text (str): текст сообщения
+            verdict (str): вердикт классификации
+            now (float): текущее время (для проверок), по умолчанию time.monotonic()
+
+        Returns:
+            None
+        """
+        now = time.monotonic() if now is None else now
+        fingerprint, _ = self._fingerprint(text)
+        if fingerprint is None:
+            return
+        if fingerprint in self._entries:
+            self._remove(fingerprint)
+        self._entries[fingerprint] = (now, verdict)
+        for key in self._band_keys(fingerprint):
+            self._bands.setdefault(key, set()).add(fingerprint)
+        self._evict(now)
@@ -0,0 +1,328 @@
+import os
+import re
+import json
+import math
+from collections import Counter, defaultdict
+from typing import List
+
+from langchain_core.documents import Document
+
+from config import BM25_K1, BM25_B, RRF_K
+
+try:
+    import pymorphy3
+    _morph = pymorphy3.MorphAnalyzer()
+    NORMALIZER = "pymorphy3"
+except ImportError:
+    _morph = None
+    NORMALIZER = "suffix"
+
+TOKEN_PATTERN = re.compile(r"[0-9a-zà-ÿа-яё]+")
+CYRILLIC_PATTERN = re.compile(r"[а-я]")
+# Латинское название сразу после заголовка: "Альбариньо (исп. *Albariño*)", "Бордо (фр. Bordeaux)"
+LATIN_ALIAS_PATTERN = r"{title}\s*\((?:[а-яё]+\.\s*)?\*?([A-Za-zÀ-ÿ' \-]{{3,}})\*?[,)]"
+RUSSIAN_ENDINGS = sorted([
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией", "иях", "ах", "ях", "ов", "ев",
+    "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ую", "юю", "ом", "ем", "ам", "ям", "ию", "ия", "ие",
+    "ы", "и", "а", "я", "о", "е", "у", "ю", "ь",
+], key=len, reverse=True)
+
+
+def normalize_token(token: str) -> str:
+    """
+    Приводит слово к нормальной форме: лемма pymorphy3, если библиотека установлена,
+    иначе отсечение типичного русского окончания. Латиница не изменяется
+
+    Args:
+        token (str): слово в нижнем регистре
+
+    Returns:
+        str: нормализованное слово
+    """
+    if not CYRILLIC_PATTERN.search(token):
+        return token
+    if _morph is not None:
+        return _morph.parse(token)[0].normal_form.replace("ё", "е")
+    for ending in RUSSIAN_ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= 3:
+            return token[:-len(ending)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Разбивает текст на нормализованные слова
+
+    Args:
+        text (str): исходный текст
+
+    Returns:
+        List[str]: нормализованные слова
+    """
+    return [normalize_token(token) for token in TOKEN_PATTERN.findall(text.lower().replace("ё", "е"))]
+
+
+def extract_aliases(title: str, text: str) -> List[str]:
+    """
+    Собирает названия, по которым пользователь может сослаться на статью:
+    заголовок файла и латинское название из первого абзаца
+
+    Args:
+        title (str): заголовок (имя файла)
+        text (str): текст первого чанка статьи
+
+    Returns:
+        List[str]: названия
+    """
+    aliases = [title.strip()]
+    match = re.search(LATIN_ALIAS_PATTERN.format(title=re.escape(title.strip())), text, re.IGNORECASE)
+    if match:
+        aliases.append(match.group(1).strip())
+    return aliases
+
+
+class LexicalIndex:
+    """
+    Инвертированный индекс по нормализованным словам чанков и названиям статей.
+    Прямое упоминание сорта или региона из заголовка возвращает чанки этой статьи,
+    иначе оценки BM25 объединяются с результатами векторного поиска (RRF)
+    """
+    def __init__(self, chunks: list, aliases: dict, version: str = None):
+        """
+        Args:
+            chunks (list): записи {"id", "text", "metadata", "tokens"}
+            aliases (dict): нормализованное название -> источник (путь к файлу статьи)
+            version (str): версия базы знаний, из которой построен индекс
+
+        Returns:
+            None
+        """
+        self.chunks = chunks
+        self.aliases = aliases
+        self.version = version
+        self.max_alias_length = max((len(alias.split()) for alias in aliases), default=0)
+        self.by_source = self._group_by_source(chunks)
+        self.postings = defaultdict(list)
+        total_length = 0
+        for position, chunk in enumerate(chunks):
+            for term, count in Counter(chunk["tokens"]).items():
+                self.postings[term].append((position, count))
+            total_length += len(chunk["tokens"])
+        self.avg_length = total_length / len(chunks) if chunks else 0.0
+
+    @classmethod
+    def build(cls, path: str, ids, texts, metadatas, version: str = None):
+        """
+        Строит индекс по чанкам и сохраняет его в JSON
+
+        Args:
+            path (str): путь к файлу индекса
+            ids (list): идентификаторы чанков
+            texts (list): тексты чанков
+            metadatas (list): метаданные чанков (source, title, start_index)
+            version (str): версия базы знаний
+
+        Returns:
+            LexicalIndex: построенный индекс
+        """
+        chunks = [
+            {"id": chunk_id, "text": text, "metadata": metadata or {}, "tokens": tokenize(text)}
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        raw_aliases = {}
+        for source, positions in cls._group_by_source(chunks).items():
+            first = sorted((chunks[position] for position in positions),
+                           key=lambda chunk: chunk["metadata"].get("start_index", 0))
+            opening = " ".join(chunk["text"] for chunk in first[:3])
+            for alias in extract_aliases(first[0]["metadata"].get("title", ""), opening):
+                raw_aliases[alias] = source
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump({"version": version, "normalizer": NORMALIZER, "chunks": chunks, "aliases": raw_aliases},
+                      file, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+        return cls(chunks, cls._normalize_aliases(raw_aliases), version)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Загружает индекс. Если индекс строился другим нормализатором слов,
+        токены пересчитываются из сохраненных текстов
+
+        Args:
+            path (str): путь к файлу индекса
+
+        Returns:
+            LexicalIndex: загруженный индекс
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        if data.get("normalizer") != NORMALIZER:
+            for chunk in data["chunks"]:
+                chunk["tokens"] = tokenize(chunk["text"])
+        return cls(data["chunks"], cls._normalize_aliases(data["aliases"]), data.get("version"))
+
+    @staticmethod
+    def _group_by_source(chunks: list) -> dict:
+        """
+        Группирует номера чанков по статьям
+
+        Args:
+            chunks (list): записи чанков
+
+        Returns:
+            dict: источник -> список номеров чанков
+        """
+        groups = defaultdict(list)
+        for position, chunk in enumerate(chunks):
+            groups[chunk["metadata"].get("source")].append(position)
+        return groups
+
+    @staticmethod
+    def _normalize_aliases(raw_aliases: dict) -> dict:
+        """
+        Нормализует названия статей для поиска по словам вопроса
+
+        Args:
+            raw_aliases (dict): название -> источник
+
+        Returns:
+            dict: нормализованное название -> источник
+        """
+        aliases = {}
+        for alias, source in raw_aliases.items():
+            tokens = tokenize(alias)
+            # Однословные короткие названия ("Ар") дают слишком много ложных совпадений
+            if tokens and (len(tokens) > 1 or len(tokens[0]) >= 3):
+                aliases[" ".join(tokens)] = source
+        return aliases
+
+    @staticmethod
+    def read_version(path: str):
+        """
+        Возвращает версию базы знаний, из которой построен индекс
+
+        Args:
+            path (str): путь к файлу индекса
+
+        Returns:
+            str: версия или None, если индекса нет
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file).get("version")
+        except (OSError, ValueError):
+            return None
+
+    def _to_document(self, position: int) -> Document:
+        """
+        Преобразует чанк индекса в документ
+
+        Args:
+            position (int): номер чанка
+
+        Returns:
+            Document: чанк с метаданными
+        """
+        chunk = self.chunks[position]
+        return Document(page_content=chunk["text"], metadata=dict(chunk["metadata"]), id=chunk["id"])
+
+    def match_entities(self, tokens: List[str]) -> List[str]:
+        """
+        Находит в вопросе названия статей. Более длинные названия имеют приоритет,
+        пересекающиеся с ними короткие не учитываются
+
+        Args:
+            tokens (List[str]): нормализованные слова вопроса
+
+        Returns:
+            List[str]: источники найденных статей в порядке упоминания
+        """
+        sources = []
+        position = 0
+        while position < len(tokens):
+            for length in range(min(self.max_alias_length, len(tokens) - position), 0, -1):
+                source = self.aliases.get(" ".join(tokens[position:position + length]))
+                if source is not None:
+                    if source not in sources:
+                        sources.append(source)
+                    position += length
+                    break
+            else:
+                position += 1
+        return sources
+
+    def bm25(self, tokens: List[str]) -> dict:
+        """
+        Считает оценки BM25 чанков для вопроса
+
+        Args:
+            tokens (List[str]): нормализованные слова вопроса
+
+        Returns:
+            dict: номер чанка -> оценка
+        """
+        scores = defaultdict(float)
+        total = len(self.chunks)
+        for term in set(tokens):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, count in postings:
+                length = len(self.chunks[position]["tokens"])
+                norm = count + BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length)
+                scores[position] += idf * count * (BM25_K1 + 1) / norm
+        return scores
+
+    def direct_hits(self, question: str, k: int) -> List[Document]:
+        """
+        Возвращает чанки статей, прямо названных в вопросе. Внутри статьи чанки
+        упорядочены по BM25, при нескольких статьях результаты чередуются
+
+        Args:
+            question (str): вопрос пользователя
+            k (int): количество результатов
+
+        Returns:
+            List[Document]: найденные чанки или пустой список, если названий в вопросе нет
+        """
+        tokens = tokenize(question)
+        sources = self.match_entities(tokens)
+        if not sources:
+            return []
+        scores = self.bm25(tokens)
+        per_source = [
+            sorted(self.by_source[source], key=lambda position: (-scores.get(position, 0.0), position))
+            for source in sources
+        ]
+        positions = []
+        for rank in range(max(len(items) for items in per_source)):
+            positions.extend(items[rank] for items in per_source if rank < len(items))
+        return [self._to_document(position) for position in positions[:k]]
+
+    def hybrid(self, question: str, dense_docs: List[Document], k: int) -> List[Document]:
+        """
+        Объединяет результаты BM25 и векторного поиска методом reciprocal rank fusion
+
+        Args:
+            question (str): вопрос пользователя
+            dense_docs (List[Document]): результаты векторного поиска по убыванию близости
+            k (int): количество результатов
+
+        Returns:
+            List[Document]: объединенные результаты
+        """
+        scores = self.bm25(tokenize(question))
+        lexical = sorted(scores, key=lambda position: -scores[position])[:max(k * 4, 10)]
+
+        fused = defaultdict(float)
+        documents = {}
+        candidates = [(rank, doc) for rank, doc in enumerate(dense_docs)]
+        candidates += [(rank, self._to_document(position)) for rank, position in enumerate(lexical)]
+        for rank, doc in candidates:
+            key = (doc.metadata.get("source"), doc.metadata.get("start_index"))
+            fused[key] += 1 / (RRF_K + rank + 1)
+            documents.setdefault(key, doc)
+        return [documents[key] for key in sorted(fused, key=lambda key: -fused[key])[:k]]
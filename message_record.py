@@ -0,0 +1,99 @@
+import datetime
+
+
+class RecordUser:
+    """
+    Автор сообщения: поля types.User, которые читают агент и база данных
+    """
+    __slots__ = ("id", "username", "first_name", "last_name")
+
+    def __init__(self, id: int, username: str = None, first_name: str = None, last_name: str = None):
+        """
+        Args:
+            id (int): идентификатор пользователя
+            username (str): имя пользователя Telegram без @
+            first_name (str): имя
+            last_name (str): фамилия
+
+        Returns:
+            None
+        """
+        self.id = id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+
+
+class RecordChat:
+    """
+    Чат сообщения: поля types.Chat, которые читают агент и база данных
+    """
+    __slots__ = ("id",)
+
+    def __init__(self, id: int):
+        """
+        Args:
+            id (int): идентификатор чата
+
+        Returns:
+            None
+        """
+        self.id = id
+
+
+class MessageRecord:
+    """
+    Легкая замена types.Message для обработки сообщений без Telegram (пакетный режим,
+    импорт заявок из других каналов). Повторяет атрибуты, которые используют граф агента
+    и UserMessagesDB: message_id, chat.id, from_user, date, text
+    """
+    __slots__ = ("message_id", "chat", "from_user", "date", "text")
+
+    def __init__(self, message_id: int, chat: RecordChat, from_user: RecordUser, text: str,
+                 date: datetime.datetime = None):
+        """
+        Args:
+            message_id (int): идентификатор сообщения
+            chat (RecordChat): чат
+            from_user (RecordUser): автор или None
+            text (str): текст сообщения
+            date (datetime): время отправки, по умолчанию текущее
+
+        Returns:
+            None
+        """
+        self.message_id = message_id
+        self.chat = chat
+        self.from_user = from_user
+        self.text = text
+        self.date = date or datetime.datetime.now(datetime.timezone.utc)
+
+    @classmethod
+    def from_dict(cls, data: dict, default_id: int = 0) -> "MessageRecord":
+        """
+        Создает запись из словаря (строки JSONL). Обязательно только поле text;
+        chat_id по умолчанию равен user_id, date - число секунд Unix или строка ISO 8601
+
+        Args:
+            data (dict): поля text, user_id, chat_id, message_id, username, first_name, last_name, date
+            default_id (int): message_id и user_id, если их нет в записи
+
+        Returns:
+            MessageRecord: запись сообщения
+
+        Raises:
+            ValueError: запись не объект JSON, в записи нет текста или дата в неизвестном формате
+        """
+        if not isinstance(data, dict):
+            raise ValueError(f"запись должна быть объектом JSON, а не {type(data).__name__}")
+        text = data.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError("в записи нет текста сообщения")
+        user_id = data.get("user_id", default_id)
+        date = data.get("date")
+        if isinstance(date, (int, float)):
+            date = datetime.datetime.fromtimestamp(date, datetime.timezone.utc)
+        elif isinstance(date, str):
+            date = datetime.datetime.fromisoformat(date)
+        user = RecordUser(user_id, data.get("username"), data.get("first_name"), data.get("last_name"))
+        return cls(data.get("message_id", default_id), RecordChat(data.get("chat_id", user_id)), user, text, date)
@@ -0,0 +1,434 @@
+import sys
+import json
+import time
+import uuid
+import bisect
+import functools
+import threading
+import contextvars
+from collections import defaultdict
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, STRUCTURED_LOGS
+
+# Идентификатор трассировки текущего сообщения; наследуется задачами asyncio и asyncio.to_thread
+trace_id_var = contextvars.ContextVar("trace_id", default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def _escape(value) -> str:
+    """
+    Экранирует значение метки для формата Prometheus
+
+    Args:
+        value: значение метки
+
+    Returns:
+        str: экранированная строка
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    """
+    Форматирует метки в синтаксисе Prometheus
+
+    Args:
+        names (tuple): имена меток
+        values (tuple): значения меток
+
+    Returns:
+        str: строка вида {name="value",...} или пустая строка
+    """
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    """
+    Монотонно растущий счетчик с метками
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        """
+        Args:
+            name (str): имя метрики
+            help_text (str): описание для # HELP
+            labels (tuple): имена меток
+
+        Returns:
+            None
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        """
+        Увеличивает счетчик
+
+        Args:
+            label_values: значения меток в порядке self.labels
+            amount (float): прирост
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._values[label_values] += amount
+
+    def samples(self):
+        """
+        Текущие значения метрики
+
+        Returns:
+            list: строки выборки в текстовом формате Prometheus
+        """
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    """
+    Значение, которое может как расти, так и уменьшаться
+    """
+    kind = "gauge"
+
+    def set(self, *label_values, value: float):
+        """
+        Устанавливает значение
+
+        Args:
+            label_values: значения меток в порядке self.labels
+            value (float): новое значение
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram:
+    """
+    Гистограмма длительностей или размеров с накопительными корзинами
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Args:
+            name (str): имя метрики
+            help_text (str): описание для # HELP
+            labels (tuple): имена меток
+            buckets (tuple): верхние границы корзин по возрастанию
+
+        Returns:
+            None
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values, value: float):
+        """
+        Добавляет наблюдение
+
+        Args:
+            label_values: значения меток в порядке self.labels
+            value (float): наблюдаемое значение
+
+        Returns:
+            None
+        """
+        with self._lock:
+            counts, total = self._series.get(label_values, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[label_values] = (counts, total + value)
+
+    def samples(self):
+        """
+        Текущие значения метрики
+
+        Returns:
+            list: строки выборки в текстовом формате Prometheus
+        """
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Набор метрик процесса и функций, обновляющих датчики перед экспортом
+    """
+    def __init__(self):
+        """
+        Создает пустой реестр
+
+        Returns:
+            None
+        """
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        """
+        Добавляет метрику в реестр
+
+        Args:
+            metric (Counter | Gauge | Histogram): метрика
+
+        Returns:
+            Counter | Gauge | Histogram: та же метрика
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        Добавляет функцию, которая вызывается перед каждым экспортом
+        (например, переносит показатели планировщика в датчики)
+
+        Args:
+            collector (Callable): функция без аргументов
+
+        Returns:
+            None
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Формирует текст в формате экспозиции Prometheus
+
+        Returns:
+            str: все метрики реестра
+        """
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"[metrics] Ошибка сборщика метрик: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+NODE_SECONDS = registry.register(Histogram(
+    "agent_node_seconds", "Длительность узла графа агента", ("node", "outcome")))
+MESSAGES_TOTAL = registry.register(Counter(
+    "agent_messages_total", "Обработанные сообщения по итоговому статусу", ("status",)))
+LLM_REQUEST_SECONDS = registry.register(Histogram(
+    "llm_request_seconds", "Длительность вызова модели вместе с повторами", ("task", "outcome")))
+LLM_ATTEMPTS_TOTAL = registry.register(Counter(
+    "llm_attempts_total", "HTTP-попытки к модели по результату", ("model", "outcome")))
+LLM_TOKENS_TOTAL = registry.register(Counter(
+    "llm_tokens_total", "Токены по данным usage OpenRouter", ("model", "task", "type")))
+LLM_HEDGES_TOTAL = registry.register(Counter(
+    "llm_hedges_total", "Дублирующие запросы и их исход", ("model", "outcome")))
+LLM_DOWNGRADES_TOTAL = registry.register(Counter(
+    "llm_downgrades_total", "Переходы задачи на следующую модель из-за бюджета задержки", ("task", "model")))
+LLM_LIMITER_STATE = registry.register(Gauge(
+    "llm_limiter_state", "Показатели общего ограничителя запросов к модели", ("api_url", "metric")))
+RAG_STAGE_SECONDS = registry.register(Histogram(
+    "rag_stage_seconds", "Длительность этапов RAG", ("stage",)))
+RAG_PROMPT_TOKENS = registry.register(Histogram(
+    "rag_prompt_tokens", "Оценка размера промпта RAG в токенах", (), TOKEN_BUCKETS))
+ANSWER_CACHE_TOTAL = registry.register(Counter(
+    "rag_answer_cache_total", "Обращения к кэшу ответов", ("result",)))
+FLOOD_TOTAL = registry.register(Counter(
+    "agent_flood_total", "Сообщения, отсеянные как флуд без классификации", ("reason",)))
+EXTRACTION_TOTAL = registry.register(Counter(
+    "agent_extraction_total", "Заявки по способу извлечения данных: без модели или с запросом недостающих полей",
+    ("source",)))
+DB_FLUSH_SECONDS = registry.register(Histogram(
+    "db_flush_seconds", "Длительность пакетной записи заявок", ("outcome",)))
+DB_ROWS_TOTAL = registry.register(Counter(
+    "db_rows_total", "Записанные строки заявок", ()))
+SCHEDULER_STATE = registry.register(Gauge(
+    "scheduler_state", "Показатели планировщика сообщений", ("metric",)))
+
+
+def new_trace_id() -> str:
+    """
+    Создает идентификатор трассировки и делает его текущим
+
+    Returns:
+        str: идентификатор
+    """
+    trace_id = uuid.uuid4().hex[:16]
+    trace_id_var.set(trace_id)
+    return trace_id
+
+
+def log_event(event: str, **fields):
+    """
+    Пишет структурированную запись журнала (одна строка JSON) с текущим trace_id
+
+    Args:
+        event (str): название события
+        fields: поля записи
+
+    Returns:
+        None
+    """
+    if not STRUCTURED_LOGS:
+        return
+    record = {"ts": round(time.time(), 3), "event": event, "trace_id": trace_id_var.get(), **fields}
+    print(json.dumps(record, ensure_ascii=False, default=str), file=sys.stderr)
+
+
+def instrument_node(name: str, node):
+    """
+    Оборачивает узел графа: замеряет длительность, считает ошибки и пишет событие в журнал.
+    Сигнатура узла сохраняется, поэтому LangGraph по-прежнему передает в него writer
+
+    Args:
+        name (str): название узла
+        node (Callable): корутина узла
+
+    Returns:
+        Callable: обернутая корутина
+    """
+    @functools.wraps(node)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await node(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            NODE_SECONDS.observe(name, outcome, value=seconds)
+            log_event("node", node=name, outcome=outcome, seconds=round(seconds, 4))
+    return wrapper
+
+
+def record_usage(model: str, task: str, usage: dict):
+    """
+    Учитывает блок usage ответа OpenRouter
+
+    Args:
+        model (str): модель
+        task (str): тип запроса (classify, ask, ...)
+        usage (dict): {"prompt_tokens", "completion_tokens", ...} или None
+
+    Returns:
+        None
+    """
+    if not usage:
+        return
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    LLM_TOKENS_TOTAL.inc(model, task, "prompt", amount=prompt_tokens)
+    LLM_TOKENS_TOTAL.inc(model, task, "completion", amount=completion_tokens)
+    log_event("llm_usage", model=model, task=task, prompt_tokens=prompt_tokens,
+              completion_tokens=completion_tokens)
+
+
+class timed:
+    """
+    Контекстный менеджер, записывающий длительность блока в гистограмму
+    """
+    def __init__(self, histogram: Histogram, *label_values):
+        """
+        Args:
+            histogram (Histogram): гистограмма
+            label_values: значения меток
+
+        Returns:
+            None
+        """
+        self.histogram = histogram
+        self.label_values = label_values
+        self.seconds = 0.0
+
+    def __enter__(self):
+        """
+        Returns:
+            timed: сам менеджер, после выхода из блока в нем доступно поле seconds
+        """
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        """
+        Записывает длительность блока; исключения не подавляются
+
+        Returns:
+            bool: False
+        """
+        self.seconds = time.perf_counter() - self._started
+        self.histogram.observe(*self.label_values, value=self.seconds)
+        return False
+
+
+_runner = None
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """
+    Запускает HTTP-эндпоинт /metrics в текущем цикле событий
+
+    Args:
+        host (str): адрес
+        port (int): порт
+
+    Returns:
+        None
+    """
+    global _runner
+    if not METRICS_ENABLED or _runner is not None:
+        return
+    from aiohttp import web
+
+    async def handle(request):
+        # Сборщики читают состояние планировщика, поэтому экспорт выполняется в цикле событий
+        text = registry.render()
+        return web.Response(text=text, content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    print(f"[metrics] Метрики доступны на http://{host}:{port}/metrics")
+
+
+async def stop_metrics_server():
+    """
+    Останавливает эндпоинт метрик
+
+    Returns:
+        None
+    """
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,121 @@
+import os
+import json
+from typing import List
+
+from langchain_core.documents import Document
+
+
+class ParentStore:
+    """
+    Хранилище родительских фрагментов статей: в векторном индексе лежат небольшие
+    чанки-потомки, а в промпт передаются фрагменты раздела, к которым они относятся
+    (метаданные parent_id потомков)
+    """
+    def __init__(self, parents: dict, version: str = None):
+        """
+        Args:
+            parents (dict): идентификатор -> {"text", "metadata"}
+            version (str): версия базы знаний
+
+        Returns:
+            None
+        """
+        self.parents = parents
+        self.version = version
+
+    def __len__(self):
+        """
+        Returns:
+            int: количество фрагментов
+        """
+        return len(self.parents)
+
+    @classmethod
+    def build(cls, path: str, parents: dict, version: str = None):
+        """
+        Сохраняет хранилище в JSON атомарно (через временный файл)
+
+        Args:
+            path (str): путь к файлу хранилища
+            parents (dict): идентификатор -> {"text", "metadata"}
+            version (str): версия базы знаний
+
+        Returns:
+            ParentStore: хранилище
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"version": version, "parents": parents}, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return cls(parents, version)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Загружает хранилище
+
+        Args:
+            path (str): путь к файлу хранилища
+
+        Returns:
+            ParentStore: хранилище
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return cls(data["parents"], data.get("version"))
+
+    @staticmethod
+    def read_version(path: str):
+        """
+        Возвращает версию базы знаний, из которой построено хранилище
+
+        Args:
+            path (str): путь к файлу хранилища
+
+        Returns:
+            str: версия или None, если хранилища нет
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file).get("version")
+        except (OSError, ValueError):
+            return None
+
+    def get(self, parent_id: str):
+        """
+        Args:
+            parent_id (str): идентификатор фрагмента
+
+        Returns:
+            Document: фрагмент или None, если его нет в хранилище
+        """
+        record = self.parents.get(parent_id)
+        if record is None:
+            return None
+        return Document(page_content=record["text"], metadata=dict(record["metadata"]), id=parent_id)
+
+    def expand(self, docs: List[Document]) -> List[Document]:
+        """
+        Заменяет найденные чанки их родительскими фрагментами без повторов, в порядке
+        лучшего найденного чанка фрагмента. Чанки без parent_id (индекс построен
+        без родительских фрагментов) и с неизвестным parent_id остаются как есть
+
+        Args:
+            docs (List[Document]): найденные чанки по убыванию релевантности
+
+        Returns:
+            List[Document]: фрагменты для контекста
+        """
+        expanded = []
+        seen = set()
+        for doc in docs:
+            parent_id = doc.metadata.get("parent_id")
+            parent = self.get(parent_id) if parent_id else None
+            if parent is None:
+                expanded.append(doc)
+                continue
+            if parent_id not in seen:
+                seen.add(parent_id)
+                expanded.append(parent)
+        return expanded
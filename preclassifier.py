@@ -0,0 +1,144 @@
+import json
+import threading
+
+import numpy as np
+
+from config import CLASSIFIER_TRAIN_PATH, CLASSIFIER_MIN_SIMILARITY, CLASSIFIER_MIN_MARGIN
+
+LABELS = ("спам", "заявка", "вопрос")
+
+
+def load_examples(path: str):
+    """
+    Загружает размеченные сообщения из JSONL-файла
+
+    Args:
+        path (str): путь к файлу со строками {"text": ..., "label": ...}
+
+    Returns:
+        list: список пар (текст, метка)
+    """
+    examples = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                row = json.loads(line)
+                examples.append((row["text"], row["label"]))
+    return examples
+
+
+class CentroidClassifier:
+    """
+    Локальный классификатор сообщений по центроидам эмбеддингов размеченных примеров.
+    Уверенные предсказания принимаются без запроса к модели, остальные
+    отдаются на классификацию LLM
+    """
+    def __init__(self, embeddings,
+                 train_path: str = CLASSIFIER_TRAIN_PATH,
+                 min_similarity: float = CLASSIFIER_MIN_SIMILARITY,
+                 min_margin: float = CLASSIFIER_MIN_MARGIN):
+        """
+        Args:
+            embeddings (Embeddings): модель эмбеддингов (та же, что используется в RAG)
+            train_path (str): путь к обучающей выборке
+            min_similarity (float): минимальная косинусная близость к центроиду метки
+            min_margin (float): минимальный отрыв лучшей метки от второй
+
+        Returns:
+            None
+        """
+        self.embeddings = embeddings
+        self.train_path = train_path
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        """
+        Нормализует строки матрицы
+
+        Args:
+            matrix (ndarray): матрица эмбеддингов
+
+        Returns:
+            ndarray: матрица со строками единичной нормы
+        """
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def fit(self, examples=None):
+        """
+        Считает центроиды меток. Без аргументов использует обучающую выборку из train_path
+
+        Args:
+            examples (list): список пар (текст, метка)
+
+        Returns:
+            None
+        """
+        if examples is None:
+            examples = load_examples(self.train_path)
+        texts = [text for text, _ in examples]
+        vectors = self._normalize(np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32))
+        centroids = []
+        for label in LABELS:
+            rows = [vector for vector, (_, example_label) in zip(vectors, examples) if example_label == label]
+            centroids.append(np.mean(rows, axis=0))
+        self._centroids = self._normalize(np.stack(centroids))
+
+    def _ensure_fitted(self):
+        """
+        Обучает классификатор при первом обращении
+
+        Returns:
+            None
+        """
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    self.fit()
+
+    def predict(self, text: str):
+        """
+        Предсказывает метку сообщения
+
+        Args:
+            text (str): текст сообщения
+
+        Returns:
+            tuple: (метка, близость к ее центроиду, отрыв от второй метки)
+        """
+        self._ensure_fitted()
+        vector = self._normalize(np.asarray(self.embeddings.embed_query(text), dtype=np.float32))
+        similarities = self._centroids @ vector
+        order = np.argsort(similarities)[::-1]
+        best, second = similarities[order[0]], similarities[order[1]]
+        return LABELS[order[0]], float(best), float(best - second)
+
+    def is_confident(self, similarity: float, margin: float) -> bool:
+        """
+        Проверяет, достаточно ли уверено предсказание, чтобы не спрашивать LLM
+
+        Args:
+            similarity (float): близость к центроиду лучшей метки
+            margin (float): отрыв от второй метки
+
+        Returns:
+            bool: True, если предсказание принимается локально
+        """
+        return similarity >= self.min_similarity and margin >= self.min_margin
+
+    def classify(self, text: str):
+        """
+        Классифицирует сообщение, если предсказание уверенное
+
+        Args:
+            text (str): текст сообщения
+
+        Returns:
+            str: метка или None, если решение нужно отдать LLM
+        """
+        label, similarity, margin = self.predict(text)
+        return label if self.is_confident(similarity, margin) else None
@@ -0,0 +1,619 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+from config import (LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN,
+                    LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES, LLM_ROUTES, LLM_DOWNGRADE_PERCENTILE,
+                    LLM_DOWNGRADE_MIN_SAMPLES, LLM_DOWNGRADE_COOLDOWN, LLM_RATE_INITIAL, LLM_RATE_BURST,
+                    LLM_RATE_MIN, LLM_RATE_MAX, LLM_RATE_STEP, LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MIN,
+                    LLM_CONCURRENCY_MAX, LLM_AIMD_DECREASE)
+from scheduler import PrioritySemaphore, PRIORITY_DEFAULT
+
+
+class LLMError(Exception):
+    """
+    Базовая ошибка обращения к модели. retryable - имеет ли смысл повторить запрос
+    к той же модели, model - модель, на которой произошла ошибка
+    """
+    retryable = False
+
+    def __init__(self, message: str, model: str = None):
+        """
+        Args:
+            message (str): описание ошибки
+            model (str): модель, на которой произошла ошибка
+
+        Returns:
+            None
+        """
+        super().__init__(message)
+        self.model = model
+
+
+class LLMTimeoutError(LLMError):
+    """
+    Истек таймаут попытки или общий срок ответа
+    """
+    retryable = True
+
+
+class LLMConnectionError(LLMError):
+    """
+    Сетевая ошибка: соединение сброшено, сервис недоступен
+    """
+    retryable = True
+
+
+class LLMRateLimitError(LLMError):
+    """
+    Сервис ответил 429; retry_after - рекомендованная пауза в секундах, если была указана
+    """
+    retryable = True
+
+    def __init__(self, message: str, model: str = None, retry_after: float = None):
+        """
+        Args:
+            message (str): описание ошибки
+            model (str): модель, на которой произошла ошибка
+            retry_after (float): значение заголовка Retry-After в секундах
+
+        Returns:
+            None
+        """
+        super().__init__(message, model)
+        self.retry_after = retry_after
+
+
+class LLMServerError(LLMError):
+    """
+    Ошибка на стороне сервиса (5xx)
+    """
+    retryable = True
+
+    def __init__(self, message: str, model: str = None, status: int = None):
+        """
+        Args:
+            message (str): описание ошибки
+            model (str): модель, на которой произошла ошибка
+            status (int): HTTP-статус ответа
+
+        Returns:
+            None
+        """
+        super().__init__(message, model)
+        self.status = status
+
+
+class LLMRequestError(LLMServerError):
+    """
+    Запрос отклонен (4xx кроме 429): неверный ключ, модель недоступна, превышен контекст.
+    Повтор к той же модели не поможет, но резервная модель может ответить
+    """
+    retryable = False
+
+
+class LLMEmptyResponseError(LLMError):
+    """
+    Модель вернула ответ без текста
+    """
+
+
+class LLMCircuitOpenError(LLMError):
+    """
+    Модель временно исключена из обращения после серии ошибок
+    """
+
+
+def parse_retry_after(value):
+    """
+    Разбирает заголовок Retry-After: число секунд или HTTP-дата
+
+    Args:
+        value (str): значение заголовка
+
+    Returns:
+        float: пауза в секундах или None, если заголовка нет или он некорректен
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: float = None, base: float = LLM_BACKOFF_BASE,
+                  cap: float = LLM_BACKOFF_MAX) -> float:
+    """
+    Пауза перед повторной попыткой: экспоненциальный рост с полным джиттером,
+    но не меньше Retry-After, если сервис его указал
+
+    Args:
+        attempt (int): номер повтора, начиная с 0
+        retry_after (float): пауза, запрошенная сервисом
+        base (float): пауза перед первым повтором
+        cap (float): максимальная пауза
+
+    Returns:
+        float: пауза в секундах
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты модели: после threshold ошибок подряд модель исключается на cooldown
+    секунд, затем пропускается один пробный запрос. Успех закрывает автомат, ошибка
+    снова открывает его
+    """
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        """
+        Args:
+            threshold (int): количество ошибок подряд до размыкания
+            cooldown (float): время, на которое модель исключается, в секундах
+
+        Returns:
+            None
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        Текущее состояние автомата
+
+        Returns:
+            str: "closed", "open" или "half_open"
+        """
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """
+        Проверяет, можно ли отправить запрос. В полуоткрытом состоянии пропускается
+        только один пробный запрос; если он не завершился за cooldown (например, был
+        отменен), пропускается следующий
+
+        Returns:
+            bool: True, если запрос разрешен
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            now = time.monotonic()
+            if state == "half_open" and (self._probe_at is None or now - self._probe_at >= self.cooldown):
+                self._probe_at = now
+                return True
+            return False
+
+    def record_success(self):
+        """
+        Отмечает успешный запрос и замыкает автомат
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_at = None
+
+    def record_failure(self):
+        """
+        Отмечает неудачный запрос; размыкает автомат при достижении порога
+        или при неудаче пробного запроса
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.failures += 1
+            if self._probe_at is not None or (self.opened_at is None and self.failures >= self.threshold):
+                print(f"[CircuitBreaker] Размыкание после {self.failures} ошибок подряд")
+                self.opened_at = time.monotonic()
+            self._probe_at = None
+
+
+class LatencyTracker:
+    """
+    Скользящее окно длительностей успешных запросов для выбора задержки хеджирования
+    """
+    def __init__(self, percentile: float = LLM_HEDGE_PERCENTILE, min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+                 window: int = 500):
+        """
+        Args:
+            percentile (float): перцентиль длительности, после которого отправляется дубль запроса
+            min_samples (int): минимальное количество замеров, до набора которого хеджирования нет
+            window (int): количество последних замеров
+
+        Returns:
+            None
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        """
+        Добавляет замер длительности
+
+        Args:
+            seconds (float): длительность успешного запроса
+
+        Returns:
+            None
+        """
+        self._samples.append(seconds)
+
+    def hedge_delay(self):
+        """
+        Задержка хеджирования - выбранный перцентиль длительности последних запросов
+
+        Returns:
+            float: задержка перед отправкой дубля или None, если замеров еще мало
+        """
+        return self.value()
+
+    def value(self):
+        """
+        Выбранный перцентиль длительности последних запросов
+
+        Returns:
+            float: перцентиль или None, если замеров еще мало
+        """
+        if len(self._samples) < self.min_samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[int(self.percentile * (len(samples) - 1))]
+
+
+class ModelRouter:
+    """
+    Выбор моделей для задачи (classify, collect_info, ask, ...). У каждой задачи свой список
+    моделей по порядку предпочтения, лимит токенов и бюджет задержки. Если задержка текущей
+    модели задачи (перцентиль последних замеров) превышает бюджет, задача переходит на следующую
+    модель списка; по истечении cooldown снова пробует предпочтительную
+    """
+    def __init__(self, routes: dict = None, models: list = None, percentile: float = LLM_DOWNGRADE_PERCENTILE,
+                 min_samples: int = LLM_DOWNGRADE_MIN_SAMPLES, cooldown: float = LLM_DOWNGRADE_COOLDOWN):
+        """
+        Args:
+            routes (dict): задача -> {"models", "max_tokens", "budget", "timeout", "reasoning"},
+                по умолчанию LLM_ROUTES
+            models (list): если задан, заменяет списки моделей всех задач (например, для проверок)
+            percentile (float): перцентиль задержки, который сравнивается с бюджетом
+            min_samples (int): минимальное количество замеров для решения о переходе
+            cooldown (float): через сколько секунд вернуться к предпочтительной модели
+
+        Returns:
+            None
+        """
+        self.routes = {task: dict(route) for task, route in (routes or LLM_ROUTES).items()}
+        if models:
+            for route in self.routes.values():
+                route["models"] = list(models)
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        # задача -> (номер текущей модели в списке, время перехода)
+        self._levels = {}
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    @property
+    def models(self) -> list:
+        """
+        Returns:
+            list: все модели маршрутов без повторов
+        """
+        return list(dict.fromkeys(model for route in self.routes.values() for model in route["models"]))
+
+    def route(self, task: str) -> dict:
+        """
+        Параметры маршрута задачи; для неизвестной задачи - маршрут "ask"
+
+        Args:
+            task (str): задача
+
+        Returns:
+            dict: {"models", "max_tokens", "budget", "timeout", "reasoning"}
+        """
+        return self.routes.get(task) or self.routes["ask"]
+
+    def order(self, task: str) -> list:
+        """
+        Порядок перебора моделей для запроса: сначала текущая модель задачи и следующие за ней,
+        затем более предпочтительные (как последний резерв)
+
+        Args:
+            task (str): задача
+
+        Returns:
+            list: модели
+        """
+        models = self.route(task)["models"]
+        with self._lock:
+            level, since = self._levels.get(task, (0, 0.0))
+            if level and time.monotonic() - since >= self.cooldown:
+                level = 0
+                self._levels.pop(task, None)
+                # Предпочтительная модель оценивается заново, по свежим замерам
+                self._latency.pop((task, models[0]), None)
+        return models[level:] + models[:level]
+
+    def record(self, task: str, model: str, seconds: float):
+        """
+        Учитывает задержку ответа модели на задачу (для ошибок по таймауту - время до ошибки)
+
+        Args:
+            task (str): задача
+            model (str): модель
+            seconds (float): задержка
+
+        Returns:
+            str: модель, на которую перешла задача, или None, если перехода не было
+        """
+        route = self.route(task)
+        models = route["models"]
+        with self._lock:
+            tracker = self._latency.get((task, model))
+            if tracker is None:
+                tracker = self._latency[(task, model)] = LatencyTracker(self.percentile, self.min_samples, window=50)
+            tracker.record(seconds)
+            level, _ = self._levels.get(task, (0, 0.0))
+            if model not in models or models.index(model) != level or level + 1 >= len(models):
+                return None
+            observed = tracker.value()
+            if observed is None or observed <= route["budget"]:
+                return None
+            self._levels[task] = (level + 1, time.monotonic())
+            return models[level + 1]
+
+
+def parse_rate_limit_reset(value):
+    """
+    Разбирает заголовок X-RateLimit-Reset: время сброса окна в миллисекундах или секундах
+    Unix, либо число секунд до сброса
+
+    Args:
+        value (str): значение заголовка
+
+    Returns:
+        float: секунды до сброса окна или None, если заголовка нет или он некорректен
+    """
+    if not value:
+        return None
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1e12:
+        reset /= 1000
+    if reset > 1e9:
+        reset -= time.time()
+    return max(0.0, reset)
+
+
+class AdaptiveRateLimiter:
+    """
+    Общий ограничитель запросов к сервису модели: маркерная корзина задает частоту запросов,
+    семафор с приоритетами - количество одновременных запросов. Оба лимита подстраиваются
+    по схеме AIMD: до первого ответа 429 растут с каждым успешным ответом (удваиваются примерно
+    за секунду), затем - на шаг в секунду без 429; после ответа 429 уменьшаются в decrease раз,
+    а новые запросы ждут Retry-After или сброса окна X-RateLimit-Reset.
+    По заголовку X-RateLimit-Remaining корзина не выдает больше маркеров, чем осталось в окне
+    """
+    def __init__(self, rate: float = LLM_RATE_INITIAL, burst: int = LLM_RATE_BURST, min_rate: float = LLM_RATE_MIN,
+                 max_rate: float = LLM_RATE_MAX, rate_step: float = LLM_RATE_STEP,
+                 concurrency: int = LLM_CONCURRENCY_INITIAL, min_concurrency: int = LLM_CONCURRENCY_MIN,
+                 max_concurrency: int = LLM_CONCURRENCY_MAX, decrease: float = LLM_AIMD_DECREASE):
+        """
+        Args:
+            rate (float): начальная частота запросов в секунду
+            burst (int): емкость корзины - сколько запросов можно отправить подряд без паузы
+            min_rate (float): нижняя граница частоты
+            max_rate (float): верхняя граница частоты
+            rate_step (float): прирост частоты за секунду без ответов 429
+            concurrency (int): начальное количество одновременных запросов
+            min_concurrency (int): нижняя граница количества одновременных запросов
+            max_concurrency (int): верхняя граница количества одновременных запросов
+            decrease (float): множитель обоих лимитов после ответа 429
+
+        Returns:
+            None
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_step = rate_step
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease = decrease
+        self.slots = PrioritySemaphore(concurrency)
+        self.throttled = 0
+        self.rate_limited = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._successes = 0
+        self._slow_start = True
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """
+        Забирает маркер из корзины
+
+        Returns:
+            float: 0, если маркер получен, иначе сколько секунд подождать до следующей попытки
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire(self, priority: int = PRIORITY_DEFAULT):
+        """
+        Занимает слот одновременного запроса (в порядке приоритета) и дожидается маркера
+
+        Args:
+            priority (int): класс приоритета, см. TASK_PRIORITY в DeepSeekR1.py
+
+        Returns:
+            None
+        """
+        await self.slots.acquire(priority)
+        try:
+            while (delay := self._take()) > 0:
+                self.throttled += 1
+                await asyncio.sleep(delay)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self):
+        """
+        Освобождает слот одновременного запроса
+
+        Returns:
+            None
+        """
+        self.slots.release()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_DEFAULT):
+        """
+        Контекст одного запроса: acquire при входе, release при выходе
+
+        Args:
+            priority (int): класс приоритета
+
+        Yields:
+            None
+        """
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire_sync(self):
+        """
+        Дожидается маркера в синхронном коде (DeepSeekAPI). Количество одновременных
+        запросов здесь не ограничивается, общими остаются частота и паузы после 429
+
+        Returns:
+            None
+        """
+        while (delay := self._take()) > 0:
+            self.throttled += 1
+            time.sleep(delay)
+
+    def _resize(self, limit: int):
+        """
+        Меняет количество одновременных запросов. Семафор работает в цикле событий, поэтому
+        ответы синхронного клиента из других потоков меняют только частоту
+
+        Args:
+            limit (int): новое количество одновременных запросов
+
+        Returns:
+            None
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.slots.set_limit(limit)
+
+    def record(self, status: int, headers=None):
+        """
+        Учитывает ответ сервиса и подстраивает лимиты
+
+        Args:
+            status (int): HTTP-статус ответа
+            headers (Mapping): заголовки ответа
+
+        Returns:
+            None
+        """
+        headers = headers or {}
+        reset = parse_rate_limit_reset(headers.get("X-RateLimit-Reset"))
+        try:
+            remaining = int(headers.get("X-RateLimit-Remaining"))
+        except (TypeError, ValueError):
+            remaining = None
+
+        with self._lock:
+            now = time.monotonic()
+            if status == 429:
+                self.rate_limited += 1
+                self._successes = 0
+                self._slow_start = False
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._resize(max(self.min_concurrency, int(self.slots.limit * self.decrease)))
+                pause = parse_retry_after(headers.get("Retry-After"))
+                if pause is None:
+                    pause = reset if reset is not None else 1 / self.rate
+                self._paused_until = max(self._paused_until, now + pause)
+                self._tokens = 0.0
+                return
+            if remaining is not None:
+                # Подряд отправляется не больше запросов, чем осталось в окне сервиса,
+                # а исчерпанное окно выжидается до сброса, не дожидаясь 429
+                self._tokens = min(self._tokens, remaining)
+                if remaining <= 0 and reset is not None:
+                    self._paused_until = max(self._paused_until, now + reset)
+            if status < 500:
+                if self._slow_start:
+                    self.rate = min(self.max_rate, self.rate + 1)
+                    self._resize(min(self.max_concurrency, self.slots.limit + 1))
+                    return
+                # Около rate ответов в секунду - частота растет на rate_step в секунду
+                self.rate = min(self.max_rate, self.rate + self.rate_step / self.rate)
+                self._successes += 1
+                if self._successes >= self.slots.limit:
+                    self._successes = 0
+                    self._resize(min(self.max_concurrency, self.slots.limit + 1))
+
+    def metrics(self) -> dict:
+        """
+        Текущие показатели ограничителя
+
+        Returns:
+            dict: rate, concurrency, in_flight, waiting, throttled, rate_limited
+        """
+        return {
+            "rate": self.rate,
+            "concurrency": self.slots.limit,
+            "in_flight": self.slots.in_use,
+            "waiting": self.slots.waiting,
+            "throttled": self.throttled,
+            "rate_limited": self.rate_limited,
+        }
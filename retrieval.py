@@ -0,0 +1,105 @@
+from typing import List
+
+from langchain_core.documents import Document
+
+from vector_index import NumpyVectorIndex
+
+
+class ChromaRetriever:
+    """
+    Поиск чанков через векторное хранилище Chroma
+    """
+    def __init__(self, vector_store):
+        """
+        Args:
+            vector_store (Chroma): векторное хранилище
+
+        Returns:
+            None
+        """
+        self.vector_store = vector_store
+
+    def search_by_vector(self, vector, k: int) -> List[Document]:
+        """
+        Находит k ближайших чанков к эмбеддингу запроса
+
+        Args:
+            vector (list): эмбеддинг запроса
+            k (int): количество результатов
+
+        Returns:
+            List[Document]: найденные чанки по убыванию близости
+        """
+        return self.vector_store.similarity_search_by_vector(vector, k=k)
+
+    def search_batch(self, vectors, k: int) -> List[List[Document]]:
+        """
+        Находит ближайшие чанки для нескольких запросов
+
+        Args:
+            vectors (list): эмбеддинги запросов
+            k (int): количество результатов на запрос
+
+        Returns:
+            List[List[Document]]: найденные чанки для каждого запроса
+        """
+        return [self.search_by_vector(vector, k) for vector in vectors]
+
+
+class NumpyRetriever:
+    """
+    Поиск чанков по NumpyVectorIndex в памяти процесса
+    """
+    def __init__(self, index: NumpyVectorIndex):
+        """
+        Args:
+            index (NumpyVectorIndex): загруженный индекс
+
+        Returns:
+            None
+        """
+        self.index = index
+
+    @staticmethod
+    def _to_document(score: float, record: dict) -> Document:
+        """
+        Преобразует запись индекса в документ
+
+        Args:
+            score (float): косинусная близость
+            record (dict): запись индекса
+
+        Returns:
+            Document: чанк с метаданными и оценкой близости
+        """
+        return Document(page_content=record["text"], metadata={**record["metadata"], "score": score},
+                        id=record["id"])
+
+    def search_by_vector(self, vector, k: int) -> List[Document]:
+        """
+        Находит k ближайших чанков к эмбеддингу запроса
+
+        Args:
+            vector (list): эмбеддинг запроса
+            k (int): количество результатов
+
+        Returns:
+            List[Document]: найденные чанки по убыванию близости
+        """
+        return [self._to_document(score, record) for score, record in self.index.search(vector, k)]
+
+    def search_batch(self, vectors, k: int) -> List[List[Document]]:
+        """
+        Находит ближайшие чанки для нескольких запросов одним умножением матриц
+
+        Args:
+            vectors (list): эмбеддинги запросов
+            k (int): количество результатов на запрос
+
+        Returns:
+            List[List[Document]]: найденные чанки для каждого запроса
+        """
+        return [
+            [self._to_document(score, record) for score, record in hits]
+            for hits in self.index.search_batch(vectors, k)
+        ]
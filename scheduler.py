@@ -0,0 +1,268 @@
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from config import (SCHEDULER_MAX_CONCURRENCY, SCHEDULER_MAX_QUEUE_PER_CHAT, SCHEDULER_MAX_PENDING,
+                    SCHEDULER_OVERFLOW_POLICY)
+
+# Классы приоритета: чем меньше число, тем раньше сообщение получает слот обработки
+PRIORITY_APPLICATION = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_LOW = 2
+
+
+class PrioritySemaphore:
+    """
+    Семафор, выдающий свободные слоты ожидающим в порядке приоритета,
+    а при равном приоритете - в порядке очереди. Лимит можно менять на лету
+    """
+    def __init__(self, limit: int):
+        """
+        Args:
+            limit (int): количество одновременно выдаваемых слотов
+
+        Returns:
+            None
+        """
+        self.limit = limit
+        self.in_use = 0
+        self._waiters = []
+        self._counter = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        """
+        Количество ожидающих слота
+
+        Returns:
+            int: длина очереди ожидания
+        """
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int = PRIORITY_DEFAULT):
+        """
+        Занимает слот, дожидаясь своей очереди
+
+        Args:
+            priority (int): класс приоритета
+
+        Returns:
+            None
+        """
+        if self.in_use < self.limit and not self.waiting:
+            self.in_use += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже был выдан, но ожидающий отменен - возвращаем слот следующему
+                self.release()
+            raise
+
+    def release(self):
+        """
+        Освобождает слот и передает свободные слоты следующим ожидающим
+
+        Returns:
+            None
+        """
+        self.in_use -= 1
+        self._wake()
+
+    def set_limit(self, limit: int):
+        """
+        Меняет количество слотов. При уменьшении уже выданные слоты не отзываются
+
+        Args:
+            limit (int): новое количество слотов
+
+        Returns:
+            None
+        """
+        self.limit = limit
+        self._wake()
+
+    def _wake(self):
+        """
+        Выдает свободные слоты ожидающим с наивысшим приоритетом
+
+        Returns:
+            None
+        """
+        while self._waiters and self.in_use < self.limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.in_use += 1
+                future.set_result(None)
+
+
+class ChatScheduler:
+    """
+    Планировщик обработки сообщений: сообщения одного чата обрабатываются строго
+    по порядку, общее количество одновременных обработок ограничено, свободные слоты
+    достаются сначала приоритетным сообщениям. При переполнении очередей новые
+    сообщения отбрасываются или получают ответ "занято"
+    """
+    def __init__(self, handler: Callable[[Any], Awaitable[None]],
+                 max_concurrency: int = SCHEDULER_MAX_CONCURRENCY,
+                 max_queue_per_chat: int = SCHEDULER_MAX_QUEUE_PER_CHAT,
+                 max_pending: int = SCHEDULER_MAX_PENDING,
+                 overflow_policy: str = SCHEDULER_OVERFLOW_POLICY,
+                 priority_fn: Callable[[Any], Awaitable[int]] = None,
+                 on_overflow: Callable[[Any], Awaitable[None]] = None):
+        """
+        Args:
+            handler (Callable): корутина обработки одного сообщения
+            max_concurrency (int): максимум одновременно обрабатываемых сообщений
+            max_queue_per_chat (int): максимум ожидающих сообщений одного чата
+            max_pending (int): максимум ожидающих сообщений всех чатов
+            overflow_policy (str): "drop" - молча отбросить, "busy" - вызвать on_overflow
+            priority_fn (Callable): корутина, определяющая класс приоритета сообщения
+            on_overflow (Callable): корутина, уведомляющая пользователя о перегрузке
+
+        Returns:
+            None
+        """
+        self.handler = handler
+        self.max_queue_per_chat = max_queue_per_chat
+        self.max_pending = max_pending
+        self.overflow_policy = overflow_policy
+        self.priority_fn = priority_fn
+        self.on_overflow = on_overflow
+        self._slots = PrioritySemaphore(max_concurrency)
+        self._queues = {}
+        self._workers = {}
+        self._pending = 0
+        self._processed = 0
+        self._dropped = 0
+        self._wait_times = deque(maxlen=1000)
+
+    async def submit(self, message) -> bool:
+        """
+        Ставит сообщение в очередь его чата. Место в очереди резервируется сразу, до вычисления
+        приоритета: так при перегрузке не тратится время на классификацию отклоняемых сообщений,
+        вычисляемые оценки учитываются в пределах очередей, а сообщения одного чата обрабатываются
+        в порядке поступления, даже если приоритет более раннего сообщения вычисляется дольше
+
+        Args:
+            message (Message): объект сообщения от пользователя
+
+        Returns:
+            bool: True, если сообщение принято в обработку
+        """
+        chat_id = message.chat.id
+        if self._is_full(chat_id):
+            return await self._reject(message)
+
+        priority = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(chat_id, deque())
+        queue.append((message, priority, time.monotonic()))
+        self._pending += 1
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain_chat(chat_id))
+
+        try:
+            priority.set_result(await self.priority_fn(message) if self.priority_fn is not None
+                                else PRIORITY_DEFAULT)
+        except Exception as e:
+            print(f"[ChatScheduler] Не удалось оценить приоритет сообщения чата {chat_id}: {e}")
+        finally:
+            # Сообщение уже в очереди: без оценки оно обрабатывается с обычным приоритетом
+            if not priority.done():
+                priority.set_result(PRIORITY_DEFAULT)
+        return True
+
+    def _is_full(self, chat_id) -> bool:
+        """
+        Args:
+            chat_id (int): идентификатор чата
+
+        Returns:
+            bool: True, если очередь чата или общее количество ожидающих сообщений достигли предела
+        """
+        queue = self._queues.get(chat_id)
+        return (queue is not None and len(queue) >= self.max_queue_per_chat) or self._pending >= self.max_pending
+
+    async def _reject(self, message) -> bool:
+        """
+        Отклоняет сообщение при переполнении и по политике overflow_policy уведомляет пользователя
+
+        Args:
+            message (Message): объект сообщения от пользователя
+
+        Returns:
+            bool: всегда False
+        """
+        self._dropped += 1
+        print(f"[ChatScheduler] Очередь переполнена, сообщение чата {message.chat.id} отклонено")
+        if self.overflow_policy == "busy" and self.on_overflow is not None:
+            await self.on_overflow(message)
+        return False
+
+    async def _drain_chat(self, chat_id):
+        """
+        Последовательно обрабатывает очередь одного чата
+
+        Args:
+            chat_id (int): идентификатор чата
+
+        Returns:
+            None
+        """
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                _, priority, _ = queue[0]
+                await self._slots.acquire(await priority)
+                message, _, enqueued_at = queue.popleft()
+                self._pending -= 1
+                self._wait_times.append(time.monotonic() - enqueued_at)
+                try:
+                    await self.handler(message)
+                except Exception as e:
+                    print(f"[ChatScheduler] Ошибка обработки сообщения чата {chat_id}: {e}")
+                finally:
+                    self._slots.release()
+                    self._processed += 1
+        finally:
+            del self._workers[chat_id]
+            if not queue:
+                self._queues.pop(chat_id, None)
+
+    async def drain(self):
+        """
+        Дожидается обработки всех принятых сообщений
+
+        Returns:
+            None
+        """
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    def metrics(self) -> dict:
+        """
+        Текущие показатели планировщика
+
+        Returns:
+            dict: количество обрабатываемых и ожидающих сообщений, глубина очередей,
+                  счетчики и время ожидания слота (среднее, p95, максимум) по последним сообщениям
+        """
+        waits = sorted(self._wait_times)
+        return {
+            "in_flight": self._slots.in_use,
+            "pending": self._pending,
+            "chats": len(self._queues),
+            "max_chat_queue": max((len(queue) for queue in self._queues.values()), default=0),
+            "processed": self._processed,
+            "dropped": self._dropped,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+        }
@@ -0,0 +1,203 @@
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL
+
+
+class SemanticCache:
+    """
+    Кэш ответов, ключом которого является эмбеддинг вопроса. Вопрос считается
+    повторным, если косинусная близость к сохраненному вопросу не ниже порога.
+    Записи вытесняются по LRU и по TTL, хранятся в SQLite и сбрасываются
+    при смене версии базы знаний
+    """
+    def __init__(self, path: str = ANSWER_CACHE_PATH,
+                 threshold: float = ANSWER_CACHE_THRESHOLD,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 ttl: float = ANSWER_CACHE_TTL):
+        """
+        Открывает (или создает) файл кэша и загружает записи в память
+
+        Args:
+            path (str): путь к файлу SQLite
+            threshold (float): минимальная косинусная близость для попадания в кэш
+            max_entries (int): максимальное количество записей
+            ttl (float): время жизни записи, в секундах
+
+        Returns:
+            None
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        ''')
+        # id -> (нормализованный эмбеддинг, ответ, время создания); порядок - от давно не использованных
+        self._entries = OrderedDict()
+        rows = self._conn.execute(
+            "SELECT id, answer, embedding, created_at FROM answers ORDER BY accessed_at"
+        ).fetchall()
+        for entry_id, answer, blob, created_at in rows:
+            self._entries[entry_id] = (np.frombuffer(blob, dtype=np.float32), answer, created_at)
+        self._matrix = None
+        self._ids = []
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        """
+        Приводит эмбеддинг к единичной норме
+
+        Args:
+            embedding (list): эмбеддинг вопроса
+
+        Returns:
+            ndarray: нормализованный вектор float32
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _delete(self, entry_ids):
+        """
+        Удаляет записи из памяти и с диска
+
+        Args:
+            entry_ids (list): идентификаторы записей
+
+        Returns:
+            None
+        """
+        if not entry_ids:
+            return
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+        self._conn.commit()
+        self._matrix = None
+
+    def _evict_expired(self, now: float):
+        """
+        Удаляет записи старше ttl
+
+        Args:
+            now (float): текущее время
+
+        Returns:
+            None
+        """
+        expired = [entry_id for entry_id, (_, _, created_at) in self._entries.items()
+                   if now - created_at > self.ttl]
+        self._delete(expired)
+
+    def get(self, embedding):
+        """
+        Ищет сохраненный ответ на близкий вопрос
+
+        Args:
+            embedding (list): эмбеддинг вопроса
+
+        Returns:
+            str: сохраненный ответ или None
+        """
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._ids = list(self._entries.keys())
+                self._matrix = np.stack([vector for vector, _, _ in self._entries.values()])
+
+            similarities = self._matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = self._ids[best]
+            self._entries.move_to_end(entry_id)
+            self._conn.execute("UPDATE answers SET accessed_at = ? WHERE id = ?", (now, entry_id))
+            self._conn.commit()
+            self.hits += 1
+            return self._entries[entry_id][1]
+
+    def put(self, question: str, embedding, answer: str):
+        """
+        Сохраняет ответ на вопрос, вытесняя давно не использованные записи сверх лимита
+
+        Args:
+            question (str): текст вопроса
+            embedding (list): эмбеддинг вопроса
+            answer (str): ответ модели
+
+        Returns:
+            None
+        """
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (question, answer, embedding, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (question, answer, vector.tobytes(), now, now)
+            )
+            self._conn.commit()
+            self._entries[cursor.lastrowid] = (vector, answer, now)
+            self._matrix = None
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._delete(list(self._entries.keys())[:overflow])
+
+    def clear(self):
+        """
+        Удаляет все записи кэша
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def sync_version(self, version: str):
+        """
+        Сбрасывает кэш, если версия базы знаний изменилась с момента сохранения ответов
+
+        Args:
+            version (str): текущая версия базы знаний
+
+        Returns:
+            None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'kb_version'").fetchone()
+            if row and row[0] == version:
+                return
+            if row:
+                print("[SemanticCache] База знаний обновлена, кэш ответов сброшен")
+                self.clear()
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('kb_version', ?)", (version,))
+            self._conn.commit()
@@ -0,0 +1,76 @@
+import os
+import re
+import sys
+import asyncio
+import contextlib
+
+import pytest
+
+# Модули проекта читают токен при импорте config; в тестах запросы к модели не отправляются
+os.environ.setdefault("DEEP_API_TOKEN", "test")
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import UserMessagesDB, ROW_COLUMNS  # noqa: E402
+
+
+
+class FakeConnection:
+    """
+    Соединение asyncpg без сервера: запоминает запросы и записанные строки и, как Postgres,
+    отклоняет NULL в колонках user_requests, объявленных NOT NULL в create_table
+    """
+    def __init__(self, pool: "FakePool"):
+        self.pool = pool
+
+    async def execute(self, query: str, *args):
+        self.pool.queries.append(query)
+        if "CREATE TABLE IF NOT EXISTS user_requests" in query:
+            table = query.split("CREATE TABLE IF NOT EXISTS user_requests", 1)[1].split(");", 1)[0]
+            not_null = set(re.findall(r"^\s*(\w+) [^,\n]*NOT NULL", table, re.MULTILINE))
+            not_null -= set(re.findall(r"ALTER COLUMN (\w+) DROP NOT NULL", query))
+            self.pool.not_null = not_null
+
+    async def executemany(self, query: str, rows: list):
+        self.pool.queries.append(query)
+        if self.pool.fail:
+            raise ConnectionError("соединение с базой потеряно")
+        for row in rows:
+            for column, value in zip(ROW_COLUMNS, row):
+                if value is None and column in self.pool.not_null:
+                    raise ValueError(f'null value in column "{column}" violates not-null constraint')
+        self.pool.rows.extend(rows)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+class FakePool:
+    """
+    Пул соединений asyncpg для UserMessagesDB без сервера Postgres
+    """
+    def __init__(self):
+        self.queries = []
+        self.rows = []
+        self.not_null = set()
+        self.fail = False
+        self.closed = False
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield FakeConnection(self)
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_db():
+    """
+    UserMessagesDB без фоновой записи поверх FakePool со схемой из create_table
+    """
+    db = UserMessagesDB("postgresql://test", flush_size=0, flush_interval=0)
+    db.pool = FakePool()
+    asyncio.run(db.create_table())
+    return db
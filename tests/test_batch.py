@@ -0,0 +1,124 @@
+import json
+import asyncio
+
+import pytest
+
+import agent
+from batch import BatchRunner, Checkpoint, read_records
+from message_record import MessageRecord
+
+
+class StubClassifier:
+    """
+    Локальный классификатор, который всегда возвращает заданную метку
+    """
+    def __init__(self, label: str):
+        self.label = label
+
+    def classify(self, text: str) -> str:
+        return self.label
+
+
+class StubLLM:
+    """
+    Клиент модели, который не находит в тексте ни одного поля заявки
+    """
+    def __init__(self):
+        self.calls = []
+
+    async def collect_fields(self, text: str, fields: list) -> str:
+        self.calls.append(fields)
+        return "{}"
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as file:
+        for record in records:
+            file.write((record if isinstance(record, str) else json.dumps(record, ensure_ascii=False)) + "\n")
+
+
+@pytest.fixture
+def lead_graph(monkeypatch, fake_db):
+    """
+    Граф агента, в котором каждое сообщение - заявка, а заявки пишутся в fake_db
+    """
+    monkeypatch.setattr(agent, "preclassifier", StubClassifier("заявка"))
+    monkeypatch.setattr(agent, "llm", StubLLM())
+    monkeypatch.setattr(agent, "db", fake_db)
+    return fake_db
+
+
+def test_lead_without_first_name_is_saved(tmp_path, lead_graph):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_jsonl(input_path, [{"text": "Хочу заказать ящик Каберне, телефон +7 900 123-45-67", "user_id": 42}])
+
+    stats = asyncio.run(BatchRunner(str(input_path), str(output_path), concurrency=1, rate=0).run())
+
+    assert stats == {"processed": 1, "failed": 0, "skipped": 0}
+    [row] = lead_graph.pool.rows
+    assert row[1] == 42 and row[3] is None
+    assert "900" in row[8]
+    [result] = [json.loads(line) for line in output_path.read_text(encoding="utf-8").splitlines()]
+    assert result["status"] == "completed"
+    assert lead_graph._buffer == []
+
+
+def test_schema_allows_null_first_name(fake_db):
+    assert "first_name" not in fake_db.pool.not_null
+    assert {"message_text", "chat_id"} <= fake_db.pool.not_null
+
+
+def test_resume_skips_processed_lines(tmp_path, lead_graph):
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_jsonl(input_path, [{"text": f"Заявка {i}, телефон +7 900 000-00-0{i}", "user_id": i} for i in range(3)])
+    asyncio.run(BatchRunner(str(input_path), str(output_path), rate=0).run())
+
+    write_jsonl(input_path, [{"text": f"Заявка {i}, телефон +7 900 000-00-0{i}", "user_id": i} for i in range(4)])
+    stats = asyncio.run(BatchRunner(str(input_path), str(output_path), rate=0).run())
+
+    assert stats["processed"] == 1
+    lines = [json.loads(line)["line"] for line in output_path.read_text(encoding="utf-8").splitlines()]
+    assert sorted(lines) == [0, 1, 2, 3]
+    assert len(lead_graph.pool.rows) == 4
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    input_path = tmp_path / "in.jsonl"
+    write_jsonl(input_path, [{"text": "a"}])
+    checkpoint = Checkpoint(str(tmp_path / "out.checkpoint"), str(input_path))
+    assert checkpoint.load() is False
+    for line in (0, 1, 3):
+        checkpoint.mark(line)
+    assert checkpoint.watermark == 2 and checkpoint.done == {3}
+    checkpoint.save(checkpoint.watermark, set(checkpoint.done), 10)
+
+    restored = Checkpoint(str(tmp_path / "out.checkpoint"), str(input_path))
+    assert restored.load() is True
+    assert [restored.is_done(line) for line in (0, 1, 2, 3)] == [True, True, False, True]
+    assert restored.output_size == 10
+
+
+def test_read_records_reports_invalid_lines(tmp_path):
+    input_path = tmp_path / "in.jsonl"
+    write_jsonl(input_path, [{"text": "Подойдет ли Мерло к сыру?"}, "{not json", {"user_id": 1}, "",
+                             '["text"]', '"Подойдет ли Мерло к сыру?"', "null"])
+    checkpoint = Checkpoint(str(tmp_path / "out.checkpoint"), str(input_path))
+
+    items = list(read_records(str(input_path), checkpoint))
+
+    assert [line for line, _, _ in items] == [0, 1, 2, 4, 5, 6]
+    assert isinstance(items[0][1], MessageRecord) and items[0][2] is None
+    assert all(record is None and error for _, record, error in items[1:])
+
+
+def test_backlog_from_one_user_is_not_rate_limited(tmp_path, lead_graph, monkeypatch):
+    monkeypatch.setattr(agent, "flood_detector", agent.FloodDetector(user_rate=10, rate_window=60))
+    input_path, output_path = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_jsonl(input_path, [{"text": f"Заказ номер {i}: ящик Мерло, телефон +7 900 000-00-{i:02d}", "user_id": 7}
+                             for i in range(15)])
+
+    asyncio.run(BatchRunner(str(input_path), str(output_path), concurrency=1, rate=0).run())
+
+    statuses = [json.loads(line)["status"] for line in output_path.read_text(encoding="utf-8").splitlines()]
+    assert statuses == ["completed"] * 15
+    assert len(lead_graph.pool.rows) == 15
@@ -0,0 +1,68 @@
+from langchain_core.documents import Document
+
+from config import CONTEXT_CHARS_PER_TOKEN
+from context import estimate_tokens, merge_overlapping, drop_near_duplicates, assemble_context
+
+
+def chunk(text: str, source: str = "Мерло.md", start: int = None) -> Document:
+    metadata = {"source": source}
+    if start is not None:
+        metadata["start_index"] = start
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_estimate_tokens_rounds_up():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a") == 1
+    assert estimate_tokens("a" * int(CONTEXT_CHARS_PER_TOKEN * 10)) == 10
+
+
+def test_merge_overlapping_and_adjacent_chunks():
+    text = "Мерло - мягкое вино. Его подают к пасте. Температура подачи 15-18 градусов."
+    docs = [
+        chunk(text[20:50], start=20),
+        chunk(text[0:30], start=0),
+        chunk(text[52:], start=52),
+        chunk("Другая статья", source="Мальбек.md", start=0),
+        chunk("Без позиции", source="Мерло.md"),
+    ]
+    passages = merge_overlapping(docs)
+    assert passages[0] == {"text": text[0:50] + "\n" + text[52:], "source": "Мерло.md", "rank": 0, "chunks": 3}
+    assert [passage["text"] for passage in passages[1:]] == ["Другая статья", "Без позиции"]
+
+
+def test_distant_chunks_of_one_article_stay_separate():
+    passages = merge_overlapping([chunk("начало статьи", start=0), chunk("конец статьи", start=500)])
+    assert [passage["chunks"] for passage in passages] == [1, 1]
+
+
+def test_drop_near_duplicates_keeps_more_relevant_passage():
+    paragraph = "Мерло хорошо сочетается с пастой с говядиной в томатном соусе и сыром средней выдержки"
+    passages = [
+        {"text": paragraph, "source": "Мерло.md", "rank": 0, "chunks": 1},
+        {"text": paragraph + " и птицей", "source": "Бордо.md", "rank": 1, "chunks": 1},
+        {"text": "Мальбек - сорт из Аргентины", "source": "Мальбек.md", "rank": 2, "chunks": 1},
+    ]
+    assert [passage["source"] for passage in drop_near_duplicates(passages, threshold=0.8)] == \
+        ["Мерло.md", "Мальбек.md"]
+
+
+def test_assemble_context_respects_budget_and_skips_large_passages():
+    small = "а" * int(CONTEXT_CHARS_PER_TOKEN * 10)
+    large = "б" * int(CONTEXT_CHARS_PER_TOKEN * 100)
+    other = "г" * int(CONTEXT_CHARS_PER_TOKEN * 10)
+    docs = [chunk(small, source="1.md"), chunk(large, source="2.md"), chunk(other, source="3.md")]
+    context, stats = assemble_context(docs, token_budget=25)
+    assert context == small + "\n\n" + other
+    assert stats["used"] == 2 and stats["tokens"] <= 25 and stats["raw_tokens"] > 100
+
+
+def test_assemble_context_truncates_first_passage_when_nothing_fits():
+    large = "в" * int(CONTEXT_CHARS_PER_TOKEN * 100)
+    context, stats = assemble_context([chunk(large)], token_budget=10)
+    assert len(context) == int(10 * CONTEXT_CHARS_PER_TOKEN) and stats["tokens"] == 10
+
+
+def test_assemble_context_without_docs():
+    assert assemble_context([], token_budget=10) == ("", {"chunks": 0, "passages": 0, "used": 0, "tokens": 0,
+                                                           "raw_tokens": 0})
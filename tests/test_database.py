@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+import agent
+import database
+from message_record import MessageRecord
+
+
+def make_record(message_id: int) -> MessageRecord:
+    return MessageRecord.from_dict({"text": f"Заявка {message_id}", "user_id": 1, "message_id": message_id})
+
+
+def test_failed_flush_keeps_rows_for_next_attempt(fake_db):
+    async def scenario():
+        await fake_db.enqueue_message(make_record(1), "+79990000001")
+        fake_db.pool.fail = True
+        with pytest.raises(ConnectionError):
+            await fake_db.flush()
+        assert len(fake_db._buffer) == 1
+        fake_db.pool.fail = False
+        await fake_db.flush()
+
+    asyncio.run(scenario())
+    assert [row[0] for row in fake_db.pool.rows] == [1]
+    assert fake_db._buffer == []
+
+
+def test_buffer_overflow_logs_dropped_rows(fake_db, monkeypatch, capsys):
+    monkeypatch.setattr(database, "DB_BUFFER_LIMIT", 2)
+
+    async def scenario():
+        fake_db.pool.fail = True
+        for message_id in range(1, 4):
+            await fake_db.enqueue_message(make_record(message_id), f"+7999000000{message_id}")
+            with pytest.raises(ConnectionError):
+                await fake_db.flush()
+
+    asyncio.run(scenario())
+    assert [row[0] for row in fake_db._buffer] == [2, 3]
+    output = capsys.readouterr().out
+    assert "не будет записано сообщений: 1" in output
+    assert "'message_id': 1" in output and "'contact_info': '+79990000001'" in output
+    assert "'message_id': 2" not in output
+
+
+def test_close_closes_pool_and_logs_lost_rows_when_flush_fails(fake_db, capsys):
+    pool = fake_db.pool
+
+    async def scenario():
+        await fake_db.enqueue_message(make_record(7), "+79990000007", "Иван", "Мерло")
+        pool.fail = True
+        await fake_db.close()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(scenario())
+    assert pool.closed and fake_db.pool is None
+    output = capsys.readouterr().out
+    assert "не записано сообщений: 1" in output and "'contact_info': '+79990000007'" in output
+
+
+def test_agent_shutdown_closes_llm_sessions_when_db_close_fails(monkeypatch):
+    closed = []
+
+    class FailingDB:
+        async def close(self):
+            raise ConnectionError("соединение с базой потеряно")
+
+    class Session:
+        def __init__(self, name):
+            self.name = name
+
+        async def close(self):
+            closed.append(self.name)
+
+    async def no_metrics():
+        pass
+
+    monkeypatch.setattr(agent, "db", FailingDB())
+    monkeypatch.setattr(agent, "llm", Session("agent"))
+    monkeypatch.setattr(agent.RAG, "async_llm", Session("rag"))
+    monkeypatch.setattr(agent, "stop_metrics_server", no_metrics)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(agent.shutdown())
+    assert closed == ["agent", "rag"]
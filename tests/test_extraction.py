@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+import agent
+from extraction import (normalize_phone, extract_contacts, extract_lead, extract_product, profile_lead, merge_lead,
+                        missing_fields, ProductCatalog)
+from message_record import RecordUser
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("8 (916) 555-44-33", "+79165554433"),
+    ("+7-916-555-44-33", "+79165554433"),
+    ("9031112233", "+79031112233"),
+    ("+375 (29) 123-45-67", "+375291234567"),
+    ("1234567890", None),
+    ("8 800 555 35 35", "+78005553535"),
+])
+def test_normalize_phone(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+def test_extract_contacts_does_not_take_email_domain_for_handle():
+    contacts = extract_contacts("Пишите в телегу @bar_owner_msk, на bar@owner.ru или t.me/kava_shop, тел 8 916 000 11 22")
+    assert contacts == {"phones": ["+79160001122"], "emails": ["bar@owner.ru"],
+                        "handles": ["@bar_owner_msk", "@kava_shop"]}
+
+
+def test_extract_contacts_ignores_dates_and_order_numbers():
+    contacts = extract_contacts("Заберу 12.05 после 18:00, номер заказа 1234567890")
+    assert contacts == {"phones": [], "emails": [], "handles": []}
+
+
+def test_extract_lead_reads_name_and_product():
+    lead = extract_lead("Меня зовут Ольга Петрова, хочу 12 бутылок Мерло. Мой номер +7 999 123-45-67")
+    assert lead == {"contact_info": "+79991234567", "fio": "Ольга Петрова", "product": "Мерло, 12 бутылок"}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Заказ на 3 бутылки Мальбека", "Мальбек, 3 бутылки"),
+    ("Интересует оптовая поставка Рислинга", "Рислинг"),
+    ("Добрый день, хочу 2 ящика Пино Нуар", "Пино-нуар, 2 ящика"),
+    ("Нужен Совиньон Блан 6 бутылок", "Совиньон блан, 6 бутылок"),
+    ("Нужен ящик красного сухого", None),
+    ("Доставка в Нью-Йорк, 5 бутылок", None),
+])
+def test_extract_product(text, expected):
+    assert extract_product(text) == expected
+
+
+def test_product_catalog_prefers_longer_titles():
+    catalog = ProductCatalog(["Совиньон", "Совиньон блан", "Каберне Совиньон", "Ар"])
+    assert catalog.find("Каберне Совиньон и совиньон блан") == ["Каберне Совиньон", "Совиньон блан"]
+    assert catalog.find("ар") == []
+
+
+def test_merge_lead_prefers_primary_and_cleans_empty_values():
+    lead = merge_lead({"contact_info": "+79991234567", "fio": "null", "product": ""},
+                      {"contact_info": "@other", "fio": "Иван", "product": ["Мерло", "None"]})
+    assert lead == {"contact_info": "+79991234567", "fio": "Иван", "product": "Мерло"}
+    assert missing_fields(lead) == []
+    assert missing_fields({"contact_info": "-", "fio": "Иван"}) == ["contact_info", "product"]
+
+
+def test_profile_lead():
+    assert profile_lead(RecordUser(1, "wine_lover", " Сергей ", None)) == {
+        "contact_info": "@wine_lover", "fio": "Сергей", "product": None}
+    assert profile_lead(None) == {"contact_info": None, "fio": None, "product": None}
+
+
+class StubLLM:
+    def __init__(self, response: str):
+        self.response = response
+        self.calls = []
+
+    async def collect_fields(self, text, fields):
+        self.calls.append(fields)
+        return self.response
+
+
+def test_collect_missing_info_skips_model_when_lead_is_complete(monkeypatch):
+    llm = StubLLM("{}")
+    monkeypatch.setattr(agent, "llm", llm)
+    lead = asyncio.run(agent.collect_missing_info("Беру Мерло 2 шт, мой номер +7 (901) 234 56 78",
+                                                  RecordUser(1, None, "Виталий", None), {}))
+    assert lead == {"contact_info": "+79012345678", "fio": "Виталий", "product": "Мерло, 2 шт"}
+    assert llm.calls == []
+
+
+def test_collect_missing_info_asks_model_only_for_missing_fields(monkeypatch):
+    llm = StubLLM('{"product": "ящик красного сухого вина"}')
+    monkeypatch.setattr(agent, "llm", llm)
+    lead = asyncio.run(agent.collect_missing_info("Нужен ящик красного сухого, звоните 89257654321",
+                                                  RecordUser(1, None, "Игорь", None), {}))
+    assert llm.calls == [["product"]]
+    assert lead["product"] == "ящик красного сухого вина" and lead["contact_info"] == "+79257654321"
@@ -0,0 +1,61 @@
+from flood import FloodDetector, normalize_text, simhash, band_layout
+
+SPAM = "Заработок от 5000 рублей в день без вложений! Пиши в личку https://t.me/easy_money"
+
+
+def test_normalize_text_hides_small_edits():
+    assert normalize_text("ЗАРАБОТОК от 7000 рублей!!! 🔥 https://spam.example/x") == \
+        normalize_text("Заработок от 5000 рублей https://other.example/y")
+    # Латинские двойники заменяются только в словах с кириллицей
+    assert normalize_text("Зapaбoтoк Merlot") == "заработок merlot"
+
+
+def test_simhash_is_close_for_near_duplicates():
+    original = simhash(normalize_text(SPAM))
+    edited = simhash(normalize_text(SPAM.replace("Пиши", "Напиши")))
+    unrelated = simhash(normalize_text("Подскажите, какое вино подойдет к стейку из говядины?"))
+    assert bin(original ^ edited).count("1") <= 8
+    assert bin(original ^ unrelated).count("1") > 8
+
+
+def test_band_layout_covers_all_bits():
+    layout = band_layout(8)
+    assert len(layout) == 9
+    assert sum(bin(mask).count("1") for _, mask in layout) == 64
+    assert [shift for shift, _ in layout] == sorted(shift for shift, _ in layout)
+
+
+def test_remembered_spam_matches_near_duplicates_only():
+    detector = FloodDetector(window=3600, user_rate=0)
+    assert detector.check(SPAM, now=0) == (None, None)
+    detector.remember(SPAM, "спам", now=0)
+
+    assert detector.check(SPAM.replace("5000", "9000").replace("!", "!!!"), now=10) == ("спам", "duplicate")
+    assert detector.check("Подскажите, какое вино подойдет к стейку из говядины?", now=10) == (None, None)
+    assert detector.stats == {"checked": 3, "duplicate": 1, "rate": 0}
+
+
+def test_short_texts_are_compared_exactly():
+    detector = FloodDetector(min_length=20, user_rate=0)
+    detector.remember("купи", "спам", now=0)
+    assert detector.check("Купи!", now=1) == ("спам", "duplicate")
+    assert detector.check("куплю", now=1) == (None, None)
+
+
+def test_old_and_excess_fingerprints_are_evicted():
+    detector = FloodDetector(window=60, max_entries=2, user_rate=0)
+    for index, text in enumerate(["первый спам текст номер", "второй спам другой текст", "третий совсем иной"]):
+        detector.remember(text, "спам", now=index)
+    assert len(detector) == 2
+    assert detector.check("первый спам текст номер", now=3) == (None, None)
+    assert detector.check("третий совсем иной", now=100) == (None, None)
+    assert len(detector) == 0 and detector._bands == {}
+
+
+def test_user_rate_limit_uses_sliding_window():
+    detector = FloodDetector(user_rate=3, rate_window=60)
+    verdicts = [detector.check(f"сообщение {i}", user_id=1, now=i)[1] for i in range(4)]
+    assert verdicts == [None, None, None, "rate"]
+    assert detector.check("другой пользователь", user_id=2, now=4) == (None, None)
+    assert detector.check("сообщение позже", user_id=1, now=70) == (None, None)
+    assert detector.check("без пользователя", now=5) == (None, None)
@@ -0,0 +1,80 @@
+import pytest
+from langchain_core.documents import Document
+
+from lexical_index import LexicalIndex, tokenize, extract_aliases
+
+ARTICLES = {
+    "Мальбек": ["Мальбек (фр. Malbec) - красный сорт, главный сорт Аргентины.",
+                "Мальбек подают к стейку и жареному мясу.",
+                "Вина из мальбека выдерживают в дубовых бочках."],
+    "Мерло": ["Мерло (фр. Merlot) - сорт из Бордо с мягкими танинами.",
+              "Мерло сочетается с пастой и сыром средней выдержки."],
+    "Ар": ["Ар (нем. Ahr) - небольшой регион Германии, известный пино-нуаром."],
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    ids, texts, metadatas = [], [], []
+    for title, chunks in ARTICLES.items():
+        start = 0
+        for number, text in enumerate(chunks):
+            ids.append(f"{title}-{number}")
+            texts.append(text)
+            metadatas.append({"source": f"{title}.md", "title": title, "start_index": start})
+            start += len(text) + 1
+    return LexicalIndex.build(str(tmp_path / "lexical.json"), ids, texts, metadatas, version="v1")
+
+
+def test_tokenize_normalizes_case_and_inflection():
+    assert tokenize("Мальбека") == tokenize("мальбек")
+    assert tokenize("Ёмкость, Malbec!") == tokenize("емкость malbec")
+
+
+def test_extract_aliases_reads_latin_name():
+    assert extract_aliases("Мальбек ", ARTICLES["Мальбек"][0]) == ["Мальбек", "Malbec"]
+    assert extract_aliases("Мерло", "Мерло - сорт винограда") == ["Мерло"]
+
+
+def test_short_single_word_titles_are_not_aliases(index):
+    assert "ahr" in index.aliases
+    assert not any(alias == tokenize("Ар")[0] for alias in index.aliases)
+
+
+def test_direct_hits_return_chunks_of_named_article(index):
+    docs = index.direct_hits("Что подать к вину из Мальбека? Подойдет ли стейк?", k=2)
+    assert [doc.metadata["source"] for doc in docs] == ["Мальбек.md", "Мальбек.md"]
+    assert docs[0].id == "Мальбек-1"
+    assert index.direct_hits("Какое вино подать к сыру?", k=3) == []
+
+
+def test_direct_hits_interleave_several_articles(index):
+    docs = index.direct_hits("Malbec или Merlot к пасте?", k=3)
+    assert [doc.metadata["source"] for doc in docs] == ["Мальбек.md", "Мерло.md", "Мальбек.md"]
+    assert docs[1].id == "Мерло-1"
+
+
+def test_bm25_prefers_chunks_with_query_terms(index):
+    scores = index.bm25(tokenize("паста сыр"))
+    best = max(scores, key=scores.get)
+    assert index.chunks[best]["id"] == "Мерло-1"
+    assert index.bm25(tokenize("неизвестное слово")) == {}
+
+
+def test_hybrid_fuses_dense_and_lexical_results(index):
+    dense = [Document(page_content=index.chunks[0]["text"], metadata=dict(index.chunks[0]["metadata"])),
+             Document(page_content=index.chunks[4]["text"], metadata=dict(index.chunks[4]["metadata"]))]
+    docs = index.hybrid("паста и сыр", dense, k=3)
+    keys = [(doc.metadata["source"], doc.metadata["start_index"]) for doc in docs]
+    # Чанк про пасту есть и в векторной, и в лексической выдаче, поэтому он первый
+    assert keys[0] == ("Мерло.md", index.chunks[4]["metadata"]["start_index"])
+    assert len(set(keys)) == len(keys) == 3
+
+
+def test_load_roundtrip_and_version(index, tmp_path):
+    path = str(tmp_path / "lexical.json")
+    loaded = LexicalIndex.load(path)
+    assert loaded.version == "v1" and LexicalIndex.read_version(path) == "v1"
+    assert loaded.aliases == index.aliases
+    assert [chunk["id"] for chunk in loaded.chunks] == [chunk["id"] for chunk in index.chunks]
+    assert LexicalIndex.read_version(str(tmp_path / "missing.json")) is None
@@ -0,0 +1,27 @@
+import os
+import sys
+import subprocess
+
+import RAG
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_does_not_create_answer_cache(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT, DEEP_API_TOKEN="test")
+    subprocess.run([sys.executable, "-c", "import RAG"], cwd=tmp_path, env=env, check=True, capture_output=True)
+    assert not (tmp_path / "answer_cache.sqlite3").exists()
+
+
+def test_answer_cache_is_opened_on_first_use(tmp_path, monkeypatch):
+    path = tmp_path / "cache.sqlite3"
+    monkeypatch.setattr(RAG, "_answer_cache", None)
+    monkeypatch.setattr(RAG, "ANSWER_CACHE_PATH", str(path))
+    monkeypatch.setattr(RAG, "ANSWER_CACHE_ENABLED", False)
+    assert RAG.get_answer_cache() is None and not path.exists()
+
+    monkeypatch.setattr(RAG, "ANSWER_CACHE_ENABLED", True)
+    cache = RAG.get_answer_cache()
+    assert cache is RAG.get_answer_cache()
+    RAG._store_answer("Вопрос", [1.0, 0.0], "Ответ")
+    assert path.exists() and cache.get([1.0, 0.0]) == "Ответ"
@@ -0,0 +1,171 @@
+import time
+import asyncio
+import random
+from email.utils import formatdate
+
+import pytest
+
+from DeepSeekR1 import AsyncDeepSeekAPI
+from resilience import (CircuitBreaker, AdaptiveRateLimiter, LLMTimeoutError, backoff_delay, parse_retry_after,
+                        parse_rate_limit_reset)
+from scheduler import PRIORITY_APPLICATION, PRIORITY_LOW
+
+
+class CountingLimiter:
+    """
+    Ограничитель, который сразу выдает слот и считает занятые и освобожденные слоты
+    """
+    def __init__(self):
+        self.acquired = 0
+        self.released = 0
+
+    async def acquire(self, priority):
+        self.acquired += 1
+
+    def release(self):
+        self.released += 1
+
+    def record(self, status, headers):
+        pass
+
+
+def test_circuit_breaker_opens_after_threshold_and_probes_once():
+    breaker = CircuitBreaker(threshold=3, cooldown=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    breaker.opened_at -= 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0 and breaker.allow()
+
+
+def test_backoff_delay_is_capped_and_respects_retry_after():
+    random.seed(0)
+    delays = [backoff_delay(attempt, base=0.5, cap=8.0) for attempt in range(10) for _ in range(20)]
+    assert all(0 <= delay <= 8.0 for delay in delays)
+    assert max(backoff_delay(0, base=0.5, cap=8.0) for _ in range(100)) <= 0.5
+    assert backoff_delay(0, retry_after=3.0, base=0.5) == 3.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert 8 <= parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+
+
+def test_acquire_with_no_time_left_raises_and_releases_slot():
+    limiter = CountingLimiter()
+    client = AsyncDeepSeekAPI("test", limiter=limiter, hedge=False)
+
+    async def scenario():
+        for timeout in (0, -1, 1e-9):
+            with pytest.raises(asyncio.TimeoutError):
+                await client._acquire("ask", timeout)
+        assert await client._acquire("ask", 5) > 0
+
+    asyncio.run(scenario())
+    assert limiter.acquired - limiter.released == 1
+
+
+def test_post_with_no_time_left_is_a_timeout():
+    limiter = CountingLimiter()
+    client = AsyncDeepSeekAPI("test", api_url="http://127.0.0.1:9/unused", limiter=limiter, hedge=False)
+
+    async def scenario():
+        try:
+            with pytest.raises(LLMTimeoutError):
+                await client._post("Вопрос", "model-a", 1e-9)
+        finally:
+            await client.close()
+
+    asyncio.run(scenario())
+    assert limiter.acquired == limiter.released
+
+
+def test_parse_rate_limit_reset():
+    assert parse_rate_limit_reset("3") == 3.0
+    assert 4 <= parse_rate_limit_reset(str(int((time.time() + 5) * 1000))) <= 5
+    assert 4 <= parse_rate_limit_reset(str(time.time() + 5)) <= 5
+    assert parse_rate_limit_reset("later") is None and parse_rate_limit_reset(None) is None
+
+
+def test_limiter_allows_burst_then_paces():
+    limiter = AdaptiveRateLimiter(rate=2.0, burst=3)
+    assert [limiter._take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert 0 < limiter._take() <= 0.5
+
+
+def test_limiter_slow_start_then_additive_increase_and_multiplicative_decrease():
+    async def scenario():
+        limiter = AdaptiveRateLimiter(rate=1.0, burst=5, max_rate=20.0, rate_step=0.5, concurrency=4,
+                                      max_concurrency=32, decrease=0.5)
+        for _ in range(3):
+            limiter.record(200)
+        assert limiter.rate == 4.0 and limiter.slots.limit == 7
+
+        limiter.record(429, {"Retry-After": "2"})
+        assert limiter.rate == 2.0 and limiter.slots.limit == 3 and limiter.rate_limited == 1
+        assert 1.9 <= limiter._take() <= 2.0
+
+        limiter.record(200)
+        assert limiter.rate == pytest.approx(2.25)
+        assert limiter.slots.limit == 3
+        for _ in range(2):
+            limiter.record(200)
+        assert limiter.slots.limit == 4
+
+    asyncio.run(scenario())
+
+
+def test_limiter_respects_remaining_header():
+    limiter = AdaptiveRateLimiter(rate=1.0, burst=5)
+    limiter.record(200, {"X-RateLimit-Remaining": "1"})
+    assert limiter._take() == 0.0 and limiter._take() > 0
+
+    limiter = AdaptiveRateLimiter(rate=10.0, burst=5)
+    limiter.record(200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "3"})
+    assert 2.9 <= limiter._take() <= 3.0
+
+
+def test_limiter_concurrency_is_not_resized_outside_event_loop():
+    limiter = AdaptiveRateLimiter(concurrency=4)
+    limiter.record(200)
+    limiter.record(429)
+    assert limiter.slots.limit == 4
+
+
+def test_limiter_gives_slots_by_priority_and_frees_them_on_cancel():
+    async def scenario():
+        limiter = AdaptiveRateLimiter(rate=100.0, burst=10, concurrency=1)
+        order = []
+        await limiter.acquire()
+
+        async def request(name, priority):
+            async with limiter.slot(priority):
+                order.append(name)
+
+        low = asyncio.create_task(request("low", PRIORITY_LOW))
+        cancelled = asyncio.create_task(request("cancelled", PRIORITY_APPLICATION))
+        application = asyncio.create_task(request("application", PRIORITY_APPLICATION))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        limiter.release()
+        await asyncio.gather(low, application, cancelled, return_exceptions=True)
+        return order, limiter.metrics()
+
+    order, metrics = asyncio.run(scenario())
+    assert order == ["application", "low"]
+    assert metrics["in_flight"] == 0 and metrics["waiting"] == 0
@@ -0,0 +1,199 @@
+import asyncio
+
+import agent
+from message_record import MessageRecord
+from scheduler import PrioritySemaphore, ChatScheduler, PRIORITY_APPLICATION, PRIORITY_DEFAULT, PRIORITY_LOW
+
+
+def make_message(chat_id: int, message_id: int, text: str = "Подойдет ли Мерло к сыру?") -> MessageRecord:
+    return MessageRecord.from_dict({"text": text, "user_id": chat_id, "message_id": message_id})
+
+
+def test_priority_semaphore_wakes_highest_priority_first():
+    async def scenario():
+        semaphore = PrioritySemaphore(1)
+        order = []
+        await semaphore.acquire()
+
+        async def waiter(name, priority):
+            await semaphore.acquire(priority)
+            order.append(name)
+            semaphore.release()
+
+        tasks = [asyncio.create_task(waiter(name, priority)) for name, priority in
+                 (("low", PRIORITY_LOW), ("default", PRIORITY_DEFAULT), ("application", PRIORITY_APPLICATION),
+                  ("default-2", PRIORITY_DEFAULT))]
+        await asyncio.sleep(0)
+        assert semaphore.waiting == 4
+        semaphore.release()
+        await asyncio.gather(*tasks)
+        return order, semaphore.in_use
+
+    order, in_use = asyncio.run(scenario())
+    assert order == ["application", "default", "default-2", "low"]
+    assert in_use == 0
+
+
+def test_priority_semaphore_cancelled_waiter_does_not_leak_slot():
+    async def scenario():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire()
+        waiter = asyncio.create_task(semaphore.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        semaphore.release()
+        return semaphore.in_use, semaphore.waiting
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+
+def test_messages_of_one_chat_are_processed_in_order():
+    async def scenario():
+        handled = []
+
+        async def handler(message):
+            await asyncio.sleep(0.01 if message.message_id == 1 else 0)
+            handled.append((message.chat.id, message.message_id))
+
+        scheduler = ChatScheduler(handler, max_concurrency=4)
+        for message_id in range(1, 4):
+            await scheduler.submit(make_message(1, message_id))
+        await scheduler.submit(make_message(2, 1))
+        await scheduler.drain()
+        return handled, scheduler.metrics()
+
+    handled, metrics = asyncio.run(scenario())
+    assert [message_id for chat_id, message_id in handled if chat_id == 1] == [1, 2, 3]
+    assert metrics["processed"] == 4 and metrics["pending"] == 0 and metrics["chats"] == 0
+
+
+def test_overflow_rejects_without_estimating_priority():
+    async def scenario():
+        release = asyncio.Event()
+        estimated, busy = [], []
+
+        async def handler(message):
+            await release.wait()
+
+        async def priority_fn(message):
+            estimated.append(message.message_id)
+            return PRIORITY_DEFAULT
+
+        async def on_overflow(message):
+            busy.append(message.message_id)
+
+        scheduler = ChatScheduler(handler, max_concurrency=1, max_queue_per_chat=2, max_pending=3,
+                                  overflow_policy="busy", priority_fn=priority_fn, on_overflow=on_overflow)
+        accepted = [await scheduler.submit(make_message(1, message_id)) for message_id in range(1, 5)]
+        await asyncio.sleep(0)
+        # Первое сообщение чата 1 уже обрабатывается, в очереди чата одно ожидающее
+        accepted.append(await scheduler.submit(make_message(1, 5)))
+        for chat_id in (2, 3):
+            accepted.append(await scheduler.submit(make_message(chat_id, 1)))
+        metrics = scheduler.metrics()
+        release.set()
+        await scheduler.drain()
+        return accepted, estimated, busy, metrics
+
+    accepted, estimated, busy, metrics = asyncio.run(scenario())
+    assert accepted == [True, True, False, False, True, True, False]
+    assert estimated == [1, 2, 5, 1]
+    assert busy == [3, 4, 1]
+    assert metrics["dropped"] == 3 and metrics["pending"] == 3
+
+
+def test_pending_estimates_count_against_limits():
+    async def scenario():
+        release = asyncio.Event()
+        estimated = []
+
+        async def handler(message):
+            await release.wait()
+
+        async def priority_fn(message):
+            estimated.append(message.chat.id)
+            await asyncio.sleep(0.01)
+            return PRIORITY_DEFAULT
+
+        scheduler = ChatScheduler(handler, max_concurrency=1, max_queue_per_chat=5, max_pending=2,
+                                  priority_fn=priority_fn, overflow_policy="drop")
+        accepted = await asyncio.gather(*(scheduler.submit(make_message(chat_id, 1)) for chat_id in range(4)))
+        pending = scheduler.metrics()["pending"]
+        release.set()
+        await scheduler.drain()
+        return accepted, estimated, pending
+
+    accepted, estimated, pending = asyncio.run(scenario())
+    assert accepted == [True, True, False, False]
+    assert estimated == [0, 1]
+    assert pending <= 2
+
+
+def test_slow_priority_estimate_keeps_chat_order():
+    async def scenario():
+        handled = []
+
+        async def handler(message):
+            handled.append(message.message_id)
+
+        async def priority_fn(message):
+            await asyncio.sleep(0.02 if message.message_id == 1 else 0)
+            return PRIORITY_DEFAULT
+
+        scheduler = ChatScheduler(handler, max_concurrency=4, priority_fn=priority_fn)
+        accepted = await asyncio.gather(*(scheduler.submit(make_message(1, message_id)) for message_id in (1, 2, 3)))
+        await scheduler.drain()
+        return accepted, handled, scheduler.metrics()
+
+    accepted, handled, metrics = asyncio.run(scenario())
+    assert accepted == [True, True, True]
+    assert handled == [1, 2, 3]
+    assert metrics["pending"] == 0 and metrics["chats"] == 0
+
+
+def test_failed_priority_estimate_falls_back_to_default():
+    async def scenario():
+        handled = []
+
+        async def handler(message):
+            handled.append(message.message_id)
+
+        async def priority_fn(message):
+            raise RuntimeError("классификатор недоступен")
+
+        scheduler = ChatScheduler(handler, priority_fn=priority_fn)
+        accepted = await scheduler.submit(make_message(1, 1))
+        await scheduler.drain()
+        return accepted, handled
+
+    assert asyncio.run(scenario()) == (True, [1])
+
+
+def test_priority_label_is_reused_by_the_graph(monkeypatch):
+    class CountingClassifier:
+        def __init__(self):
+            self.calls = 0
+
+        def classify(self, text):
+            self.calls += 1
+            return "спам"
+
+    classifier = CountingClassifier()
+    monkeypatch.setattr(agent, "preclassifier", classifier)
+    monkeypatch.setattr(agent.RAG, "is_ready", lambda: True)
+    message = make_message(10, 1, "Купи подписчиков дешево")
+
+    async def scenario():
+        priority = await agent.estimate_priority(message)
+        response = await agent.run_agent(message)
+        return priority, response
+
+    priority, response = asyncio.run(scenario())
+    assert priority == PRIORITY_LOW
+    assert response == agent.SPAM_RESPONSE
+    assert classifier.calls == 1
+    assert not agent._local_labels
+
+    asyncio.run(agent.run_agent(make_message(10, 2, "Еще одно сообщение")))
+    assert classifier.calls == 2
@@ -0,0 +1,141 @@
+import json
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText
+
+import RAG
+import bot
+from DeepSeekR1 import AsyncDeepSeekAPI
+from resilience import LLMEmptyResponseError, LLMConnectionError
+
+ROUTE = "/api/v1/chat/completions"
+ROUTES = {"ask_stream": {"models": ["model-a", "model-b"], "max_tokens": None, "budget": 10.0, "timeout": 10,
+                         "reasoning": False}}
+
+
+def sse(delta: dict) -> bytes:
+    return f"data: {json.dumps({'choices': [{'delta': delta}]}, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def stream_answer(events: list, done: bool = True, requests: list = None) -> list:
+    """
+    Запускает сервер, который на каждый потоковый запрос отдает events, и читает ответ ask_stream
+
+    Returns:
+        list: полученные фрагменты; модели запросов дописываются в requests
+    """
+    requests = [] if requests is None else requests
+
+    async def handle(request):
+        requests.append((await request.json())["model"])
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for event in events:
+            await response.write(sse(event))
+        if done:
+            await response.write(b"data: [DONE]\n\n")
+        return response
+
+    app = web.Application()
+    app.router.add_post(ROUTE, handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    client = AsyncDeepSeekAPI("test", api_url=f"http://127.0.0.1:{runner.addresses[0][1]}{ROUTE}", max_retries=0,
+                              hedge=False, routes=ROUTES)
+    try:
+        return [token async for token in client.ask_stream("Вопрос")]
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+def test_stream_with_answer():
+    requests = []
+    tokens = asyncio.run(stream_answer([{"reasoning": "думаю"}, {"content": "Мерло "}, {"content": "да"}],
+                                       requests=requests))
+    assert tokens == ["Мерло ", "да"]
+    assert requests == ["model-a"]
+
+
+@pytest.mark.parametrize("events", [[], [{"reasoning": "только рассуждения"}], [{"content": "\n"}]])
+def test_empty_stream_is_an_error(events):
+    with pytest.raises(LLMEmptyResponseError):
+        asyncio.run(stream_answer(events))
+
+
+def test_empty_stream_falls_back_to_next_model():
+    requests = []
+    with pytest.raises(LLMEmptyResponseError):
+        asyncio.run(stream_answer([], requests=requests))
+    assert requests == ["model-a", "model-b"]
+
+
+def test_stream_closed_before_done_is_an_error():
+    with pytest.raises(LLMConnectionError):
+        asyncio.run(stream_answer([{"content": "Мерло "}], done=False))
+
+
+def test_empty_answer_is_not_cached(monkeypatch):
+    stored = []
+
+    class StubCache:
+        def put(self, question, embedding, response):
+            stored.append(response)
+
+    monkeypatch.setattr(RAG, "_answer_cache", StubCache())
+    RAG._store_answer("Вопрос", [0.0], "")
+    RAG._store_answer("Вопрос", [0.0], "Ответ")
+    assert stored == ["Ответ"]
+
+
+class FakeReply:
+    def __init__(self, chat: "FakeChat", rate_limited: int):
+        self.chat = chat
+        self.rate_limited = rate_limited
+
+    async def edit_text(self, text: str):
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise TelegramRetryAfter(EditMessageText(text=text), "Too Many Requests", retry_after=0)
+        self.chat.edits.append(text)
+
+
+class FakeChat:
+    """
+    Сообщение пользователя: запоминает отправленные ответы и правки, правки первые rate_limited раз
+    отклоняются с TelegramRetryAfter
+    """
+    def __init__(self, rate_limited: int = 0):
+        self.rate_limited = rate_limited
+        self.answers, self.edits = [], []
+
+    async def answer(self, text: str) -> FakeReply:
+        self.answers.append(text)
+        return FakeReply(self, self.rate_limited)
+
+
+async def stream_reply(chat: FakeChat, tokens: list, response: str):
+    reply = bot.StreamingReply(chat, interval=0)
+    for token in tokens:
+        await reply.on_token(token)
+    await reply.finish(response)
+
+
+@pytest.mark.parametrize("rate_limited", [1, 2])
+def test_final_edit_waits_out_rate_limits(rate_limited):
+    chat = FakeChat(rate_limited=rate_limited)
+    asyncio.run(stream_reply(chat, ["Мерло"], "Мерло подойдет"))
+    assert chat.answers == ["Мерло …"]
+    assert chat.edits == ["Мерло подойдет"]
+
+
+def test_final_answer_is_sent_when_edit_keeps_failing():
+    chat = FakeChat(rate_limited=bot.STREAM_FINAL_EDIT_ATTEMPTS)
+    asyncio.run(stream_reply(chat, ["Мерло"], "Мерло подойдет"))
+    assert chat.answers == ["Мерло …", "Мерло подойдет"]
+    assert chat.edits == []
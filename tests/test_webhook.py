@@ -0,0 +1,97 @@
+import signal
+
+import webhook
+from webhook import RestartPolicy, SERVICE_KEY
+
+
+def test_restart_delay_grows_for_crash_loops_and_resets_after_stable_run():
+    policy = RestartPolicy(delay=1.0, max_delay=8.0, stable=60.0)
+    policy.started(0, now=0.0)
+    delays = []
+    for now in (1.0, 3.0, 7.0, 15.0, 30.0):
+        delays.append(policy.next_delay(0, now=now))
+        policy.started(0, now=now)
+    assert delays == [1.0, 2.0, 4.0, 8.0, 8.0]
+
+    assert policy.next_delay(0, now=200.0) == 1.0
+    assert policy.next_delay(SERVICE_KEY, now=200.0) == 1.0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeProcess:
+    def __init__(self, name):
+        self.name = name
+        self.sentinel = name
+        self.pid = -1
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.exitcode is None
+
+    def terminate(self):
+        self.exitcode = self.exitcode if self.exitcode is not None else -15
+
+    def join(self):
+        pass
+
+
+def test_run_restarts_with_delay_and_ignores_dead_service_while_stopping(monkeypatch):
+    clock = FakeClock()
+    started, waits, handlers = [], [], {}
+
+    def start_worker(context, index, host, port):
+        started.append(f"webhook-{index}")
+        return FakeProcess(f"webhook-{index}")
+
+    def start_embedding_service(context, socket_path):
+        started.append("embeddings")
+        return FakeProcess("embeddings")
+
+    processes = {}
+
+    def fake_wait(sentinels, timeout=None):
+        waits.append((list(sentinels), timeout))
+        step = len(waits)
+        live = {name: process for name, process in processes.items() if process.is_alive()}
+        if step == 1:
+            # Сервис и процесс webhook падают сразу после запуска
+            live["embeddings"].exitcode = 1
+            live["webhook-0"].exitcode = 1
+        elif step == 2:
+            clock.now += timeout
+        elif step == 3:
+            handlers[signal.SIGTERM](signal.SIGTERM, None)
+            # При остановке сервис завершается раньше, чем процесс webhook дорабатывает сообщения
+            live["embeddings"].exitcode = 0
+        elif step == 4:
+            live["webhook-0"].exitcode = 0
+        else:
+            raise AssertionError("цикл ожидания крутится вхолостую")
+
+    def track(start):
+        def wrapper(*args):
+            process = start(*args)
+            processes[process.name] = process
+            return process
+        return wrapper
+
+    monkeypatch.setattr(webhook, "time", clock)
+    monkeypatch.setattr(webhook, "wait", fake_wait)
+    monkeypatch.setattr(webhook, "start_worker", track(start_worker))
+    monkeypatch.setattr(webhook, "start_embedding_service", track(start_embedding_service))
+    monkeypatch.setattr(webhook.signal, "signal", lambda signum, handler: handlers.__setitem__(signum, handler))
+    monkeypatch.setattr(webhook.os, "kill", lambda pid, signum: None)
+    monkeypatch.delenv("EMBEDDING_SERVICE_SOCKET", raising=False)
+
+    webhook.run(1, "127.0.0.1", 0, "/tmp/test-embeddings.sock")
+
+    assert started == ["embeddings", "webhook-0", "webhook-0", "embeddings"]
+    assert waits[1] == ([], 1.0)
+    assert waits[3] == (["webhook-0"], None)
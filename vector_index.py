@@ -0,0 +1,153 @@
+import os
+import json
+
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.json"
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Приводит строки матрицы к единичной норме
+
+    Args:
+        matrix (ndarray): матрица векторов
+
+    Returns:
+        ndarray: матрица float32 со строками единичной нормы
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class NumpyVectorIndex:
+    """
+    Векторный индекс в памяти процесса: нормализованные эмбеддинги чанков лежат
+    в отображаемой в память матрице float32, тексты и метаданные - в соседнем
+    JSON-файле. Поиск top-k - одно матричное умножение
+    """
+    def __init__(self, matrix: np.ndarray, records: list, version: str = None):
+        """
+        Args:
+            matrix (ndarray): матрица нормализованных эмбеддингов (n, dim)
+            records (list): записи {"id", "text", "metadata"} в порядке строк матрицы
+            version (str): версия базы знаний, из которой построен индекс
+
+        Returns:
+            None
+        """
+        self.matrix = matrix
+        self.records = records
+        self.version = version
+
+    def __len__(self):
+        """
+        Returns:
+            int: количество чанков в индексе
+        """
+        return len(self.records)
+
+    @classmethod
+    def build(cls, directory: str, ids, embeddings, texts, metadatas, version: str = None):
+        """
+        Сохраняет индекс на диск. Файлы пишутся во временные и затем атомарно
+        подменяются, чтобы читающие процессы не увидели половину индекса
+
+        Args:
+            directory (str): каталог индекса
+            ids (list): идентификаторы чанков
+            embeddings (list): эмбеддинги чанков
+            texts (list): тексты чанков
+            metadatas (list): метаданные чанков
+            version (str): версия базы знаний
+
+        Returns:
+            NumpyVectorIndex: построенный индекс
+        """
+        os.makedirs(directory, exist_ok=True)
+        matrix = normalize_rows(embeddings) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+        records = [
+            {"id": chunk_id, "text": text, "metadata": metadata or {}}
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+
+        embeddings_path = os.path.join(directory, EMBEDDINGS_FILE)
+        with open(f"{embeddings_path}.tmp", "wb") as file:
+            np.save(file, matrix)
+        metadata_path = os.path.join(directory, METADATA_FILE)
+        with open(f"{metadata_path}.tmp", "w", encoding="utf-8") as file:
+            json.dump({"version": version, "records": records}, file, ensure_ascii=False)
+        os.replace(f"{embeddings_path}.tmp", embeddings_path)
+        os.replace(f"{metadata_path}.tmp", metadata_path)
+        return cls(matrix, records, version)
+
+    @classmethod
+    def load(cls, directory: str):
+        """
+        Загружает индекс, отображая матрицу эмбеддингов в память
+
+        Args:
+            directory (str): каталог индекса
+
+        Returns:
+            NumpyVectorIndex: загруженный индекс
+        """
+        matrix = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        with open(os.path.join(directory, METADATA_FILE), "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+        return cls(matrix, metadata["records"], metadata.get("version"))
+
+    @staticmethod
+    def read_version(directory: str):
+        """
+        Возвращает версию базы знаний, из которой построен индекс
+
+        Args:
+            directory (str): каталог индекса
+
+        Returns:
+            str: версия или None, если индекса нет
+        """
+        try:
+            with open(os.path.join(directory, METADATA_FILE), "r", encoding="utf-8") as file:
+                return json.load(file).get("version")
+        except (OSError, ValueError):
+            return None
+
+    def search_batch(self, vectors, k: int):
+        """
+        Находит k ближайших чанков для каждого запроса одним умножением матриц
+
+        Args:
+            vectors (list): эмбеддинги запросов (m, dim)
+            k (int): количество результатов на запрос
+
+        Returns:
+            list: для каждого запроса список пар (косинусная близость, запись) по убыванию близости
+        """
+        if not self.records:
+            return [[] for _ in vectors]
+        queries = normalize_rows(np.atleast_2d(vectors))
+        scores = queries @ self.matrix.T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(scores, top):
+            ordered = candidates[np.argsort(-row[candidates])]
+            results.append([(float(row[i]), self.records[i]) for i in ordered])
+        return results
+
+    def search(self, vector, k: int):
+        """
+        Находит k ближайших чанков для одного запроса
+
+        Args:
+            vector (list): эмбеддинг запроса
+            k (int): количество результатов
+
+        Returns:
+            list: пары (косинусная близость, запись) по убыванию близости
+        """
+        return self.search_batch([vector], k)[0]
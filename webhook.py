@@ -0,0 +1,307 @@
+import os
+import time
+import signal
+import asyncio
+import argparse
+import multiprocessing
+from multiprocessing.connection import wait
+
+from config import (WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_WORKERS,
+                    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_SHUTDOWN_TIMEOUT, UPDATE_DEDUP_TTL_HOURS, WEBHOOK_RESTART_DELAY,
+                    WEBHOOK_RESTART_MAX_DELAY, WEBHOOK_RESTART_STABLE)
+
+# Ключ сервиса эмбеддингов в RestartPolicy и расписании перезапусков (процессы webhook - по номеру)
+SERVICE_KEY = "embeddings"
+
+
+def build_app():
+    """
+    Собирает aiohttp-приложение, принимающее обновления Telegram на WEBHOOK_PATH.
+    Обработчик отвечает Telegram после того, как обновление прошло проверку на повтор
+    и поставлено в очередь планировщика, поэтому ответ не ждет работы агента
+
+    Returns:
+        Application: приложение aiohttp
+    """
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    from agent import db
+    from bot import bot, dp, deduplicate_updates
+
+    dp.update.outer_middleware(deduplicate_updates)
+    app = web.Application()
+    # Порядок важен: при остановке сначала дренируется планировщик (dp.shutdown),
+    # и только потом обработчик webhook закрывает HTTP-сессию бота
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=False,
+                         secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+
+    async def prune(app):
+        # Выполняется после dp.startup, когда подключение к базе уже открыто
+        try:
+            removed = await db.prune_updates(UPDATE_DEDUP_TTL_HOURS)
+            print(f"Удалено устаревших update_id: {removed}")
+        except Exception as e:
+            print(f"Не удалось очистить processed_updates: {e}")
+
+    async def health(request):
+        return web.Response(text="ok")
+
+    app.on_startup.append(prune)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+def serve_worker(host: str, port: int):
+    """
+    Запускает один процесс webhook. Все процессы слушают один порт (SO_REUSEPORT),
+    ядро распределяет между ними соединения. По SIGTERM/SIGINT процесс перестает
+    принимать соединения, дожидается обработки принятых сообщений и записи заявок
+
+    Args:
+        host (str): адрес
+        port (int): порт
+
+    Returns:
+        None
+    """
+    from aiohttp import web
+
+    # Свой группе процессов Ctrl+C в терминале не приходит: остановкой управляет главный процесс
+    os.setpgrp()
+    web.run_app(build_app(), host=host, port=port, reuse_port=True, shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT,
+                print=None, access_log=None)
+
+
+async def set_webhook():
+    """
+    Регистрирует адрес webhook в Telegram. Выполняется один раз главным процессом
+
+    Returns:
+        None
+    """
+    from bot import create_bot, dp
+
+    bot = create_bot()
+    try:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        print(f"Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    finally:
+        await bot.session.close()
+
+
+def start_worker(context, index: int, host: str, port: int):
+    """
+    Запускает процесс webhook с номером index. Номер передается через окружение,
+    так как config читается при импорте в новом процессе
+
+    Args:
+        context (BaseContext): контекст multiprocessing
+        index (int): номер процесса
+        host (str): адрес
+        port (int): порт
+
+    Returns:
+        Process: запущенный процесс
+    """
+    os.environ["WORKER_INDEX"] = str(index)
+    try:
+        process = context.Process(target=serve_worker, args=(host, port), name=f"webhook-{index}")
+        process.start()
+    finally:
+        os.environ.pop("WORKER_INDEX", None)
+    print(f"Процесс webhook-{index} запущен, pid {process.pid}")
+    return process
+
+
+def serve_embeddings(socket_path: str):
+    """
+    Запускает общий сервис эмбеддингов в отдельной группе процессов: он должен
+    пережить Ctrl+C, пока процессы webhook дорабатывают сообщения
+
+    Args:
+        socket_path (str): путь к Unix-сокету сервиса
+
+    Returns:
+        None
+    """
+    from embedding_service import serve
+
+    os.setpgrp()
+    serve(socket_path)
+
+
+def start_embedding_service(context, socket_path: str):
+    """
+    Запускает общий сервис эмбеддингов: модель загружается один раз, а не в каждом процессе webhook
+
+    Args:
+        context (BaseContext): контекст multiprocessing
+        socket_path (str): путь к Unix-сокету сервиса
+
+    Returns:
+        Process: запущенный процесс
+    """
+    process = context.Process(target=serve_embeddings, args=(socket_path,), name="embeddings")
+    process.start()
+    print(f"Сервис эмбеддингов запущен, pid {process.pid}")
+    return process
+
+
+class RestartPolicy:
+    """
+    Паузы перед перезапуском упавших процессов: процесс, который падает сразу после
+    запуска (ошибка конфигурации, порт занят), перезапускается все реже, а не в цикле
+    """
+    def __init__(self, delay: float = WEBHOOK_RESTART_DELAY, max_delay: float = WEBHOOK_RESTART_MAX_DELAY,
+                 stable: float = WEBHOOK_RESTART_STABLE):
+        """
+        Args:
+            delay (float): пауза после первого падения, в секундах
+            max_delay (float): максимальная пауза
+            stable (float): после стольких секунд работы счетчик падений сбрасывается
+
+        Returns:
+            None
+        """
+        self.delay = delay
+        self.max_delay = max_delay
+        self.stable = stable
+        self._started = {}
+        self._failures = {}
+
+    def started(self, key, now: float = None):
+        """
+        Отмечает запуск процесса
+
+        Args:
+            key: номер процесса webhook или SERVICE_KEY
+            now (float): время запуска (для проверок), по умолчанию time.monotonic()
+
+        Returns:
+            None
+        """
+        self._started[key] = time.monotonic() if now is None else now
+
+    def next_delay(self, key, now: float = None) -> float:
+        """
+        Учитывает падение процесса и возвращает паузу перед его перезапуском
+
+        Args:
+            key: номер процесса webhook или SERVICE_KEY
+            now (float): время падения (для проверок), по умолчанию time.monotonic()
+
+        Returns:
+            float: пауза в секундах
+        """
+        now = time.monotonic() if now is None else now
+        if now - self._started.get(key, now) >= self.stable:
+            self._failures[key] = 0
+        failures = self._failures.get(key, 0) + 1
+        self._failures[key] = failures
+        return min(self.max_delay, self.delay * 2 ** (failures - 1))
+
+
+def run(workers: int, host: str, port: int, embedding_socket: str = None):
+    """
+    Запускает процессы webhook и перезапускает упавшие с паузой (RestartPolicy).
+    SIGTERM/SIGINT передается всем процессам, главный процесс дожидается их корректного
+    завершения. Сервис эмбеддингов, если он включен, останавливается последним
+
+    Args:
+        workers (int): количество процессов
+        host (str): адрес
+        port (int): порт
+        embedding_socket (str): путь к сокету общего сервиса эмбеддингов или None
+
+    Returns:
+        None
+    """
+    context = multiprocessing.get_context("spawn")
+    policy = RestartPolicy()
+    service = None
+    if embedding_socket:
+        # Процессы webhook наследуют окружение и подключаются к сервису, дожидаясь загрузки модели
+        os.environ["EMBEDDING_SERVICE_SOCKET"] = embedding_socket
+        service = start_embedding_service(context, embedding_socket)
+        policy.started(SERVICE_KEY)
+    processes = {}
+    for index in range(workers):
+        processes[index] = start_worker(context, index, host, port)
+        policy.started(index)
+    # Ключ процесса -> время перезапуска по time.monotonic()
+    restarts = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        print("Остановка: процессы webhook дорабатывают принятые сообщения")
+        for process in processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while processes or (restarts and not stopping):
+        if not stopping:
+            now = time.monotonic()
+            for key in [key for key, restart_at in restarts.items() if restart_at <= now]:
+                del restarts[key]
+                if key == SERVICE_KEY:
+                    service = start_embedding_service(context, embedding_socket)
+                else:
+                    processes[key] = start_worker(context, key, host, port)
+                policy.started(key)
+
+        # Завершившийся процесс остается в списке ожидания, только пока его не обработали ниже:
+        # wait() сразу возвращает sentinel мертвого процесса, и цикл крутился бы вхолостую
+        sentinels = [process.sentinel for process in processes.values()]
+        if service is not None and service.is_alive():
+            sentinels.append(service.sentinel)
+        timeout = max(0.0, min(restarts.values()) - time.monotonic()) if restarts and not stopping else None
+        wait(sentinels, timeout)
+
+        for index, process in list(processes.items()):
+            if process.is_alive():
+                continue
+            del processes[index]
+            if not stopping:
+                delay = policy.next_delay(index)
+                print(f"Процесс webhook-{index} завершился с кодом {process.exitcode}, "
+                      f"перезапуск через {delay:.0f} s")
+                restarts[index] = time.monotonic() + delay
+        if service is not None and not service.is_alive() and SERVICE_KEY not in restarts and not stopping:
+            delay = policy.next_delay(SERVICE_KEY)
+            print(f"Сервис эмбеддингов завершился с кодом {service.exitcode}, перезапуск через {delay:.0f} s")
+            restarts[SERVICE_KEY] = time.monotonic() + delay
+    if service is not None:
+        service.terminate()
+        service.join()
+    print("Все процессы webhook остановлены")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бот в режиме webhook с несколькими процессами")
+    parser.add_argument("--workers", type=int, default=WEBHOOK_WORKERS)
+    parser.add_argument("--host", default=WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument("--no-set-webhook", action="store_true",
+                        help="не регистрировать адрес в Telegram (локальная проверка)")
+    parser.add_argument("--embedding-service", metavar="SOCKET", nargs="?", const="/tmp/wine-embeddings.sock",
+                        help="загрузить модель эмбеддингов один раз в общем сервисе на этом Unix-сокете")
+    args = parser.parse_args()
+
+    if not args.no_set_webhook:
+        if not WEBHOOK_URL:
+            parser.error("задайте WEBHOOK_URL или запустите с --no-set-webhook")
+        asyncio.run(set_webhook())
+    run(args.workers, args.host, args.port, args.embedding_service)